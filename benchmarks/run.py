@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from file_loader.xltek_loader import XltekLoader
+from file_loader.file_types.erd_file import ERDLoader
+from file_loader.file_types.ent_file import ENTLoader
+from file_loader.file_types.etc_file import ETCLoader
+from file_loader.utils.key_tree_parser import parse_key_tree, LazyKeyTree
+from file_loader.utils.raw_data_packet import RawDataObject
+from file_loader.utils.synthetic import write_study
+
+"""
+Benchmarks of the hot paths of the loader on synthetic studies.
+
+    python -m benchmarks.run [--size small|medium|large] [--repeat N]
+                             [--save results.json] [--compare results.json]
+
+Run from the root of the repository. Each benchmark reports its best time
+over --repeat runs, with the throughput in MB/s of input and in samples/s
+(channel values). With --compare, the ratio to the throughput of an
+earlier --save run is shown, so regressions stand out.
+"""
+
+# Synthetic studies per size, see write_study. Headbox 1 names 32
+# channels, the medium study has AUX channels at lower rates.
+sizes = {
+    'small': dict(duration=60, num_files=2, notes_per_minute=20),
+    'medium': dict(duration=900, num_files=4, notes_per_minute=20,
+                   frequency_factor={20: 2, 21: 2, 22: 4, 23: 4}),
+    'large': dict(duration=3600, num_files=8, notes_per_minute=20),
+}
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def study_files(path, suffix):
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(suffix))
+
+
+def count_samples(erd_loaders):
+    # Channel values decoded from the packets of the .erd files
+    num_samples = 0
+    for erd_loader in erd_loaders:
+        buf = erd_loader.open_buffer()
+        o = RawDataObject(erd_loader)
+        buf.cursor = erd_loader.data['data_packets'].data_offset
+        o.load_file(buf)
+        buf.close()
+        num_samples += len(o.packets.values)
+    return num_samples
+
+
+def erd_headers(path):
+    erd_loaders = []
+    for f in study_files(path, '.erd'):
+        erd_loader = ERDLoader(f)
+        erd_loader.load_header()
+        erd_loaders.append(erd_loader)
+    return erd_loaders
+
+
+def bench_load_file(path, repeat):
+    # Packet decoding of every .erd file, without the headers
+    erd_loaders = erd_headers(path)
+    buffers = [erd_loader.open_buffer() for erd_loader in erd_loaders]
+
+    def run():
+        for erd_loader, buf in zip(erd_loaders, buffers):
+            data_offset = erd_loader.data['data_packets'].data_offset
+            buf.cursor = data_offset
+            RawDataObject(erd_loader, data_offset=data_offset).load_file(buf)
+
+    num_bytes = sum(
+        len(buf.s) - erd_loader.data['data_packets'].data_offset
+        for erd_loader, buf in zip(erd_loaders, buffers)
+    )
+    seconds = best_time(run, repeat)
+    for buf in buffers:
+        buf.close()
+    return seconds, num_bytes, count_samples(erd_loaders)
+
+
+def bench_combine_files(path, repeat):
+    loader = XltekLoader(path, load_video=False)
+    loader.read()
+    ret = loader.combine_files()
+    num_bytes = ret['EEGData'].nbytes
+    return best_time(loader.combine_files, repeat), num_bytes, ret['EEGData'][:-1].size
+
+
+def bench_parse_key_tree(path, repeat):
+    # The note texts of the .ent file, parsed one by one
+    ent_loader = ENTLoader(study_files(path, '.ent')[0])
+    ent_loader.lazy_notes = True
+    ent_loader.load()
+    texts = [
+        tree.text for tree in ent_loader.data['note_packets']['note_key_tree']
+        if isinstance(tree, LazyKeyTree)
+    ]
+
+    def run():
+        for text in texts:
+            parse_key_tree(text)
+
+    return best_time(run, repeat), sum(len(text) for text in texts), len(texts)
+
+
+def bench_repeat_sections(path, repeat):
+    # repeat: sections, fixed size records (.etc) and variable size (.ent)
+    files = [(ETCLoader, f) for f in study_files(path, '.etc')] \
+        + [(ENTLoader, f) for f in study_files(path, '.ent')]
+
+    def run():
+        for loader_type, f in files:
+            loader_type(f).load()
+
+    num_records = 0
+    for loader_type, f in files:
+        file_loader = loader_type(f)
+        file_loader.load()
+        section = 'table_of_content' if loader_type is ETCLoader else 'note_packets'
+        num_records += len(next(iter(file_loader.data[section].values())))
+    return best_time(run, repeat), sum(os.path.getsize(f) for _, f in files), num_records
+
+
+def bench_load(path, repeat):
+    def run():
+        XltekLoader(path, load_video=False).load()
+
+    num_bytes = sum(os.path.getsize(f) for f in study_files(path, ''))
+    return best_time(run, repeat), num_bytes, count_samples(erd_headers(path))
+
+
+# name -> (function, unit of the item count)
+benchmarks = {
+    'RawDataObject.load_file': (bench_load_file, 'samples'),
+    'combine_files': (bench_combine_files, 'samples'),
+    'parse_key_tree': (bench_parse_key_tree, 'notes'),
+    'repeat sections': (bench_repeat_sections, 'records'),
+    'XltekLoader.load': (bench_load, 'samples'),
+}
+
+
+def run_benchmarks(path, repeat=3, names=None, log=print):
+    """
+    Run the benchmarks on the study at path. Returns {name: result}.
+    """
+    results = {}
+    for name, (func, unit) in benchmarks.items():
+        if names and name not in names:
+            continue
+        seconds, num_bytes, num_items = func(path, repeat)
+        results[name] = {
+            'seconds': seconds,
+            'bytes': num_bytes,
+            'items': num_items,
+            'unit': unit,
+            'mb_per_second': num_bytes / 1e6 / seconds,
+            'items_per_second': num_items / seconds
+        }
+        log('{:<26} {:9.4f} s {:10.1f} MB/s {:14.0f} {}/s'.format(
+            name, seconds, results[name]['mb_per_second'],
+            results[name]['items_per_second'], unit
+        ))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run',
+        description='Benchmark the loader on a synthetic study.'
+    )
+    parser.add_argument('--size', choices=sorted(sizes), default='small')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--study', help='existing study directory to use instead')
+    parser.add_argument('--only', action='append', choices=sorted(benchmarks),
+                        help='run only this benchmark (can be repeated)')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    tmp_dir = None
+    path = args.study
+    if path is None:
+        tmp_dir = tempfile.mkdtemp(prefix='neuroworks_bench_')
+        path = os.path.join(tmp_dir, 'study')
+        write_study(path, **sizes[args.size])
+        print('Synthetic {} study: {:.1f} MB'.format(
+            args.size, sum(os.path.getsize(f) for f in study_files(path, '')) / 1e6
+        ))
+
+    try:
+        results = run_benchmarks(path, args.repeat, args.only)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = json.load(f)
+        print('Throughput relative to {}:'.format(args.compare))
+        for name, result in results.items():
+            if name in before:
+                print('{:<26} {:6.2f}x'.format(
+                    name, result['items_per_second'] / before[name]['items_per_second']
+                ))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
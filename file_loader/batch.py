@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .xltek_loader import XltekLoader, scan_headers
+from .utils.export import writers
+from .utils.template_plan import warm_templates
+
+"""
+Batch ingestion of a tree of NeuroWorks studies.
+
+    python -m file_loader.batch ROOT --out OUT --workers N
+
+Every directory under ROOT holding .eeg and .erd files is a study. The
+studies are exported (see XltekLoader.export) in a pool of worker
+processes, largest first by the size of their .erd files. Each worker
+compiles the data templates once and reuses them for all its studies.
+
+OUT/manifest.jsonl gets one line per finished study, with its status
+('done' or 'failed'), output path, size, time and error. Studies already
+done are skipped when the batch is run again, so an interrupted run just
+continues. Outputs are written under a temporary name and only renamed
+once complete.
+
+With --catalog, the studies are not exported. Instead OUT/catalog.jsonl
+gets the header summary of each study (see XltekLoader.scan_headers),
+which only reads a few kilobytes per study.
+"""
+
+MANIFEST = 'manifest.jsonl'
+CATALOG = 'catalog.jsonl'
+
+# Output file extension by export format
+extensions = {'zarr': '.zarr', 'hdf5': '.h5'}
+
+
+def find_studies(root):
+    """
+    (study directory, total .erd size) of every study under root.
+    """
+    studies = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        extensions_found = {os.path.splitext(f)[1] for f in file_names}
+        if '.eeg' in extensions_found and '.erd' in extensions_found:
+            size = sum(
+                os.path.getsize(os.path.join(dir_path, f))
+                for f in file_names if f.endswith('.erd')
+            )
+            studies.append((dir_path, size))
+    return studies
+
+
+def read_manifest(out_dir):
+    """
+    Last manifest entry of each study.
+    """
+    entries = dict()
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.isfile(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Line cut off by an interrupted run
+                continue
+            entries[entry['study']] = entry
+    return entries
+
+
+def output_path(root, study_dir, out_dir, format):
+    rel = os.path.relpath(study_dir, root)
+    if rel == '.':
+        rel = os.path.basename(os.path.abspath(study_dir))
+    return os.path.join(out_dir, 'studies', rel + extensions[format])
+
+
+def ingest_study(study_dir, out_path, format='zarr', loader_options={}, export_options={}):
+    """
+    Export one study. Task of the worker processes, returns its manifest
+    entry.
+    """
+    start = time.time()
+    entry = {'study': study_dir, 'output': out_path}
+    partial_path = out_path + '.partial'
+    try:
+        if os.path.isdir(partial_path):
+            shutil.rmtree(partial_path)
+        elif os.path.exists(partial_path):
+            os.remove(partial_path)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+        XltekLoader(study_dir, **loader_options).export(
+            partial_path, format=format, **export_options
+        )
+
+        if os.path.isdir(out_path):
+            shutil.rmtree(out_path)
+        os.replace(partial_path, out_path)
+        entry['status'] = 'done'
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = '{}: {}'.format(type(e).__name__, e)
+        entry['traceback'] = traceback.format_exc()
+    entry['seconds'] = time.time() - start
+    return entry
+
+
+def catalog_study(study_dir):
+    """
+    Catalog entry of one study. Task of the worker processes.
+    """
+    entry = {'study': study_dir}
+    try:
+        entry.update(scan_headers(study_dir))
+        entry['status'] = 'done'
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = '{}: {}'.format(type(e).__name__, e)
+    return entry
+
+
+def write_catalog(root, out_dir, workers=1, log=print):
+    """
+    Write the catalog entry of every study under root to
+    OUT/catalog.jsonl. Returns the number of failed studies.
+    """
+    studies = [study_dir for study_dir, _ in find_studies(os.path.abspath(root))]
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.time()
+    num_failed = 0
+    with ProcessPoolExecutor(workers, initializer=warm_templates) as executor, \
+            open(os.path.join(out_dir, CATALOG), 'w') as f:
+        for entry in executor.map(catalog_study, studies, chunksize=16):
+            f.write(json.dumps(entry) + '\n')
+            if entry['status'] == 'failed':
+                num_failed += 1
+                log('failed {}: {}'.format(entry['study'], entry['error']))
+    log('{} studies catalogued, {} failed in {:.1f} s'.format(
+        len(studies), num_failed, time.time() - start
+    ))
+    return num_failed
+
+
+class BatchRun:
+    def __init__(self, root, out_dir, workers=1, format='zarr', retry_failed=False,
+                 loader_options={}, export_options={}):
+        """
+        loader_options are passed to XltekLoader, export_options to
+        XltekLoader.export.
+        """
+        if format not in writers:
+            raise ValueError("Unknown export format '{}'".format(format))
+        # Absolute, so the manifest matches however ROOT is given
+        self.root = os.path.abspath(root)
+        self.out_dir = out_dir
+        self.workers = workers
+        self.format = format
+        self.retry_failed = retry_failed
+        self.loader_options = loader_options
+        self.export_options = export_options
+
+        os.makedirs(out_dir, exist_ok=True)
+        self.manifest = read_manifest(out_dir)
+
+        # End a line cut off by an interrupted run, so the next entry
+        # starts on its own line
+        path = os.path.join(out_dir, MANIFEST)
+        if os.path.isfile(path) and os.path.getsize(path):
+            with open(path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    def pending(self):
+        """
+        (study directory, .erd size) of the studies still to do, largest
+        first.
+        """
+        skip = {'done', 'failed'} if not self.retry_failed else {'done'}
+        studies = [
+            (study_dir, size) for study_dir, size in find_studies(self.root)
+            if self.manifest.get(study_dir, {}).get('status') not in skip
+        ]
+        studies.sort(key=lambda study: -study[1])
+        return studies
+
+    def record(self, entry):
+        # One line per study, flushed so an interrupted run keeps it
+        self.manifest[entry['study']] = entry
+        with open(os.path.join(self.out_dir, MANIFEST), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def run(self, log=print):
+        """
+        Export all pending studies. Returns the throughput summary.
+        """
+        studies = self.pending()
+        sizes = dict(studies)
+        log('{} studies to do, {:.1f} MB of .erd files'.format(
+            len(studies), sum(sizes.values()) / 1e6
+        ))
+
+        start = time.time()
+        num_done = num_failed = done_bytes = 0
+
+        # Workers inherit or compile the templates once, not per study
+        warm_templates()
+        with ProcessPoolExecutor(self.workers, initializer=warm_templates) as executor:
+            futures = [
+                executor.submit(
+                    ingest_study, study_dir,
+                    output_path(self.root, study_dir, self.out_dir, self.format),
+                    self.format, self.loader_options, self.export_options
+                )
+                for study_dir, _ in studies
+            ]
+            for future in as_completed(futures):
+                entry = future.result()
+                entry['bytes'] = sizes[entry['study']]
+                self.record(entry)
+
+                if entry['status'] == 'done':
+                    num_done += 1
+                    done_bytes += entry['bytes']
+                else:
+                    num_failed += 1
+                elapsed = time.time() - start
+                log('[{}/{}] {} {} ({:.1f} s) - {:.1f} studies/hour, {:.2f} MB/s'.format(
+                    num_done + num_failed, len(studies), entry['status'], entry['study'],
+                    entry['seconds'], num_done * 3600 / elapsed, done_bytes / 1e6 / elapsed
+                ))
+                if entry['status'] == 'failed':
+                    log('    ' + entry['error'])
+
+        elapsed = time.time() - start
+        summary = {
+            'done': num_done,
+            'failed': num_failed,
+            'seconds': elapsed,
+            'studies_per_hour': num_done * 3600 / elapsed if elapsed else 0.,
+            'bytes_per_second': done_bytes / elapsed if elapsed else 0.
+        }
+        log('{done} done, {failed} failed in {seconds:.1f} s: {studies_per_hour:.1f} '
+            'studies/hour, {bytes_per_second:.0f} bytes/s'.format(**summary))
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m file_loader.batch',
+        description='Export every NeuroWorks study under ROOT.'
+    )
+    parser.add_argument('root', metavar='ROOT', help='directory tree holding the studies')
+    parser.add_argument('--out', required=True, help='output directory, holds the manifest')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--format', choices=sorted(writers), default='zarr')
+    parser.add_argument('--chunk-samples', type=int, default=65536)
+    parser.add_argument('--no-video', action='store_true',
+                        help="don't open the videos for the frame times")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='also redo the studies that failed before')
+    parser.add_argument('--catalog', action='store_true',
+                        help='only write the header summary of each study to OUT/catalog.jsonl')
+    args = parser.parse_args(argv)
+    if args.chunk_samples <= 0:
+        parser.error('--chunk-samples has to be positive')
+
+    if args.catalog:
+        return 1 if write_catalog(args.root, args.out, args.workers) else 0
+
+    summary = BatchRun(
+        args.root, args.out, args.workers, args.format, args.retry_failed,
+        loader_options={'load_video': not args.no_video},
+        export_options={'chunk_samples': args.chunk_samples}
+    ).run()
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,8 @@ import json
 import struct
 import collections
 from .utils.byte_buffer import ByteBuffer
-from .utils.misc import load_json
+from .utils.template_plan import templates
+from .utils.stats import stage
 
 """
 Documentation for data_template based parsing file.
@@ -32,124 +33,145 @@ TODO: Add support for inferring base schema
 
 
 class ReadFileParent:
+    # Attributes on how to load the file, which are not cached
+    cache_skip = [
+        'load_filename', 'generic_data_templates', 'data_template_type',
+        'use_mmap', 'cache', 'stats'
+    ]
+
     def __init__(self, load_filename, data_template_type, base_schema=1):
         self.load_filename = load_filename
-        dir_name = os.getcwd()
+        self.data_template_type = data_template_type
+
+        # Memory map the file instead of reading it, see ByteBuffer
+        self.use_mmap = False
+
+        # Optional DecodedCache of the loaded data
+        self.cache = None
+
+        # Optional LoadStats recording the stages of load
+        self.stats = None
+
+        # Leave a trailing record that is cut off unread, for files still
+        # being written, see load_tail
+        self.complete_records = False
+
+        # Only read the fixed size headers, up to the first special or
+        # repeat section or variable size field of the data template
+        self.header_only = False
 
         if base_schema > 0:
-            # First load the generic header data_templates
-            generic_data_template_filename = os.path.join(
-                dir_name,
-                "data_templates/generic_header_data_template_schema_{}.json".format(base_schema)
-            )
-            self.generic_data_templates = load_json(generic_data_template_filename)
+            # First load the generic header data_templates, compiled
+            self.generic_data_templates = templates.plan('generic', base_schema)
         else:
             # File types without a generic template
             self.generic_data_templates = None
 
-        # Load the file schema specific directories
-        self.schema_data_template_dir = os.path.join(dir_name, 'data_templates', data_template_type)
+    def open_buffer(self, offset=0, size=None):
+        return ByteBuffer(self.load_filename, use_mmap=self.use_mmap, offset=offset, size=size)
+
+    def cache_variant(self):
+        # Loaders reading a file in different ways are cached separately
+        if self.header_only:
+            return type(self).__name__ + ':header_only'
+        if self.complete_records:
+            return type(self).__name__ + ':complete'
+        return type(self).__name__
 
     def load(self):
-        self.requirements = {}
-        self.data = {}
-
-        buf = ByteBuffer(self.load_filename)
-        generic_loaded = False
-        for stage in range(2):
-            if stage == 0:
-                if self.generic_data_templates is None:
-                    generic_loaded = True
-                else:
-                    data_template = self.generic_data_templates
-            elif self.generic_data_templates is not None:
-                generic_loaded = True
-            else:
-                # If no generic header is used and finished stage 1
-                continue
+        with stage(self.stats, 'load', os.path.basename(self.load_filename)) as record:
+            if self.cache is not None and self.cache.restore(self):
+                record['cached'] = True
+                return
 
-            if generic_loaded:
-                if self.generic_data_templates is None:
-                    # When having no base header, there is no file schema
-                    data_template_to_load = os.path.join(
-                        self.schema_data_template_dir,
-                        "data_template.json"
-                    )
+            self.requirements = {}
+            self.data = {}
 
+            if not self.header_only:
+                buf = self.open_buffer()
+            elif self.generic_data_templates is not None:
+                buf = self.open_buffer(size=self.generic_data_templates.header_end())
+            else:
+                buf = self.open_buffer(size=0)
+            generic_loaded = False
+            for step in range(2):
+                if step == 0:
+                    if self.generic_data_templates is None:
+                        generic_loaded = True
+                    else:
+                        data_template = self.generic_data_templates
+                elif self.generic_data_templates is not None:
+                    generic_loaded = True
                 else:
-                    if not self.validate():
-                        raise ValueError("Generic header validation failed!")
-
-                    # Find the file schema described in header
-                    file_schema = self.data['generic_file_header']['file_schema']
-                    data_template_to_load = os.path.join(
-                        self.schema_data_template_dir,
-                        "file_schema_{}".format(file_schema),
-                        "data_template.json"
-                    )
-                    self.file_schema = file_schema
-
-                if not os.path.isfile(data_template_to_load):
-                    raise FileNotFoundError(
-                        "Schema-specific data_template not found. "
-                        "File should be: {}".format(data_template_to_load)
-                    )
-
-                # Load the correct version of data_templates
-                data_template = load_json(data_template_to_load)
-
-            for key_outer, val_outer in data_template.items():
-                if "requirements" in key_outer:
-                    self.requirements[key_outer.split(":")[1]] = val_outer
-                    continue
-                elif "special" in key_outer:
-                    # If there is a special field, pass to the method
-                    self.read_special_field(buf, key_outer.split(":")[1], val_outer)
-                    continue
-                elif "read_checkpoint" in key_outer:
-                    # Run a check on reading offset
-                    if buf.cursor != val_outer:
-                        raise ValueError("Checkpoint '{}' failed".format(key_outer))
-                    continue
-                elif "repeat" in key_outer:
-                    # When in repeat, read until the end and repeatedly
-                    # fill in a dict.
-                    key_outer = key_outer.split(":")[1]
-
-                    self.data[key_outer] = dict()
-                    for key in val_outer.keys():
-                        # Empty list for repeated units
-                        self.data[key_outer][key] = []
-
-                    while not buf.isfinished():
-                        for key, val in val_outer.items():
-                            if isinstance(val[1], int):
-                                # Specify plain number as num_reads
-                                loaded = buf.read(val[0], val[1])
-                            else:
-                                # Specify evaluable as num_reads condition
-                                d_temp = {}
-                                for key_inner in self.data[key_outer].keys():
-                                    # Itself can't be used as condition
-                                    # TODO: Check for cyclic condition
-                                    if key_inner == key: continue
-                                    d_temp[key_inner] = \
-                                        self.data[key_outer][key_inner][-1]
-                                locals().update(d_temp)
-                                loaded = buf.read(val[0], eval(val[1]))
-                            self.data[key_outer][key].append(loaded)
-
+                    # If no generic header is used and finished stage 1
                     continue
 
-                # TODO: Only support 2 levels of hierarchy for now
-                if isinstance(val_outer, dict):
-                    self.data[key_outer] = dict()
-                    for key, val in val_outer.items():
-                        loaded = buf.read(*val)
-                        self.data[key_outer][key] = loaded
+                if generic_loaded:
+                    if self.generic_data_templates is None:
+                        # When having no base header, there is no file schema
+                        data_template_to_load = templates.template_path(self.data_template_type)
+
+                    else:
+                        if not self.validate():
+                            raise ValueError("Generic header validation failed!")
+
+                        # Find the file schema described in header
+                        file_schema = self.data['generic_file_header']['file_schema']
+                        data_template_to_load = templates.template_path(
+                            self.data_template_type, file_schema
+                        )
+                        self.file_schema = file_schema
+
+                    if not os.path.isfile(data_template_to_load):
+                        raise FileNotFoundError(
+                            "Schema-specific data_template not found. "
+                            "File should be: {}".format(data_template_to_load)
+                        )
+
+                    # Load the correct version of data_templates
+                    with stage(self.stats, 'template', os.path.basename(self.load_filename)):
+                        data_template = templates.load_plan(data_template_to_load)
+                    self.data_template_path = data_template_to_load
+
+                    if self.header_only:
+                        # Bytes up to the end of the fixed size header
+                        cursor = buf.cursor
+                        buf.close()
+                        buf = self.open_buffer(size=data_template.header_end(cursor))
+                        buf.cursor = cursor
+
+                if self.header_only:
+                    data_template.run_header(self, buf)
                 else:
-                    loaded = buf.read(*val_outer)
-                    self.data[key_outer] = loaded
+                    data_template.run(self, buf)
+
+            # End of what was read, see load_tail
+            self.data_end = buf.cursor
+            buf.close()
+            record['bytes'] = int(buf.cursor)
+
+            if self.cache is not None:
+                self.cache.store(self)
+
+    def load_tail(self):
+        """
+        Read the records appended to the repeat section of a file still
+        being written, from the end of the last load() or load_tail() on.
+        Only the new bytes are read, and load() has to be done with
+        complete_records. The new records are added to data and returned
+        as {section name: records}.
+        """
+        with stage(self.stats, 'load_tail', os.path.basename(self.load_filename)) as record:
+            buf = self.open_buffer(offset=self.data_end)
+            new_records = templates.load_plan(self.data_template_path).read_records(buf)
+            buf.close()
+            self.data_end += buf.cursor
+            record['bytes'] = int(buf.cursor)
+
+        for name, records in new_records.items():
+            for key, values in records.items():
+                self.data[name][key].extend(values)
+        return new_records
 
     def validate(self):
         # Iterate through the requirement dict
@@ -2,7 +2,23 @@ from ..file_loading_parent import ReadFileParent
 
 
 class ENTLoader(ReadFileParent):
+    cache_skip = ReadFileParent.cache_skip + ['lazy_notes']
+
     def __init__(self, load_file):
         super().__init__(load_file, "ent")
 
-# Caution: The last note entry is always None, which needs to be handled with care.
\ No newline at end of file
+        # Keep the notes as LazyKeyTree, only the Stamp is read when
+        # collecting them
+        self.lazy_notes = False
+
+    def cache_variant(self):
+        if self.lazy_notes:
+            return super().cache_variant() + ':lazy'
+        return super().cache_variant()
+
+    def open_buffer(self, offset=0, size=None):
+        buf = super().open_buffer(offset, size)
+        buf.lazy_key_trees = self.lazy_notes
+        return buf
+
+# Caution: The last note entry is always None, which needs to be handled with care.
@@ -1,7 +1,8 @@
-import os
+import numpy as np
 from ..file_loading_parent import ReadFileParent
 from ..utils.raw_data_packet import RawDataObject
-from ..utils.misc import load_json
+from ..utils.template_plan import templates
+from ..utils.expression import evaluate, evaluate_vector
 
 
 """
@@ -10,10 +11,54 @@ TODO: Add doc for conversion file format
 """
 
 class ERDLoader(ReadFileParent):
+    cache_skip = ReadFileParent.cache_skip + ['decode_packets', 'value_dtype', 'channels']
+
     def __init__(self, load_file):
         super().__init__(load_file, "erd")
         # TODO: Maybe want to get a centralized class and add files?
 
+        # When False, load() only reads the headers and leaves the
+        # packets for random access reads
+        self.decode_packets = True
+
+        # Type the decoded values are stored in, float32 halves the memory
+        self.value_dtype = np.float64
+
+        # Channel indices to decode, None for all. The other channels
+        # are skipped over and not stored.
+        self.channels = None
+
+    def cache_variant(self):
+        if not self.decode_packets:
+            return super().cache_variant() + ':header'
+        variant = super().cache_variant()
+        if np.dtype(self.value_dtype) != np.float64:
+            variant += ':' + np.dtype(self.value_dtype).name
+        if self.channels is not None:
+            variant += ':channels=' + ','.join(str(c) for c in self.channels)
+        return variant
+
+    def resolve_channels(self, channels=None):
+        """
+        Channel indices for a list of channel names or indices. None
+        selects all channels. Names are looked up in channel_names, which
+        is in virtual channel order like the ChannelNames of load();
+        phys_chan is not applied.
+        """
+        if channels is None:
+            return list(range(self.num_channels))
+
+        channel_ids = []
+        for c in channels:
+            if isinstance(c, str):
+                if c not in self.channel_names:
+                    raise ValueError("Unknown channel '{}'".format(c))
+                c = self.channel_names.index(c)
+            elif not -self.num_channels <= c < self.num_channels:
+                raise ValueError("Channel index {} out of range".format(c))
+            channel_ids.append(int(c) % self.num_channels)
+        return channel_ids
+
     def read_rec(self, val, extra={}):
         """
         Iterate over keys of a dict. 
@@ -21,37 +66,11 @@ class ERDLoader(ReadFileParent):
         its value. If it's a list, combine it as string.
         Run eval on the value, etc.
         """
+        # The dependent variables are the header fields
+        variables = dict(self.data['raw_data_file_header'])
+        variables.update(extra)
+        return evaluate(val, variables)
 
-        # Get the dependent variables in locals
-        locals().update(self.data['raw_data_file_header'])
-        locals().update(extra)
-
-        if isinstance(val, dict):
-            for k, v in val.items():
-
-                try:
-                    res = eval(k)
-                except:
-                    raise ValueError('Key {} is not evaluatable'.format(k))
-
-                # Recursion on child dictionaries of matching key
-                if isinstance(res, bool) and res:
-                    return self.read_rec(v, extra)
-
-            # Shouldn't get here
-            raise ValueError(
-                "Unmatched version/machine type. Keys are {}.".format(val.keys())
-            )
-
-        elif isinstance(val, list):
-            return eval(''.join(val))
-
-        elif isinstance(val, str):
-            return eval(val)
-
-        else:
-            raise ValueError("Invalid configuration of format file")
-    
     def correct_electrode_order(self):
         new_lst = [''] * len(self.channel_names)
         header = self.data['raw_data_file_header']
@@ -59,14 +78,30 @@ class ERDLoader(ReadFileParent):
             new_lst[virt_chan] = self.channel_names[phys_chan]
         self.channel_names = new_lst
 
+    def load_header(self):
+        """
+        Load only the header, with the channel names and conversion
+        factors, and a RawDataObject whose packets are not decoded, to
+        read them later from data_offset on (see RawDataObject.iter_from).
+        Only the header bytes of the file are read.
+        """
+        self.header_only = True
+        try:
+            self.load()
+        finally:
+            self.header_only = False
+        self.data['data_packets'] = self.packet_reader(self.data_end)
+
     def read_special_field(self, f, key, val):
-        # Path to search for conversion files
-        p = os.path.join(
-            self.schema_data_template_dir,
-            'file_schema_{}'.format(self.file_schema),
-            "conversion.json"
-        )
-        raw_data_conversion = load_json(p)
+        # Actually load .erd file
+        o = self.packet_reader(f.cursor)
+        if self.decode_packets:
+            o.load_file(f)
+        self.data[key] = o
+
+    def packet_reader(self, data_offset):
+        # Conversion tables, read once per process
+        raw_data_conversion = templates.table('erd', self.file_schema)
 
         # TODO: Handle 4 different headboxes?
         self.data['raw_data_file_header']['headbox_type'] = self.data['raw_data_file_header']['headbox_type'][0]
@@ -76,14 +111,14 @@ class ERDLoader(ReadFileParent):
         self.num_channels = self.data['raw_data_file_header']['num_channels']
         self.headbox_name = self.read_rec(raw_data_conversion['headbox_name'])
         self.channel_names = self.read_rec(raw_data_conversion['channel_names'])
-        self.channel_factors = [0.] * self.data['raw_data_file_header']['num_channels']
-        for c_id in range(len(self.channel_factors)):
-            self.channel_factors[c_id] = self.read_rec(
-                raw_data_conversion['conversion_factors'],
-                {'channel':c_id}
-            )
+        # Factors of all channels at once
+        self.channel_factors = evaluate_vector(
+            raw_data_conversion['conversion_factors'],
+            self.data['raw_data_file_header'],
+            'channel', self.num_channels
+        )
 
-        # Actually load .erd file
-        o = RawDataObject(self)
-        o.load_file(f)
-        self.data[key] = o
+        return RawDataObject(
+            self, data_offset=data_offset, value_dtype=self.value_dtype,
+            channels=self.channels
+        )
@@ -1,24 +1,56 @@
+import os
 from ..file_loading_parent import ReadFileParent
+from ..utils.template_plan import templates, FixedRepeat
+from ..utils.toc_index import TocIndex
 
 
 class ETCLoader(ReadFileParent):
     def __init__(self, load_file):
         super().__init__(load_file, "etc")
 
+    def load(self):
+        super().load()
+        # Built once, shared by validation and sample stamping
+        if not self.header_only:
+            self.toc_index = TocIndex(self.data['table_of_content'])
+
+    def read_entry(self, index):
+        """
+        Table of content entry index (negative counts from the end), read
+        on its own after a header_only load. None if there is no such
+        entry.
+        """
+        step = next(
+            step for step in templates.load_plan(self.data_template_path).steps
+            if isinstance(step, FixedRepeat)
+        )
+        record_size = step.dtype.itemsize
+        num_entries = (os.path.getsize(self.load_filename) - self.data_end) // record_size
+        if index < 0:
+            index += num_entries
+        if not 0 <= index < num_entries:
+            return None
+
+        buf = self.open_buffer(offset=self.data_end + index * record_size, size=record_size)
+        entry = {key: values[0] for key, values in step.read(buf).items()}
+        buf.close()
+        return entry
+
+    def load_tail(self):
+        new_records = super().load_tail()
+        self.toc_index.extend(new_records['table_of_content'])
+        return new_records
+
     def validate(self, erd_loader=None):
         # First call the super validate
         if not super().validate():
             return False
         
         if erd_loader is not None:
-            # Iterate over all toc entries and check the offset
-            for toc_step in range(len(self.data['offset'])):
-                offset = self.data['offset'][toc_step]
-                sample_num = self.data['sample_num'][toc_step]
-                sample_span = self.data['sample_span'][toc_step]
-
-                if offset not in erd_loader.data['data_packets'].packet_file_offset:
-                    return False
+            # Every toc entry has to point at a packet offset
+            packet_file_offset = erd_loader.data['data_packets'].packet_file_offset
+            if not self.toc_index.covered_by(packet_file_offset):
+                return False
 
 
         # That's all for now I guess
@@ -1,22 +1,56 @@
+import os
+import re
+import mmap
 import struct
-from .key_tree_parser import key_tree_parser
+from .key_tree_parser import key_tree_parser, LazyKeyTree
 
-def null_terminated_string(s):
-    l = []
-    for c in s:
-        if c == '\x00':
-            break
-        l.append(
-            c
-        )
-    return ''.join(l)
+# Search of bytes, mmap and memoryview alike, which has no find()
+find_null = re.compile(b'\x00').search
 
 class ByteBuffer:
-    def __init__(self, path):
+    def __init__(self, path, use_mmap=False, offset=0, size=None):
+        """
+        With use_mmap, the file is memory mapped read-only instead of read
+        into memory. Processes reading the same file then share the page
+        cache, and only the parts actually read are paged in.
+        With offset, only the bytes from offset on are read, and the
+        cursor counts from there. With size, at most size bytes are read.
+        Mapped files are then sliced without copying.
+        """
+        self.map = None
         with open(path, 'rb') as f:
-            self.s = f.read()
+            if use_mmap and os.fstat(f.fileno()).st_size > 0:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.map is not None and (offset or size is not None):
+                end = len(self.map) if size is None else offset + size
+                self.s = memoryview(self.map)[offset:end]
+            elif self.map is not None:
+                self.s = self.map
+            elif offset or size is not None:
+                f.seek(offset)
+                self.s = f.read(-1 if size is None else size)
+            else:
+                self.s = f.read()
         self.cursor = 0
-    
+
+        # Slices of the view don't copy the bytes
+        self.view = memoryview(self.s)
+
+        # Return key trees as LazyKeyTree, parsed when first accessed
+        self.lazy_key_trees = False
+
+    def close(self):
+        # Arrays still using the mapped bytes keep the file open until
+        # they are freed
+        try:
+            self.view.release()
+            if isinstance(self.s, memoryview):
+                self.s.release()
+            if self.map is not None:
+                self.map.close()
+        except BufferError:
+            pass
+
     def isfinished(self):
         return self.cursor >= len(self.s) - 1
 
@@ -38,7 +72,7 @@ class ByteBuffer:
                 val = self.s[self.cursor]
             else:
                 val = int.from_bytes(
-                    self.s[self.cursor:self.cursor+num_read],
+                    self.view[self.cursor:self.cursor+num_read],
                     'big'
                 )
                 # Assuming big endian
@@ -47,28 +81,33 @@ class ByteBuffer:
             return val
 
         elif read_format == 'string' or read_format == 'key_tree':
+            end = self.cursor + num_read if num_read > 0 else len(self.s)
+            if null_terminate:
+                # Only decode up to the first null byte
+                null = find_null(self.s, self.cursor, end)
+                if null is not None:
+                    end = null.start()
+
             if num_read > 0:
-                s = self.s[self.cursor:self.cursor+num_read].decode()
+                s = str(self.view[self.cursor:end], 'utf-8')
                 self.cursor += num_read
             else:
                 # Will I regret my life over this?
-                s = self.s[self.cursor:].decode('ascii', 'ignore')
+                s = str(self.view[self.cursor:end], 'ascii', 'ignore')
                 # Decodes as raw text
-
-            if null_terminate:
-                s = null_terminated_string(s)
+                self.cursor = end
 
             if read_format == 'key_tree':
-                s = key_tree_parser(s).to_dict()
+                if self.lazy_key_trees:
+                    s = LazyKeyTree(s)
+                else:
+                    s = key_tree_parser(s).to_dict()
             return s
 
         else:
             # Read using unpack
             updated_format = read_format * num_read
-            size_needed = struct.calcsize(updated_format)
-            val = struct.unpack(
-                updated_format, self.s[self.cursor:self.cursor+size_needed]
-            )
-            self.cursor += size_needed
+            val = struct.unpack_from(updated_format, self.s, self.cursor)
+            self.cursor += struct.calcsize(updated_format)
 
             return list(val) if len(updated_format)>1 else val[0]
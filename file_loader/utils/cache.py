@@ -0,0 +1,151 @@
+import os
+import shutil
+import pickle
+import hashlib
+import numpy as np
+
+"""
+Persistent cache of decoded files.
+
+Each entry is a directory named after the fingerprint of the source
+file (path, size, mtime and a hash of its first bytes). It holds the
+pickled loader state, with large arrays stored next to it as .npy files
+that are memory mapped when the entry is read back. Entries are evicted
+least recently used first once the cache grows over max_bytes.
+"""
+
+# Bytes of the file hashed into the fingerprint. Covers the headers.
+FINGERPRINT_BYTES = 1 << 16
+
+# Arrays at least this large are stored as separate .npy files
+NPY_MIN_BYTES = 1 << 16
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, f, entry_dir, owner):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.entry_dir = entry_dir
+        self.owner = owner
+        self.num_arrays = 0
+
+    def persistent_id(self, obj):
+        # Back references to the loader being cached
+        if obj is self.owner:
+            return ('owner',)
+
+        if isinstance(obj, np.ndarray) and obj.nbytes >= NPY_MIN_BYTES \
+                and not obj.dtype.hasobject:
+            name = 'array_{}.npy'.format(self.num_arrays)
+            self.num_arrays += 1
+            np.save(os.path.join(self.entry_dir, name), obj)
+            return ('npy', name)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, entry_dir, owner):
+        super().__init__(f)
+        self.entry_dir = entry_dir
+        self.owner = owner
+
+    def persistent_load(self, pid):
+        if pid[0] == 'owner':
+            return self.owner
+        return np.load(os.path.join(self.entry_dir, pid[1]), mmap_mode='r')
+
+
+class DecodedCache:
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        if max_bytes is not None:
+            self.evict()
+
+    def fingerprint(self, path, variant=''):
+        st = os.stat(path)
+        h = hashlib.sha1()
+        h.update(
+            '{}|{}|{}|{}'.format(
+                os.path.abspath(path), st.st_size, st.st_mtime_ns, variant
+            ).encode()
+        )
+        with open(path, 'rb') as f:
+            h.update(f.read(FINGERPRINT_BYTES))
+        return h.hexdigest()
+
+    def restore(self, file_loader):
+        """
+        Fill file_loader's attributes from the cache. Returns False if
+        the file is not cached.
+        """
+        entry_dir = os.path.join(
+            self.cache_dir,
+            self.fingerprint(file_loader.load_filename, file_loader.cache_variant())
+        )
+        state_file = os.path.join(entry_dir, 'state.pkl')
+        if not os.path.isfile(state_file):
+            return False
+
+        with open(state_file, 'rb') as f:
+            state = _Unpickler(f, entry_dir, file_loader).load()
+        file_loader.__dict__.update(state)
+
+        # Mark as recently used
+        os.utime(entry_dir)
+        return True
+
+    def store(self, file_loader):
+        """
+        Store file_loader's attributes, except the ones in its cache_skip.
+        """
+        key = self.fingerprint(file_loader.load_filename, file_loader.cache_variant())
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_dir):
+            return
+
+        # Write to a temporary directory first, so readers never see a
+        # partially written entry
+        tmp_dir = os.path.join(self.cache_dir, '.{}.{}.tmp'.format(key, os.getpid()))
+        os.makedirs(tmp_dir, exist_ok=True)
+        state = {
+            k: v for k, v in file_loader.__dict__.items()
+            if k not in file_loader.cache_skip
+        }
+        with open(os.path.join(tmp_dir, 'state.pkl'), 'wb') as f:
+            _Pickler(f, tmp_dir, file_loader).dump(state)
+
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Stored by someone else in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        if self.max_bytes is not None:
+            self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in
+        max_bytes. The entry keep is never removed.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, f))
+                for f in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(entry_dir), name, size))
+            total += size
+
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
@@ -0,0 +1,133 @@
+import os
+import json
+import zlib
+import numpy as np
+from .key_tree_parser import LazyKeyTree
+
+"""
+Writers for exporting a study to chunked, compressed storage.
+
+ZarrWriter writes a Zarr (format 2) directory store with zlib compressed
+chunks and needs no extra package; the store can be opened with the zarr
+package. HDF5Writer needs h5py. Both take the EEG data one time block at
+a time, so the recording never has to fit in memory.
+"""
+
+
+def _json_default(obj):
+    # NumPy scalars in notes and study info
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, LazyKeyTree):
+        return obj.to_dict()
+    raise TypeError("Can't export {!r}".format(obj))
+
+
+class ZarrWriter:
+    def __init__(self, path, num_rows, chunk_rows, chunk_samples, level=5):
+        self.path = path
+        self.num_rows = num_rows
+        self.chunk_rows = chunk_rows
+        self.chunk_samples = chunk_samples
+        self.level = level
+        self.num_samples = 0
+        self.attrs = {}
+
+        os.makedirs(os.path.join(path, 'EEGData'), exist_ok=True)
+        self.write_json('.zgroup', {'zarr_format': 2})
+
+    def write_json(self, name, obj):
+        with open(os.path.join(self.path, name), 'w') as f:
+            json.dump(obj, f, default=_json_default)
+
+    def write_chunk(self, name, key, chunk):
+        with open(os.path.join(self.path, name, key), 'wb') as f:
+            f.write(zlib.compress(np.ascontiguousarray(chunk).tobytes(), self.level))
+
+    def write_meta(self, name, shape, chunks, dtype, fill_value):
+        self.write_json(os.path.join(name, '.zarray'), {
+            'zarr_format': 2,
+            'shape': list(shape),
+            'chunks': list(chunks),
+            'dtype': np.dtype(dtype).str,
+            'compressor': {'id': 'zlib', 'level': self.level},
+            'fill_value': fill_value,
+            'order': 'C',
+            'filters': None
+        })
+
+    def append(self, block):
+        """
+        Write one time block of shape (num_rows, chunk_samples). Only the
+        last block can be shorter.
+        """
+        j = self.num_samples // self.chunk_samples
+        for i, row in enumerate(range(0, self.num_rows, self.chunk_rows)):
+            # Chunks on the edges are stored in full size
+            chunk = np.full((self.chunk_rows, self.chunk_samples), np.nan)
+            rows = block[row:row+self.chunk_rows]
+            chunk[:len(rows), :block.shape[1]] = rows
+            self.write_chunk('EEGData', '{}.{}'.format(i, j), chunk)
+        self.num_samples += block.shape[1]
+
+    def add_array(self, name, array):
+        # Small 1-D side arrays, stored as a single chunk
+        array = np.asarray(array)
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        self.write_meta(name, array.shape, [max(1, len(array))], array.dtype, 0)
+        if len(array):
+            self.write_chunk(name, '0', array)
+
+    def set_attrs(self, attrs):
+        self.attrs.update(attrs)
+
+    def close(self):
+        # The final shape is only known at the end
+        self.write_meta(
+            'EEGData', (self.num_rows, self.num_samples),
+            (self.chunk_rows, self.chunk_samples), np.float64, 'NaN'
+        )
+        self.write_json('.zattrs', self.attrs)
+
+
+class HDF5Writer:
+    def __init__(self, path, num_rows, chunk_rows, chunk_samples, level=5):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Exporting to HDF5 needs the h5py package")
+
+        self.f = h5py.File(path, 'w')
+        self.num_samples = 0
+        self.eeg = self.f.create_dataset(
+            'EEGData',
+            shape=(num_rows, 0),
+            maxshape=(num_rows, None),
+            chunks=(min(chunk_rows, num_rows), chunk_samples),
+            dtype=np.float64,
+            compression='gzip',
+            compression_opts=level,
+            fillvalue=np.nan
+        )
+
+    def append(self, block):
+        self.eeg.resize(self.num_samples + block.shape[1], axis=1)
+        self.eeg[:, self.num_samples:] = block
+        self.num_samples += block.shape[1]
+
+    def add_array(self, name, array):
+        self.f.create_dataset(name, data=np.asarray(array))
+
+    def set_attrs(self, attrs):
+        # Attributes are limited in size, so store them as JSON strings
+        for key, val in attrs.items():
+            self.f.create_dataset(key, data=json.dumps(val, default=_json_default))
+
+    def close(self):
+        self.f.close()
+
+
+writers = {
+    'zarr': ZarrWriter,
+    'hdf5': HDF5Writer
+}
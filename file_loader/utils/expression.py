@@ -0,0 +1,118 @@
+import types
+import numpy as np
+
+"""
+Expressions used in data templates and conversion files, like the
+"length-16" repeat lengths of .ent files or the "channel<32" keys of
+conversion.json. Each expression is compiled once and evaluated with
+explicit variables.
+"""
+
+
+def code_names(code):
+    # Global names of the code and of the comprehensions and lambdas in it
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names += [n for n in code_names(const) if n not in names]
+    return names
+
+
+class Expression:
+    def __init__(self, src):
+        self.src = src
+        self.code = compile(src, '<template>', 'eval')
+        # Variables the expression may refer to
+        self.names = code_names(self.code)
+
+    def __reduce__(self):
+        # Code objects can't be pickled
+        return expression, (self.src,)
+
+    def __call__(self, variables):
+        # Variables are globals, so they are visible in comprehensions
+        return eval(self.code, {n: variables[n] for n in self.names if n in variables})
+
+
+# Compiled expressions by source
+_expressions = {}
+
+
+def expression(src):
+    if src not in _expressions:
+        _expressions[src] = Expression(src)
+    return _expressions[src]
+
+
+def evaluate(val, variables):
+    """
+    Evaluate a conversion entry. Dict keys are conditions, and the first
+    key that is true selects its value. Lists are joined into a single
+    expression.
+    """
+    if isinstance(val, dict):
+        for k, v in val.items():
+            try:
+                res = expression(k)(variables)
+            except:
+                raise ValueError('Key {} is not evaluatable'.format(k))
+
+            # Recursion on child dictionaries of matching key
+            if isinstance(res, bool) and res:
+                return evaluate(v, variables)
+
+        # Shouldn't get here
+        raise ValueError(
+            "Unmatched version/machine type. Keys are {}.".format(val.keys())
+        )
+
+    elif isinstance(val, list):
+        return expression(''.join(val))(variables)
+
+    elif isinstance(val, str):
+        return expression(val)(variables)
+
+    else:
+        raise ValueError("Invalid configuration of format file")
+
+
+def evaluate_vector(val, variables, name, n):
+    """
+    Evaluate a conversion entry for all values 0..n-1 of the variable
+    name at once, e.g. the conversion factor of every channel. Conditions
+    are evaluated on the array of values still unmatched.
+    """
+    out = np.empty(n)
+    index = np.arange(n)
+    fill_vector(val, dict(variables), name, index, out)
+    return out
+
+
+def fill_vector(val, variables, name, index, out):
+    variables[name] = index
+    if isinstance(val, dict):
+        for k, v in val.items():
+            try:
+                res = np.asarray(expression(k)(variables))
+            except:
+                raise ValueError('Key {} is not evaluatable'.format(k))
+            if res.dtype != bool:
+                continue
+
+            matched = np.broadcast_to(res, index.shape)
+            if matched.any():
+                # Recursion on child dictionaries of matching key
+                fill_vector(v, variables, name, index[matched], out)
+                index = index[~matched]
+                variables[name] = index
+            if not len(index):
+                return
+
+        # Shouldn't get here
+        raise ValueError(
+            "Unmatched version/machine type for {}={}. Keys are {}.".format(
+                name, index.tolist(), val.keys()
+            )
+        )
+
+    out[index] = evaluate(val, variables)
@@ -1,20 +1,101 @@
 import re
+from collections.abc import Mapping
+
+"""
+Parser of key trees, the text format of study info and notes:
+
+    (.(."Stamp", 2238), (."Data", (.(."User", "abc"))))
+
+Keyed entries (."key", value) are collected into dicts, values that are
+trees again become nested dicts. The text is tokenized in a single pass.
+"""
+
+# Start of a keyed entry '(."key", ', a quoted string, or a parenthesis
+_token = re.compile(r'\(\."(?![()])([^"]*)"..|"[^"]*"|[()]', re.S)
+
+# Top level Stamp entry of a note
+_stamp = re.compile(r'\(\."Stamp", ([^)]*)\)')
+
+# First characters of values that can be numbers
+_number_start = set('0123456789+-. iInN')
+
+
+def convert_value(val):
+    # Non ASCII and control characters are kept escaped
+    if not (val.isascii() and val.isprintable()) or '\\' in val:
+        val = val.encode("unicode-escape").decode()
+    val = val.strip('"')  # String values have redundant double quotes
+
+    # Might be a number, numbers are always floats
+    if val[:1] in _number_start:
+        try:
+            return float(val)
+        except ValueError:
+            pass
+    return val
+
+
+def read_value(t, cursor):
+    """
+    Read the value starting at cursor, up to the parenthesis closing its
+    entry. Returns the value and the cursor after the parenthesis.
+    """
+    if t.startswith('"', cursor):
+        # Text can have parenthesis
+        end_quote = t.find('"', cursor + 1)
+        end = t.find(')', cursor if end_quote < 0 else end_quote + 1)
+    else:
+        end = t.find(')', cursor)
+    if end < 0:
+        end = len(t)
+    return convert_value(t[cursor:end]), end + 1
+
+
+def parse_key_tree(t):
+    tree = dict()
+    # Trees being read: (parent tree, key, parenthesis depth in parent)
+    stack = []
+    depth = 0
+    cursor = 0
+
+    while True:
+        m = _token.search(t, cursor)
+        if m is None:
+            break
+        cursor = m.end()
+        token = m.group()
+        key = m.group(1)
+
+        if key is not None:
+            if t.startswith('(', cursor):
+                # Value is a tree
+                stack.append((tree, key, depth))
+                tree = dict()
+                depth = 0
+                cursor += 1
+            else:
+                tree[key], cursor = read_value(t, cursor)
+
+        elif token == '(':
+            depth += 1
+
+        elif token == ')':
+            if depth == 0 and stack:
+                # End of the tree, skip the parenthesis of its entry
+                parent, key, depth = stack.pop()
+                parent[key] = tree
+                tree = parent
+                cursor += 1
+            else:
+                depth -= 1
 
+    # Trees cut off at the end of the text
+    while stack:
+        parent, key, _ = stack.pop()
+        parent[key] = tree
+        tree = parent
 
-class node:
-    def __init__(self, key, data):
-        self.key = key
-        self.data = data
-
-    def to_dict(self):
-        if isinstance(self.data, list):
-            d = dict()
-            for item in self.data:
-                d[item.key] = item.to_dict()
-            return d
-        else:
-            # If not a list, just a value
-            return self.data
+    return tree
 
 
 class key_tree_parser:
@@ -22,94 +103,35 @@ class key_tree_parser:
         self.parsed_tree = parse_key_tree(string)
 
     def to_dict(self):
-        d = dict()
-        for item in self.parsed_tree:
-            d[item.key] = item.to_dict()
-        return d
-
-
-def parse_key_tree(t, start=0, end=-1, depth=0):
-    lst_nodes = []
-    found_key = False
-    cursor = start
-    stopping = len(t) if end == -1 else end
-
-    while cursor < stopping:
-        if t[cursor:cursor+3] == '(."' and t[cursor+3] not in [')', '(']:
-            found_key = True
-            cursor = cursor + 3
-
-        if not found_key:
-            cursor += 1
-
-        else:
-            # Find key
-            next_quote = t.find('"', cursor)
-            key = t[cursor:next_quote]
-
-            # Open value
-            if t[next_quote+3] != '(':
-                next_paren_right = t.find(')', cursor)
-
-                # Sometimes text has parenthesis.
-                while t[next_paren_right+1] not in [',',')']:
-                    next_paren_right = t.find(')', next_paren_right+1)
-
-                val = t[next_quote+3:next_paren_right].encode("unicode-escape").decode()
-                val = val.strip('"')  # String values have redundant double quotes
-
-                # Might be a string of int
-                if val.isdigit():  
-                    val = int(val)
-                # TODO: Will this cause a problem if we have an integer ID with leading 0's?
-
-                # Might be a float
-                try:
-                    a = float(val)
-                    val = a
-                except:
-                    pass
-
-                # Add key, val to list
-                lst_nodes.append(
-                    node(key, val)
-                )
-
-            # Value is either pair or tree
-            else:
-                inside_text = False
-                count = None
-                cursor_inner = next_quote + 3
-                while count != 0:
-                    if count is None:
-                        count = 0
-
-                    if t[cursor_inner] == '"':
-                        inside_text = not inside_text
-
-                    if t[cursor_inner] == '(' and not inside_text:
-                        count += 1
-                    elif t[cursor_inner] == ')' and not inside_text:
-                        count -= 1
-
-                    cursor_inner += 1
-                next_paren_right = cursor_inner
-
-                res = parse_key_tree(
-                            t=t,
-                            start=next_quote+3,
-                            end=cursor_inner+1,
-                            depth=depth+1
-                        )
-
-                lst_nodes.append(
-                    node(
-                        key,
-                        res
-                    )
-                )
-
-            cursor = next_paren_right+1
-            found_key = False
-    
-    return lst_nodes
+        return self.parsed_tree
+
+
+class LazyKeyTree(Mapping):
+    """
+    Key tree only parsed when first accessed. The Stamp of a note is
+    found without parsing the whole tree.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.tree = None
+
+    def to_dict(self):
+        if self.tree is None:
+            self.tree = parse_key_tree(self.text)
+        return self.tree
+
+    def __getitem__(self, key):
+        if key == 'Stamp' and self.tree is None:
+            m = _stamp.search(self.text)
+            if m is not None:
+                return convert_value(m.group(1))
+        return self.to_dict()[key]
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __repr__(self):
+        return 'LazyKeyTree({!r})'.format(self.to_dict())
@@ -0,0 +1,97 @@
+import numpy as np
+from .key_tree_parser import LazyKeyTree
+
+"""
+Notes of a study sorted by their sample stamp, for time range queries.
+"""
+
+
+class NoteIndex:
+    def __init__(self, note_trees):
+        """
+        note_trees is the 'note_key_tree' list of ENTLoader's note_packets.
+        Entries that are not notes or have no integer Stamp are skipped.
+        Notes with the same stamp are all kept, in file order.
+        """
+        stamps = []
+        notes = []
+        for tree in note_trees:
+            if not isinstance(tree, (dict, LazyKeyTree)):
+                continue
+            try:
+                stamps.append(int(tree['Stamp']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            notes.append(tree)
+
+        order = np.argsort(np.asarray(stamps, dtype=np.int64), kind='stable')
+        self.stamps = np.asarray(stamps, dtype=np.int64)[order]
+        self.notes = [notes[i] for i in order]
+
+    def __len__(self):
+        return len(self.notes)
+
+    def __iter__(self):
+        # (stamp, note) pairs in stamp order
+        return zip(self.stamps.tolist(), self.notes)
+
+    def at(self, stamp):
+        """
+        All notes at the given stamp.
+        """
+        start = np.searchsorted(self.stamps, stamp, 'left')
+        end = np.searchsorted(self.stamps, stamp, 'right')
+        return self.notes[start:end]
+
+    def between(self, a, b):
+        """
+        (stamp, note) pairs with a <= stamp <= b, in stamp order.
+        """
+        start = np.searchsorted(self.stamps, a, 'left')
+        end = np.searchsorted(self.stamps, b, 'right')
+        return list(zip(self.stamps[start:end].tolist(), self.notes[start:end]))
+
+    def count_between(self, a, b):
+        """
+        Number of notes with a <= stamp <= b. a and b can be arrays.
+        """
+        return np.searchsorted(self.stamps, b, 'right') - \
+            np.searchsorted(self.stamps, a, 'left')
+
+    def near(self, stamp, k=1):
+        """
+        The k notes closest to stamp as (stamp, note) pairs, closest first.
+        Of equally close notes the earlier one comes first.
+        """
+        i = np.searchsorted(self.stamps, stamp)
+        # The k closest are within k entries on either side
+        start = max(0, i - k)
+        end = min(len(self.stamps), i + k)
+        dist = np.abs(self.stamps[start:end] - stamp)
+        closest = start + np.argsort(dist, kind='stable')[:k]
+        return [(int(self.stamps[j]), self.notes[j]) for j in closest]
+
+    def sample_index(self, sample_stamps):
+        """
+        Column of each note in the EEG data, given the sample stamp row
+        of the data (e.g. ret['EEGData'][-1] of XltekLoader.load). The
+        column is the first sample at or after the note's stamp, or -1 if
+        the note is after the end of the data.
+        """
+        index = np.searchsorted(sample_stamps, self.stamps, 'left')
+        index[index == len(sample_stamps)] = -1
+        return index
+
+    def filetime(self, time_base):
+        """
+        FILETIME of each note, using a TimeBase (see
+        XltekLoader.timebase).
+        """
+        return time_base.stamp_to_filetime(self.stamps)
+
+    def to_dict(self):
+        """
+        {stamp: note}, like 'Notes' of XltekLoader.load. Of notes at the
+        same stamp, only the last one is kept.
+        """
+        return dict(zip(self.stamps.tolist(), self.notes))
@@ -1,4 +1,9 @@
+import os
+import re
+import numpy as np
+from collections import namedtuple
 from .byte_buffer import ByteBuffer
+from .stats import stage
 
 # C macro for short int size
 SHRT_MAX = 32767
@@ -15,10 +20,379 @@ bitmap_translate = {
     7: -1  # -1 for all
 }
 
+# FFFF search of bytes, mmap and memoryview alike
+find_ffff = re.compile(b'\xff\xff').search
+
+# Number of (packet x channel) entries decoded per NumPy batch
+BLOCK_ENTRIES = 1 << 20
+
+# Bytes read at a time by RawDataObject.iter_from
+WINDOW_BYTES = 1 << 22
+
+# Per-packet lists of RawDataObject, built from its PacketStore on use
+PACKET_LISTS = ['values_list', 'channels_list', 'subsample_list']
+
+# One decoded batch of packets. ends are the file offsets after each
+# packet, values the running channel values after each packet.
+PacketBlock = namedtuple(
+    'PacketBlock', ['starts', 'ends', 'groups', 'values', 'present', 'is_abs']
+)
+
+
+def _subsample_from_byte(res_read):
+    # Lowest set bit that has a translation decides the subsample
+    for i in range(9):
+        if i in bitmap_translate.keys() and res_read & 1:
+            break
+        if i == 8:
+            return None
+        res_read >>= 1
+    return bitmap_translate[i]
+
+
+# Frequency byte -> subsample, precomputed for all 256 values
+subsample_lookup = [_subsample_from_byte(b) for b in range(256)]
+
+
+class PacketDecoder:
+    """
+    Batched decoder for the delta-compressed packets of an .erd file.
+
+    Decoding happens in two passes. scan() walks the packet boundaries,
+    which only needs the frequency byte, the delta mask and a check for
+    FFFF escapes. decode() then unpacks a whole block of packets with
+    NumPy and rebuilds the absolute values with a per-channel cumsum.
+    """
+    def __init__(self, n_channels, freq_change, shorted_channel,
+                 discardbits, channel_factors):
+        self.n_channels = n_channels
+        self.discardbits = discardbits
+        self.channel_factors = np.asarray(channel_factors, dtype=np.float64)
+
+        # Bytes before the delta values: event, optional freq byte, masks
+        self.has_freq = freq_change is not None
+        self.num_mask_bytes = (n_channels + 7) // 8
+        self.header_size = 1 + int(self.has_freq) + self.num_mask_bytes
+
+        # Channel groups present in a packet. Group 0 holds every
+        # channel, the others one per subsample rate.
+        shorted = set(shorted_channel)
+        self.group_subsample = [-1]
+        group_channels = [list(range(n_channels))]
+        if self.has_freq:
+            for subsample in bitmap_translate.values():
+                if subsample == -1:
+                    continue
+                self.group_subsample.append(subsample)
+                group_channels.append(freq_change.get(subsample, []))
+
+        self.group_include = np.zeros(
+            (len(group_channels), n_channels), dtype=bool
+        )
+        self.group_mask = []
+        self.group_size = []
+        for g, channels in enumerate(group_channels):
+            channels = [c for c in channels if c < n_channels and c not in shorted]
+            self.group_include[g, channels] = True
+            self.group_mask.append(sum(1 << c for c in channels))
+            self.group_size.append(len(channels))
+        # Frequency byte -> group index
+        self.freq_lookup = None
+        if self.has_freq:
+            group_of_subsample = {s: g for g, s in enumerate(self.group_subsample)}
+            self.freq_lookup = [
+                None if s is None else group_of_subsample[s]
+                for s in subsample_lookup
+            ]
+
+        self.block_packets = max(1, BLOCK_ENTRIES // max(1, n_channels))
+
+    def scan(self, s, cursor, max_packets=None):
+        """
+        Find packet boundaries starting at cursor. Returns the packet
+        starts, their channel group and the cursor after the last
+        complete packet. A truncated packet at the end is not included.
+        """
+        end = len(s)
+        has_freq = self.has_freq
+        mask_start = 1 + int(has_freq)
+        header_size = self.header_size
+        group_mask = self.group_mask
+        group_size = self.group_size
+        freq_lookup = self.freq_lookup
+        from_bytes = int.from_bytes
+
+        starts = []
+        groups = []
+        if max_packets is None:
+            max_packets = end
+        while cursor < end and len(starts) < max_packets:
+            delta_start = cursor + header_size
+            if delta_start > end:
+                break
+
+            if has_freq:
+                g = freq_lookup[s[cursor+1]]
+                if g is None:
+                    raise RuntimeWarning(
+                        'Frequency byte was expecting a 1 bit but all are 0. Result might'
+                        'be faulty.'
+                    )
+            else:
+                g = 0
+
+            # Each double delta adds one byte to the delta section
+            mask = from_bytes(s[cursor+mask_start:delta_start], 'little') & group_mask[g]
+            delta_end = delta_start + group_size[g] + mask.bit_count()
+
+            # Absolute values only follow a 2 byte FFFF delta
+            if mask and find_ffff(s, delta_start, delta_end) is not None:
+                delta_end += 4 * self._count_abs(s, delta_start, delta_end, mask, g)
+
+            if delta_end > end:
+                break
+            starts.append(cursor)
+            groups.append(g)
+            cursor = delta_end
+
+        return starts, groups, cursor
+
+    def _count_abs(self, s, delta_start, delta_end, mask, g):
+        # FFFF hits can also straddle two fields. Only count the ones
+        # starting a double delta field.
+        group_mask = self.group_mask[g]
+        num_abs = 0
+        hit = find_ffff(s, delta_start, delta_end)
+        while hit is not None:
+            hit = hit.start()
+            # Channel whose field holds the hit: lowest channel with
+            # more than hit - delta_start bytes up to and including it
+            offset = hit - delta_start
+            lo, hi = 0, self.n_channels
+            while lo < hi:
+                mid = (lo + hi) // 2
+                below = (2 << mid) - 1
+                if (group_mask & below).bit_count() + (mask & below).bit_count() > offset:
+                    hi = mid
+                else:
+                    lo = mid + 1
+
+            below = (1 << lo) - 1
+            field_start = (group_mask & below).bit_count() + (mask & below).bit_count()
+            if mask >> lo & 1 and field_start == offset:
+                num_abs += 1
+            hit = find_ffff(s, hit+1, delta_end)
+        return num_abs
+
+    def decode(self, s, starts, groups, state, channels=None):
+        """
+        Decode a block of packets found by scan(). state holds the last
+        value of each channel (NaN if unknown) and is updated in place.
+        channels selects the channels to decode (all by default). The
+        other channels are only skipped over, using the delta mask.
+
+        Returns (values, present, is_abs): values is a (packets x channels)
+        array of the running channel values, present marks the channels
+        stored in each packet and is_abs the ones using absolute values.
+        """
+        data = np.frombuffer(s, dtype=np.uint8)
+        last_byte = len(data) - 1
+        n = self.n_channels
+        starts = np.asarray(starts, dtype=np.int64)
+        groups = np.asarray(groups, dtype=np.intp)
+        if channels is None:
+            channels = np.arange(n)
+            cols = slice(None)
+        else:
+            channels = np.asarray(channels, dtype=np.intp)
+            cols = channels
+
+        # Delta masks, one bit per channel
+        mask_pos = starts + 1 + int(self.has_freq)
+        mask_bytes = data[mask_pos[:, None] + np.arange(self.num_mask_bytes)]
+        double = np.unpackbits(mask_bytes, axis=1, bitorder='little')[:, :n]
+
+        # Byte width and offset of every delta value, for all channels
+        present_all = self.group_include[groups]
+        width = present_all * (1 + double)
+        cum_width = np.cumsum(width, axis=1, dtype=np.int32)
+        delta_start = starts + self.header_size
+
+        # Absolute values are FFFF double deltas. Their values follow the
+        # deltas in channel order, so the ones of skipped channels count
+        # for the positions too.
+        dbl_rows, dbl_cols = np.nonzero(width == 2)
+        dbl_pos = delta_start[dbl_rows] + cum_width[dbl_rows, dbl_cols] - 2
+        hit = (data[dbl_pos] == 255) & (data[dbl_pos+1] == 255)
+        abs_rows, abs_cols = dbl_rows[hit], dbl_cols[hit]
+        abs_rank = np.arange(len(abs_rows)) - np.searchsorted(abs_rows, abs_rows)
+
+        # Only the selected channels from here on
+        present = present_all[:, cols]
+        width = width[:, cols]
+        pos = delta_start[:, None] + (cum_width[:, cols] - width)
+        channel_factors = self.channel_factors[channels]
+
+        # Deltas are big endian unsigned
+        byte_0 = data[np.minimum(pos, last_byte)].astype(np.int64)
+        byte_1 = data[np.minimum(pos+1, last_byte)].astype(np.int64)
+        raw = np.where(width == 2, (byte_0 << 8) | byte_1, byte_0)
+        is_abs = (width == 2) & (raw == FFFF)
+
+        # Shift to restore discarded bits and convert
+        converted = np.where(
+            present & ~is_abs,
+            (raw << self.discardbits) * channel_factors,
+            0.
+        )
+
+        # Running sum from the previous state, channel by channel
+        converted = np.concatenate([state[None, channels], converted])
+        values = np.cumsum(converted, axis=0)[1:]
+
+        if is_abs.any():
+            abs_pos = delta_start[abs_rows] + cum_width[abs_rows, -1] + 4*abs_rank
+            converted = converted[1:]
+            for col in np.flatnonzero(is_abs.any(axis=0)):
+                channel_id = channels[col]
+                sel = abs_cols == channel_id
+                abs_raw = np.ascontiguousarray(
+                    data[abs_pos[sel, None] + np.arange(4)]
+                ).view(np.intc)[:, 0].astype(np.int64)
+                rows = abs_rows[sel]
+                converted[rows, col] = (abs_raw << self.discardbits) * self.channel_factors[channel_id]
+
+                # Restart the running sum at every absolute value
+                rows = rows.tolist()
+                for row, stop in zip(rows, rows[1:] + [len(starts)]):
+                    values[row:stop, col] = np.cumsum(converted[row:stop, col])
+
+        state[channels] = values[-1]
+        return values, present, is_abs
+
+    def to_packets(self, values, present, is_abs, channels=None):
+        """
+        Per-packet channels and values in the order of the original
+        format: delta channels first, then absolute channels. channels
+        are the decoded channels, if not all of them.
+        """
+        num_cols = present.shape[1]
+        rows, cols = np.nonzero(present)
+        if is_abs.any():
+            order = np.argsort(
+                rows * (2*num_cols) + cols + num_cols*is_abs[rows, cols],
+                kind='stable'
+            )
+            rows, cols = rows[order], cols[order]
+
+        ptr = np.zeros(len(values)+1, dtype=np.int64)
+        np.cumsum(present.sum(axis=1), out=ptr[1:])
+        channel_ids = cols if channels is None else np.asarray(channels)[cols]
+        return values[rows, cols], channel_ids, ptr
+
+
+class PacketStore:
+    """
+    Decoded packets in CSR layout: packet t holds the values
+    values[packet_ptr[t]:packet_ptr[t+1]] of the channels channel_ids[...]
+    in the same range, and has a subsample and the file offset after it.
+    The arrays grow by doubling while packets are appended.
+    """
+    def __init__(self, value_dtype=np.float64):
+        self.num_packets = 0
+        self.num_values = 0
+        self.buffers = dict(
+            values=np.empty(0, dtype=value_dtype),
+            channel_ids=np.empty(0, dtype=np.uint16),
+            packet_ptr=np.zeros(1, dtype=np.int64),
+            subsample=np.empty(0, dtype=np.int16),
+            file_offset=np.empty(0, dtype=np.int64)
+        )
+
+    @classmethod
+    def from_arrays(cls, values, channel_ids, packet_ptr, subsample, file_offset):
+        store = cls(values.dtype)
+        store.num_packets = len(subsample)
+        store.num_values = len(values)
+        store.buffers = dict(
+            values=values, channel_ids=channel_ids, packet_ptr=packet_ptr,
+            subsample=subsample, file_offset=file_offset
+        )
+        return store
+
+    def reserve(self, name, size):
+        buf = self.buffers[name]
+        if len(buf) < size:
+            grown = np.empty(max(size, 2*len(buf), 1024), dtype=buf.dtype)
+            grown[:len(buf)] = buf
+            self.buffers[name] = grown
+        return self.buffers[name]
+
+    def append(self, values, channel_ids, ptr, subsample, file_offset):
+        """
+        Append packets, with ptr relative to the first of them.
+        """
+        n, m = self.num_packets, self.num_values
+        k = len(ptr) - 1
+        self.reserve('values', m + len(values))[m:m+len(values)] = values
+        self.reserve('channel_ids', m + len(values))[m:m+len(values)] = channel_ids
+        self.reserve('packet_ptr', n + k + 1)[n+1:n+k+1] = ptr[1:] + m
+        self.reserve('subsample', n + k)[n:n+k] = subsample
+        self.reserve('file_offset', n + k)[n:n+k] = file_offset
+        self.num_packets += k
+        self.num_values += len(values)
+
+    def trim(self):
+        # Drop the spare capacity once no more packets are appended
+        for name, size in [
+            ('values', self.num_values), ('channel_ids', self.num_values),
+            ('packet_ptr', self.num_packets+1), ('subsample', self.num_packets),
+            ('file_offset', self.num_packets)
+        ]:
+            if len(self.buffers[name]) > size:
+                self.buffers[name] = self.buffers[name][:size].copy()
+
+    def __len__(self):
+        return self.num_packets
+
+    @property
+    def values(self):
+        return self.buffers['values'][:self.num_values]
+
+    @property
+    def channel_ids(self):
+        return self.buffers['channel_ids'][:self.num_values]
+
+    @property
+    def packet_ptr(self):
+        return self.buffers['packet_ptr'][:self.num_packets+1]
+
+    @property
+    def subsample(self):
+        return self.buffers['subsample'][:self.num_packets]
+
+    @property
+    def file_offset(self):
+        return self.buffers['file_offset'][:self.num_packets]
+
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self.buffers.values())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['buffers'] = {
+            'values': self.values, 'channel_ids': self.channel_ids,
+            'packet_ptr': self.packet_ptr, 'subsample': self.subsample,
+            'file_offset': self.file_offset
+        }
+        return state
+
 
 class RawDataObject:
-    def __init__(self, reader_parent):
+    def __init__(self, reader_parent, data_offset=None, value_dtype=np.float64,
+                 channels=None):
         self.reader_parent = reader_parent
+        self.data_offset = data_offset
         self.header = reader_parent.data['raw_data_file_header']
         self.n_channels = self.header['num_channels']
 
@@ -37,104 +411,180 @@ class RawDataObject:
         shorted_mask = self.header['shorted']
         self.shorted_channel = [i for i, x in enumerate(shorted_mask) if x]
 
-        # Packet list
-        self.values_list = []
-        self.channels_list = []
-        self.subsample_list = []
-        self.packet_file_offset = []
+        # TODO: This only works for deltabits=8
+        self.decoder = PacketDecoder(
+            self.n_channels,
+            self.freq_change,
+            self.shorted_channel,
+            self.header['discardbits'],
+            reader_parent.channel_factors
+        )
+        self.group_subsample = np.array(self.decoder.group_subsample, dtype=np.int16)
+
+        # Channels kept in the packet store, None for all of them
+        self.channels = None if channels is None else np.asarray(channels, dtype=np.intp)
+
+        # Decoded packets
+        self.packets = PacketStore(value_dtype)
         self.last_channel_value = [None] * self.n_channels
 
+    def channel_subsample(self):
+        """
+        Subsample rate of each channel, -1 for full rate channels.
+        """
+        subsample = np.full(self.n_channels, -1, dtype=np.int64)
+        for freq_down, channels in (self.freq_change or {}).items():
+            channels = [c for c in channels if c < self.n_channels]
+            subsample[channels] = freq_down
+        return subsample
+
     def load_file(self, buf):
-        # Event byte: Skip; Read until EOF
-        while buf.read() is not None:
-
-            # Second byte: Optional, freq flag
-            if self.freq_change is not None:
-                res_read = buf.read()
-                for i in range(9):
-                    if i in bitmap_translate.keys() and res_read & 1:
-                        break
-                    if i == 8:
-                        raise RuntimeWarning(
-                            'Frequency byte was expecting a 1 bit but all are 0. Result might'
-                            'be faulty.'
-                        )
-                    res_read >>= 1
-                subsample = bitmap_translate[i]
-            else:
-                subsample = -1
-
-            # Delta masks
-            chan_cursor = 0
-            chan_double_delta = []
-            while chan_cursor < self.n_channels:
-
-                # Every 8 bits, read a new byte. 0 included
-                if chan_cursor % 8 == 0:
-                    res_read = buf.read()
-
-                # Check if the bit is on
-                if res_read & 1:
-                    chan_double_delta.append(chan_cursor)
-
-                # Shift the number by 1
-                res_read >>= 1
-                chan_cursor += 1
-
-            # TODO: This only works for deltabits=8
-            # Read the bytes for delta
-            delta_values = []
-            delta_channels = []
-            abs_channels = []
-            for channel_id in range(self.n_channels):
-                # Check if channel is shorted or not included due to subsample
-                if channel_id in self.shorted_channel:
-                    continue
-                if subsample != -1 and channel_id not in self.freq_change[subsample]:
-                    continue
+        state = np.array(
+            [np.nan if v is None else v for v in self.last_channel_value],
+            dtype=np.float64
+        )
 
-                # If the delta mask is 1, read 2x8 bits
-                byte2read = 2 if channel_id in chan_double_delta else 1
+        stats = getattr(self.reader_parent, 'stats', None)
+        name = None if stats is None else os.path.basename(self.reader_parent.load_filename)
+        start = buf.cursor
+        with stage(stats, 'decode', name) as record:
+            # Scan and decode a block of packets at a time until EOF
+            for block in self.iter_blocks(buf.s, buf.cursor, state, channels=self.channels):
+                self.append_packets(
+                    block.values, block.present, block.is_abs,
+                    self.group_subsample[block.groups], block.ends
+                )
+                buf.cursor = int(block.ends[-1])
+                if stats is not None:
+                    stats.report_progress(name, buf.cursor - start, len(buf.s) - start)
+            self.packets.trim()
+            record['bytes'] = buf.cursor - start
+            record['packets'] = len(self.packets)
 
-                # Read and interpret the result
-                res_read = buf.read(num_read=byte2read)
+        self.last_channel_value = [
+            None if np.isnan(v) else v for v in state.tolist()
+        ]
 
-                # Check if the channel is using absolute value
-                if res_read == FFFF:
-                    abs_channels.append(channel_id)
-                else:
-                    # Shift to restore discarded bits
-                    res_read <<= self.header['discardbits']
-
-                    # Record the channel and delta values
-                    delta_values.append(res_read)
-                    delta_channels.append(channel_id)
-
-            # Read the absolute values if needed
-            abs_values = []
-            for channel_abs in abs_channels:
-                res_read = buf.read(read_format='i')
-                res_read <<= self.header['discardbits']
-                abs_values.append(
-                    res_read*self.reader_parent.channel_factors[channel_abs]
-                )
-                self.last_channel_value[channel_abs] = abs_values[-1]
+    def iter_blocks(self, s, cursor, state, block_packets=None, channels=None):
+        """
+        Decode the packets from cursor on, one PacketBlock at a time.
+        state is the channel state at cursor and is updated in place.
+        values, present and is_abs only have the columns of channels, if
+        given.
+        """
+        if block_packets is None:
+            block_packets = self.decoder.block_packets
+        while True:
+            starts, groups, cursor = self.decoder.scan(s, cursor, block_packets)
+            if not starts:
+                return
+            values, present, is_abs = self.decoder.decode(
+                s, starts, groups, state, channels
+            )
+            starts = np.asarray(starts, dtype=np.int64)
+            yield PacketBlock(
+                starts,
+                np.append(starts[1:], cursor),
+                np.asarray(groups, dtype=np.intp),
+                values, present, is_abs
+            )
 
-            # Final values for the packet
-            values = []
-            channels = delta_channels + abs_channels
+    def iter_from(self, cursor, state, channels=None):
+        """
+        Decode the packets from file offset cursor on, reading the file
+        WINDOW_BYTES at a time (mapped files are sliced instead), so the
+        memory used doesn't grow with the file. A truncated packet at the
+        end, of a file still being written, is left. Yields PacketBlocks
+        with file offsets, state is updated in place.
+        """
+        use_mmap = self.reader_parent.use_mmap
+        while True:
+            buf = self.reader_parent.open_buffer(
+                offset=cursor, size=None if use_mmap else WINDOW_BYTES
+            )
+            end = cursor
+            try:
+                for block in self.iter_blocks(buf.s, 0, state, channels=channels):
+                    end = cursor + int(block.ends[-1])
+                    yield block._replace(starts=block.starts + cursor, ends=block.ends + cursor)
+                window = len(buf.s)
+            finally:
+                buf.close()
 
-            # Apply delta to prev values if applicable
-            for delta, channel_id in zip(delta_values, delta_channels):
-                converted_delta = delta*self.reader_parent.channel_factors[channel_id]
-                values.append(
-                    self.last_channel_value[channel_id]+converted_delta
-                )
-                self.last_channel_value[channel_id] = values[-1]
-            values += abs_values
-
-            # Finally, record all the results
-            self.values_list.append(values)
-            self.channels_list.append(channels)
-            self.subsample_list.append(subsample)
-            self.packet_file_offset.append(buf.cursor)
+            # Done at the end of the file
+            if use_mmap or window < WINDOW_BYTES or end == cursor:
+                return
+            cursor = end
+
+    def index_checkpoints(self, toc_index):
+        """
+        One pass over the file to record the channel state after every
+        packet listed in the .etc table of content, so later reads can
+        start decoding from any table entry.
+        """
+        checkpoints = np.full((len(toc_index), self.n_channels), np.nan)
+        found = np.zeros(len(toc_index), dtype=bool)
+        state = np.full(self.n_channels, np.nan)
+        for block in self.iter_from(self.data_offset, state):
+            idx = toc_index.lookup(block.ends)
+            rows = np.flatnonzero(idx >= 0)
+            checkpoints[idx[rows]] = block.values[rows]
+            found[idx[rows]] = True
+        toc_index.set_checkpoints(checkpoints, found)
+
+    def append_packets(self, values, present, is_abs, subsample, file_offset):
+        flat_values, flat_channels, ptr = self.decoder.to_packets(
+            values, present, is_abs, self.channels
+        )
+        self.packets.append(flat_values, flat_channels, ptr, subsample, file_offset)
+
+    def __len__(self):
+        return len(self.packets)
+
+    @property
+    def packet_file_offset(self):
+        # File offset after each packet
+        return self.packets.file_offset
+
+    def packet_arrays(self, start=0, stop=None):
+        """
+        Packets start to stop as flat arrays: values, channel ids and
+        packet_ptr, where packet t holds entries packet_ptr[t] to
+        packet_ptr[t+1] (relative to the first packet). The arrays are
+        views of the packet store.
+        """
+        if stop is None:
+            stop = len(self)
+        ptr = self.packets.packet_ptr[start:stop+1]
+        return (
+            self.packets.values[ptr[0]:ptr[-1]],
+            self.packets.channel_ids[ptr[0]:ptr[-1]],
+            ptr - ptr[0]
+        )
+
+    def __getstate__(self):
+        # The lists are rebuilt from the packet store when needed
+        state = self.__dict__.copy()
+        for key in PACKET_LISTS:
+            state.pop(key, None)
+        return state
+
+    def __getattr__(self, name):
+        # Per-packet lists of older versions, only built when used
+        if name not in PACKET_LISTS or 'packets' not in self.__dict__:
+            raise AttributeError(name)
+
+        packets = self.packets
+        if name in ['values_list', 'channels_list']:
+            ptr = packets.packet_ptr.tolist()
+            flat_values = packets.values.tolist()
+            flat_channels = packets.channel_ids.tolist()
+            self.values_list = [
+                flat_values[a:b] for a, b in zip(ptr[:-1], ptr[1:])
+            ]
+            self.channels_list = [
+                flat_channels[a:b] for a, b in zip(ptr[:-1], ptr[1:])
+            ]
+        else:
+            self.subsample_list = packets.subsample.tolist()
+        return self.__dict__[name]
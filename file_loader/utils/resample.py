@@ -0,0 +1,67 @@
+import numpy as np
+
+"""
+Resampling of the channel groups of XltekLoader.load(multi_rate=True)
+onto a common grid of sample stamps.
+"""
+
+methods = ['linear', 'previous', 'nearest']
+
+
+def resample(data, stamps, method='linear'):
+    """
+    Values of the channels of data, laid out like EEGData with the sample
+    stamps as the last row, at the given sample stamps. Missing (NaN)
+    samples are skipped. 'linear' interpolates between samples,
+    'previous' holds the last sample and 'nearest' takes the closest one.
+    Stamps before the first or after the last sample of a channel are
+    NaN. Returns an array with the stamps as the last row.
+    """
+    if method not in methods:
+        raise ValueError("Unknown resampling method '{}'".format(method))
+
+    stamps = np.asarray(stamps, dtype=np.float64)
+    out = np.full((len(data), len(stamps)), np.nan)
+    out[-1] = stamps
+    for row, values in enumerate(data[:-1]):
+        valid = ~np.isnan(values)
+        x = data[-1, valid]
+        y = values[valid]
+        if not len(x):
+            continue
+
+        inside = (stamps >= x[0]) & (stamps <= x[-1])
+        if method == 'linear':
+            out[row] = np.interp(stamps, x, y)
+        else:
+            i = np.clip(np.searchsorted(x, stamps, 'right') - 1, 0, len(x) - 1)
+            if method == 'nearest':
+                # Move to the next sample when it is closer
+                after = np.minimum(i + 1, len(x) - 1)
+                i = np.where(x[after] - stamps < stamps - x[i], after, i)
+            out[row] = y[i]
+        out[row, ~inside] = np.nan
+    return out
+
+
+def resample_groups(groups, stamps=None, method='linear'):
+    """
+    Put the EEGGroups of XltekLoader.load(multi_rate=True) back into a
+    single array, resampled at stamps. By default the stamps are those of
+    the full rate group (or of the group with most samples). Returns
+    EEGData and ChannelNames like load().
+    """
+    if stamps is None:
+        if -1 in groups:
+            stamps = groups[-1]['EEGData'][-1]
+        else:
+            stamps = max(
+                (group['EEGData'][-1] for group in groups.values()), key=len
+            )
+
+    data = [resample(group['EEGData'], stamps, method)[:-1] for group in groups.values()]
+    c_names = [c for group in groups.values() for c in group['ChannelNames'][:-1]]
+    return {
+        'EEGData': np.vstack(data + [np.asarray(stamps, dtype=np.float64)[None]]),
+        'ChannelNames': c_names+['SampleStamp']
+    }
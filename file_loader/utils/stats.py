@@ -0,0 +1,125 @@
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+"""
+Instrumentation of the loading pipeline.
+
+A LoadStats given to XltekLoader(stats=...) records one entry per stage
+of each file loader: wall time, bytes read, packets decoded and, with
+track_memory, the peak memory allocated during the stage (traced with
+tracemalloc, which slows allocations down, so it is off by default).
+Stages are nested, e.g. the 'decode' of an .erd file is part of its
+'load'. Without a LoadStats, the loaders skip all of this.
+"""
+
+
+def stage(stats, name, loader=None):
+    """
+    stats.stage(name, loader), or a context yielding a throwaway record
+    when stats is None.
+    """
+    if stats is None:
+        return nullcontext({})
+    return stats.stage(name, loader)
+
+
+class LoadStats:
+    def __init__(self, track_memory=False, progress=None):
+        """
+        progress, if given, is called as progress(loader, bytes_done,
+        bytes_total) while the packets of an .erd file are decoded.
+        """
+        self.track_memory = track_memory
+        self.progress = progress
+        self.records = []
+
+        # Stages open in each thread, for the peaks of nested stages
+        self.local = threading.local()
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def __getstate__(self):
+        # Sent to worker processes without the callback and thread state
+        state = self.__dict__.copy()
+        state['progress'] = None
+        del state['local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    @contextmanager
+    def stage(self, name, loader=None):
+        """
+        Record the stage around the with block. The record (a dict) is
+        yielded, to fill in bytes and packets.
+        """
+        record = {'stage': name, 'loader': loader, 'seconds': 0., 'bytes': 0, 'packets': 0}
+        open_stages = self.local.__dict__.setdefault('open_stages', [])
+        if self.track_memory:
+            # The enclosing stages keep the peak so far, before it is reset
+            current, peak = tracemalloc.get_traced_memory()
+            for outer in open_stages:
+                outer['_peak'] = max(outer['_peak'], peak)
+            tracemalloc.reset_peak()
+            record['_base'] = record['_peak'] = current
+        open_stages.append(record)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            open_stages.pop()
+            if self.track_memory:
+                peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+                record['peak_bytes'] = peak - record.pop('_base')
+                for outer in open_stages:
+                    outer['_peak'] = max(outer['_peak'], peak)
+            self.records.append(record)
+
+    def report_progress(self, loader, done, total):
+        if self.progress is not None:
+            self.progress(loader, done, total)
+
+    def fork(self):
+        # Empty LoadStats with the same settings, for a worker process
+        return LoadStats(self.track_memory)
+
+    def merge(self, other):
+        # Take over the records of a fork, once even if several loaders
+        # share it
+        if other is not None and other is not self:
+            self.records.extend(other.records)
+            other.records = []
+
+    def summary(self):
+        """
+        Totals per stage: count, seconds, bytes, packets and the largest
+        peak_bytes.
+        """
+        totals = dict()
+        for record in self.records:
+            total = totals.setdefault(
+                record['stage'], {'count': 0, 'seconds': 0., 'bytes': 0, 'packets': 0}
+            )
+            total['count'] += 1
+            for key in ['seconds', 'bytes', 'packets']:
+                total[key] += record[key]
+            if 'peak_bytes' in record:
+                total['peak_bytes'] = max(total.get('peak_bytes', 0), record['peak_bytes'])
+        return totals
+
+    def to_json(self, path=None):
+        """
+        The records and the summary as JSON, written to path if given.
+        """
+        text = json.dumps({'records': self.records, 'summary': self.summary()}, indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
@@ -0,0 +1,268 @@
+import os
+import struct
+import numpy as np
+from .raw_data_packet import bitmap_translate
+from .time_base import FILETIME_RATE
+
+"""
+Writer of synthetic NeuroWorks studies, laid out like the data_templates
+expect, for benchmarks and for trying the loader without patient data.
+
+The packets are encoded with NumPy, so long studies with many channels
+are written quickly. Channel values are random: single byte deltas, a
+share of double byte deltas, and absolute values at the first packet of
+every channel and at random afterwards.
+"""
+
+# GUIDs of the generic headers
+FILE_GUID = [-905246832, 298899349, -1610599761, -1521198300]
+STC_GUID = [-373878152, 1297721419, 1913685951, -1648510833]
+
+# FILETIME of the first sample
+START_FILETIME = 130000000000000000
+
+# Subsample rate -> bit of the frequency byte
+subsample_bit = {s: b for b, s in bitmap_translate.items()}
+
+
+def padded_string(text, size):
+    b = text.encode()[:size]
+    return b + b'\x00' * (size - len(b))
+
+
+def generic_header(file_schema, guid=FILE_GUID, name=('Doe', 'John', 'Q', 'PID01')):
+    return (
+        struct.pack('=4ihhIii', *guid, file_schema, 1, 1234567, 7, 42)
+        + b''.join(padded_string(s, 80) for s in name)
+    )
+
+
+def key_tree(d):
+    """
+    Key tree text of a dict, see key_tree_parser.
+    """
+    parts = []
+    for k, v in d.items():
+        if isinstance(v, dict):
+            parts.append('(."{}", {})'.format(k, key_tree(v)))
+        elif isinstance(v, str):
+            parts.append('(."{}", "{}")'.format(k, v))
+        else:
+            parts.append('(."{}", {})'.format(k, v))
+    return '(.' + ', '.join(parts) + ')'
+
+
+def erd_header(num_channels, sample_freq, headbox_type, discardbits,
+               frequency_factor, shorted):
+    factors = [32767] * 1024
+    for channel_id, factor in frequency_factor.items():
+        factors[channel_id] = factor
+    shorted_mask = [0] * 1024
+    for channel_id in shorted:
+        shorted_mask[channel_id] = 1
+    return (
+        struct.pack('=dii', sample_freq, num_channels, 8)
+        + struct.pack('=1024i', *range(1024))
+        + struct.pack('=4i', headbox_type, 0, 0, 0)
+        + struct.pack('=4i', 1, 0, 0, 0)
+        + padded_string('3.5', 40) + padded_string('1', 10) + padded_string('1', 10)
+        + struct.pack('=i', discardbits)
+        + struct.pack('=1024h', *shorted_mask)
+        + struct.pack('=1024h', *factors)
+    )
+
+
+def encode_packets(rng, num_channels, num_packets, frequency_factor, shorted,
+                   double_fraction, abs_fraction, base_offset, return_values=False):
+    """
+    Bytes of num_packets packets, and the file offset after each packet.
+    With return_values, also the value of each channel after each packet
+    (packets x channels), in file units before discardbits and the
+    conversion factors, NaN where the channel isn't in the packet.
+    """
+    # Channel groups, as in PacketDecoder: every packet either holds all
+    # channels, or only the ones of one subsample rate
+    rates = sorted(set(frequency_factor.values()))
+    include = np.ones((1 + len(rates), num_channels), dtype=bool)
+    for g, rate in enumerate(rates):
+        include[g+1] = [frequency_factor.get(c) == rate for c in range(num_channels)]
+    include[:, list(shorted)] = False
+    has_freq = bool(rates)
+
+    # Three out of four packets hold all channels
+    groups = np.zeros(num_packets, dtype=np.intp)
+    if has_freq:
+        slow = rng.random(num_packets) < 0.25
+        groups[slow] = rng.integers(1, 1 + len(rates), slow.sum())
+    present = include[groups]
+
+    # Absolute values at the first packet of each channel, and at random
+    first = np.zeros_like(present)
+    seen = np.cumsum(present, axis=0)
+    first[present & (seen == 1)] = True
+    is_abs = present & (first | (rng.random(present.shape) < abs_fraction))
+    double = is_abs | (present & (rng.random(present.shape) < double_fraction))
+
+    width = present * (1 + double.astype(np.int64))
+    num_mask_bytes = (num_channels + 7) // 8
+    header_size = 1 + int(has_freq) + num_mask_bytes
+    sizes = header_size + width.sum(axis=1) + 4 * is_abs.sum(axis=1)
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    out = np.zeros(int(ends[-1]) if num_packets else 0, dtype=np.uint8)
+
+    # Event byte stays 0, then the frequency byte and the delta mask
+    if has_freq:
+        bits = np.array([subsample_bit[-1]] + [subsample_bit[rate] for rate in rates])
+        out[starts + 1] = 1 << bits[groups]
+    mask = np.zeros((num_packets, num_mask_bytes * 8), dtype=bool)
+    mask[:, :num_channels] = double & present
+    mask_pos = starts + 1 + int(has_freq)
+    out[mask_pos[:, None] + np.arange(num_mask_bytes)] = np.packbits(
+        mask, axis=1, bitorder='little'
+    )
+
+    # Deltas, big endian. FFFF marks an absolute value.
+    pos = (starts + header_size)[:, None] + np.cumsum(width, axis=1) - width
+    single = present & ~double
+    single_values = rng.integers(0, 256, single.sum())
+    out[pos[single]] = single_values
+    two = double & ~is_abs
+    values = rng.integers(256, 65535, two.sum())
+    out[pos[two]] = values >> 8
+    out[pos[two] + 1] = values & 255
+    out[pos[is_abs]] = 255
+    out[pos[is_abs] + 1] = 255
+
+    # Absolute values after the deltas, in channel order
+    abs_rows, _ = np.nonzero(is_abs)
+    abs_rank = np.arange(len(abs_rows)) - np.searchsorted(abs_rows, abs_rows)
+    abs_pos = (starts + header_size + width.sum(axis=1))[abs_rows] + 4 * abs_rank
+    abs_values = rng.integers(-2**20, 2**20, len(abs_rows)).astype('<i4')
+    out[abs_pos[:, None] + np.arange(4)] = abs_values.view(np.uint8).reshape(-1, 4)
+
+    if not return_values:
+        return out.tobytes(), base_offset + ends
+
+    # Running sum of the deltas, restarted at every absolute value
+    deltas = np.zeros(present.shape, dtype=np.int64)
+    deltas[single] = single_values
+    deltas[two] = values
+    running = np.cumsum(deltas, axis=0)
+    restart = np.zeros(present.shape, dtype=np.int64)
+    restart[is_abs] = abs_values - running[is_abs]
+    rows = np.arange(num_packets)[:, None]
+    last_abs = np.maximum.accumulate(np.where(is_abs, rows, -1), axis=0)
+    channel_values = (
+        running + restart[np.maximum(last_abs, 0), np.arange(num_channels)]
+    ).astype(np.float64)
+    channel_values[~present | (last_abs < 0)] = np.nan
+    return out.tobytes(), base_offset + ends, channel_values
+
+
+def write_study(path, name='Pat', headbox_type=1, num_channels=32, duration=60.,
+                sample_freq=512., num_files=2, double_fraction=0.3,
+                abs_fraction=0.001, frequency_factor=None, shorted=(),
+                notes_per_minute=2., toc_every=100, num_videos=2, gap=50, seed=0,
+                return_values=False):
+    """
+    Write a study of duration seconds to directory path, split into
+    num_files .erd/.etc pairs with gap missing samples in between.
+
+    headbox_type selects the channel names and conversion factors (see
+    conversion.json), num_channels has to match it: 32 for headbox types
+    1 and 19, 256 for 3 and 21, 28 for 4, 42 for 5, 36 for 6, 47 for 14,
+    34 for 15, 45 for 17, 276 or 532 for 20, 43 for 22 and 39 for 23.
+    Types 8 and 9 have no channel names and can't be loaded. double_fraction is the share of double byte deltas,
+    abs_fraction the share of absolute values. frequency_factor maps
+    channel indices to their subsample rate (2, 4, 5, 10, 20 or 50), and
+    shorted lists shorted channels. Notes are placed at random stamps.
+    The videos of the .vtc file split the recording evenly, their files
+    are not written.
+
+    Returns the (start, end) sample stamps of each .erd file. With
+    return_values, also the encoded channel values of each .erd file, see
+    encode_packets, to check decoders against.
+    """
+    rng = np.random.default_rng(seed)
+    frequency_factor = dict(frequency_factor or {})
+    for rate in frequency_factor.values():
+        if rate not in subsample_bit or rate == -1:
+            raise ValueError("Unsupported subsample rate {}".format(rate))
+    os.makedirs(path, exist_ok=True)
+
+    def write(suffix, content):
+        with open(os.path.join(path, name + suffix), 'wb') as f:
+            f.write(content)
+
+    write('.eeg', generic_header(3) + key_tree({
+        'Name': 'Synthetic', 'Info': {'Age': 33, 'Sex': 'M', 'Headbox': headbox_type}
+    }).encode() + b'\x00')
+
+    # Packets of each file
+    packets_per_file = max(1, int(round(duration * sample_freq / num_files)))
+    header = generic_header(9) + erd_header(
+        num_channels, sample_freq, headbox_type, 2, frequency_factor, shorted
+    )
+    segments = []
+    file_values = []
+    stamp = 0
+    for file_id in range(num_files):
+        stem = '_{:03d}'.format(file_id)
+        encoded = encode_packets(
+            rng, num_channels, packets_per_file, frequency_factor, shorted,
+            double_fraction, abs_fraction, len(header), return_values
+        )
+        body, ends = encoded[:2]
+        file_values += encoded[2:]
+        write(stem + '.erd', header + body)
+
+        toc = np.array([
+            (ends[t], stamp + t, t, toc_every)
+            for t in range(min(5, packets_per_file - 1), packets_per_file, toc_every)
+        ], dtype='<i4')
+        write(stem + '.etc', generic_header(3) + toc.tobytes())
+
+        segments.append((name + stem, stamp, stamp + packets_per_file - 1))
+        stamp += packets_per_file + gap
+
+    # Segment table
+    stc = generic_header(1, STC_GUID) + struct.pack('=14i', int(sample_freq), num_channels, *[0]*12)
+    for seg_name, start, end in segments:
+        stc += padded_string(seg_name, 256) + struct.pack('=4i', start, end, 0, end - start + 1)
+    write('.stc', stc)
+
+    # A time mapping every 1000 samples
+    filetime_per_sample = FILETIME_RATE / sample_freq
+    snc = generic_header(1)
+    for st in list(range(0, stamp, 1000)) + [stamp]:
+        snc += struct.pack('=iq', st, START_FILETIME + int(round(st * filetime_per_sample)))
+    write('.snc', snc)
+
+    # Notes, each with the length of itself and of the previous note
+    ent = generic_header(3)
+    prev_length = 0
+    for note_id in range(int(notes_per_minute * duration / 60)):
+        text = key_tree({
+            'Stamp': int(rng.integers(stamp)),
+            'Comment': 'note {} (synthetic)'.format(note_id),
+            'Data': {'User': 'bench'}
+        }).encode() + b'\x00'
+        length = len(text) + 16
+        ent += struct.pack('=4i', 0, length, prev_length, note_id) + text
+        prev_length = length
+    write('.ent', ent)
+
+    # Videos covering the recording
+    end_filetime = START_FILETIME + int(round(stamp * filetime_per_sample))
+    bounds = np.linspace(START_FILETIME, end_filetime, num_videos + 1).astype(np.int64)
+    vtc = struct.pack('=5i', 1, 2, 3, 4, 1)
+    for video_id in range(num_videos):
+        vtc += padded_string('{}_{}.avi'.format(name, video_id), 261) \
+            + struct.pack('=4iqq', 0, 0, 0, 0, bounds[video_id], bounds[video_id+1])
+    write('.vtc', vtc)
+
+    segments = [(start, end) for _, start, end in segments]
+    if return_values:
+        return segments, file_values
+    return segments
@@ -0,0 +1,440 @@
+import os
+import struct
+import numpy as np
+from .misc import load_json
+from .expression import expression
+
+"""
+Data templates compiled into reading plans.
+
+A plan is a list of steps, one per entry of the template. Consecutive
+fixed size fields of a section are merged into a single struct.Struct,
+and repeat sections made of fixed size fields only are decoded with one
+np.frombuffer call on a structured dtype. Other fields (key trees,
+strings read until the end, lengths depending on other fields) are read
+one by one with ByteBuffer.read, as before.
+
+Plans are compiled once per process and template file, see
+TemplateRegistry. Templates are found next to the file_loader package,
+not relative to the working directory.
+"""
+
+# Standard size struct characters by (size, signed), used to merge native
+# fields into one unpadded struct
+_int_chars = {
+    (1, True): 'b', (2, True): 'h', (4, True): 'i', (8, True): 'q',
+    (1, False): 'B', (2, False): 'H', (4, False): 'I', (8, False): 'Q'
+}
+
+
+def packed_char(fmt):
+    # Same field as fmt read on its own, but without native alignment
+    if fmt in 'fd?':
+        return fmt
+    return _int_chars[(struct.calcsize(fmt), fmt.islower())]
+
+
+def is_fixed(val):
+    """
+    If the template field [format, num_read, null_terminate] has a size
+    known at compile time.
+    """
+    if not isinstance(val[1], int):
+        return False
+    if val[0] == 'string':
+        return val[1] > 0
+    return isinstance(val[0], str) and len(val[0]) == 1 \
+        and val[0] in 'bBhHiIlLqQfd?'
+
+
+def decode_string(b, null_terminate=True):
+    if null_terminate:
+        b = b.split(b'\x00', 1)[0]
+    return b.decode()
+
+
+class StructBlock:
+    """
+    Consecutive fixed size fields of a section, read with one unpack.
+    """
+    def __init__(self, fields):
+        self.fields = fields
+        self.layout = []
+        fmt = '='
+        for key, val in fields:
+            if val[0] == 'string':
+                null_terminate = bool(val[2]) if len(val) > 2 else True
+                fmt += '{}s'.format(val[1])
+                self.layout.append((key, 'string', null_terminate))
+            else:
+                fmt += '{}{}'.format(val[1], packed_char(val[0]))
+                self.layout.append((key, val[1], None))
+        self.struct = struct.Struct(fmt)
+
+    def __reduce__(self):
+        # Struct can't be pickled, e.g. when sending loaders to processes
+        return StructBlock, (self.fields,)
+
+    def read(self, buf, out):
+        vals = self.struct.unpack_from(buf.s, buf.cursor)
+        buf.cursor += self.struct.size
+
+        i = 0
+        for key, n, null_terminate in self.layout:
+            if n == 'string':
+                out[key] = decode_string(vals[i], null_terminate)
+                i += 1
+            elif n == 1:
+                out[key] = vals[i]
+                i += 1
+            else:
+                out[key] = list(vals[i:i+n])
+                i += n
+
+
+class FieldRead:
+    """
+    Single field of variable size.
+    """
+    def __init__(self, key, val):
+        self.key = key
+        self.val = val
+
+    def read(self, buf, out):
+        out[self.key] = buf.read(*self.val)
+
+
+def compile_fields(fields):
+    # Merge runs of fixed size fields into StructBlocks
+    readers = []
+    run = []
+    for key, val in fields:
+        if is_fixed(val):
+            run.append((key, val))
+            continue
+        if run:
+            readers.append(StructBlock(run))
+            run = []
+        readers.append(FieldRead(key, val))
+    if run:
+        readers.append(StructBlock(run))
+    return readers
+
+
+class Requirement:
+    def __init__(self, name, val):
+        self.name = name
+        self.val = val
+
+    def run(self, file_loader, buf):
+        file_loader.requirements[self.name] = self.val
+
+
+class Special:
+    def __init__(self, name, val):
+        self.name = name
+        self.val = val
+
+    def run(self, file_loader, buf):
+        file_loader.read_special_field(buf, self.name, self.val)
+
+
+class Checkpoint:
+    def __init__(self, key, offset):
+        self.key = key
+        self.offset = offset
+
+    def run(self, file_loader, buf):
+        if buf.cursor != self.offset:
+            raise ValueError("Checkpoint '{}' failed".format(self.key))
+
+
+class Section:
+    def __init__(self, name, fields):
+        self.name = name
+        self.readers = compile_fields(fields.items())
+
+    def run(self, file_loader, buf):
+        out = file_loader.data[self.name] = dict()
+        for reader in self.readers:
+            reader.read(buf, out)
+
+
+class Value:
+    def __init__(self, name, val):
+        self.name = name
+        self.reader = compile_fields([(name, val)])[0]
+
+    def run(self, file_loader, buf):
+        self.reader.read(buf, file_loader.data)
+
+
+class FixedRepeat:
+    """
+    Repeat section of fixed size records, decoded as a structured array.
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        dtype = []
+        for key, val in fields.items():
+            if val[0] == 'string':
+                dtype.append((key, 'S{}'.format(val[1])))
+            elif val[1] == 1:
+                dtype.append((key, np.dtype(val[0])))
+            else:
+                dtype.append((key, np.dtype(val[0]), (val[1],)))
+        self.dtype = np.dtype(dtype)
+
+    def run(self, file_loader, buf):
+        file_loader.data[self.name] = self.read(buf, file_loader.complete_records)
+
+    def read(self, buf, complete=True):
+        # Records until the end of the file. A trailing partial record,
+        # e.g. from a file still being written, is left unread.
+        n = max(0, len(buf.s) - buf.cursor) // self.dtype.itemsize
+        records = np.frombuffer(buf.s, self.dtype, count=n, offset=buf.cursor)
+        buf.cursor += n * self.dtype.itemsize
+
+        out = dict()
+        for key, val in self.fields.items():
+            if val[0] == 'string':
+                # 'S' fields already drop the trailing nulls
+                out[key] = [decode_string(b) for b in records[key].tolist()]
+            else:
+                out[key] = records[key].tolist()
+        return out
+
+
+class Repeat:
+    """
+    Repeat section with fields depending on the previous fields.
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = []
+        for key, val in fields.items():
+            if isinstance(val[1], int):
+                # Specify plain number as num_reads
+                self.fields.append((key, val, None))
+            else:
+                # Specify evaluable as num_reads condition. Itself can't
+                # be used as condition
+                # TODO: Check for cyclic condition
+                length = expression(val[1])
+                names = [n for n in length.names if n in fields and n != key]
+                self.fields.append((key, val, (length, names)))
+
+    def run(self, file_loader, buf):
+        file_loader.data[self.name] = self.read(buf, file_loader.complete_records)
+
+    def read(self, buf, complete=False):
+        """
+        Read records until the end of the file. With complete, a trailing
+        record cut off by the end of the file is left unread.
+        """
+        out = dict()
+        for key, _, _ in self.fields:
+            # Empty list for repeated units
+            out[key] = []
+
+        while not buf.isfinished():
+            start = buf.cursor
+            record = dict()
+            try:
+                for key, val, length in self.fields:
+                    if length is None:
+                        loaded = buf.read(val[0], val[1])
+                    else:
+                        expr, names = length
+                        loaded = buf.read(val[0], expr({
+                            n: record[n] if n in record else out[n][-1] for n in names
+                        }))
+                    record[key] = loaded
+                    if not complete:
+                        out[key].append(loaded)
+                    elif loaded is None:
+                        # Cut off by the end of the file
+                        break
+            except (struct.error, UnicodeDecodeError):
+                # Cut off inside a number, or inside a character of a text
+                if not complete:
+                    raise
+                buf.cursor = len(buf.s) + 1
+
+            if complete:
+                if buf.cursor > len(buf.s) or any(v is None for v in record.values()):
+                    buf.cursor = start
+                    break
+                for key, loaded in record.items():
+                    out[key].append(loaded)
+        return out
+
+
+def compile_step(key_outer, val_outer):
+    if "requirements" in key_outer:
+        return Requirement(key_outer.split(":")[1], val_outer)
+    elif "special" in key_outer:
+        # If there is a special field, pass to the method
+        return Special(key_outer.split(":")[1], val_outer)
+    elif "read_checkpoint" in key_outer:
+        # Run a check on reading offset
+        return Checkpoint(key_outer, val_outer)
+    elif "repeat" in key_outer:
+        # When in repeat, read until the end and repeatedly fill in a dict
+        name = key_outer.split(":")[1]
+        if all(is_fixed(val) and (val[0] != 'string' or len(val) < 3 or val[2])
+               for val in val_outer.values()):
+            return FixedRepeat(name, val_outer)
+        return Repeat(name, val_outer)
+
+    # TODO: Only support 2 levels of hierarchy for now
+    if isinstance(val_outer, dict):
+        return Section(key_outer, val_outer)
+    return Value(key_outer, val_outer)
+
+
+class TemplatePlan:
+    def __init__(self, data_template):
+        self.steps = [
+            compile_step(key_outer, val_outer)
+            for key_outer, val_outer in data_template.items()
+        ]
+
+    def run(self, file_loader, buf):
+        for step in self.steps:
+            step.run(file_loader, buf)
+
+    def header_steps(self):
+        # Steps up to the first special or repeat section, or the first
+        # field whose size depends on the file content
+        for step in self.steps:
+            if isinstance(step, (Special, Repeat, FixedRepeat)):
+                return
+            if isinstance(step, (Section, Value)):
+                readers = step.readers if isinstance(step, Section) else [step.reader]
+                if not all(isinstance(reader, StructBlock) for reader in readers):
+                    return
+            yield step
+
+    def run_header(self, file_loader, buf):
+        """
+        Run the fixed size steps before the first special or repeat section
+        or variable size field, and the requirements. Nothing after that is
+        read.
+        """
+        header_steps = list(self.header_steps())
+        for step in self.steps:
+            if step in header_steps or isinstance(step, Requirement):
+                step.run(file_loader, buf)
+
+    def header_end(self, start=0):
+        """
+        File offset where the steps read by run_header end, when they are
+        run from offset start.
+        """
+        end = start
+        for step in self.header_steps():
+            if isinstance(step, Checkpoint):
+                end = step.offset
+            elif isinstance(step, Section):
+                end += sum(reader.struct.size for reader in step.readers)
+            elif isinstance(step, Value):
+                end += step.reader.struct.size
+        return end
+
+    def read_records(self, buf, complete=True):
+        """
+        Read the repeat sections from the cursor on, without the rest of
+        the template. Returns {section name: records}.
+        """
+        return {
+            step.name: step.read(buf, complete) for step in self.steps
+            if isinstance(step, (Repeat, FixedRepeat))
+        }
+
+
+# data_templates directory next to the file_loader package
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'data_templates'
+)
+
+
+class TemplateRegistry:
+    """
+    Data templates and conversion tables of a template directory, each
+    compiled or read once and kept for the whole process.
+    """
+    def __init__(self, template_dir=TEMPLATE_DIR):
+        self.template_dir = template_dir
+
+        # Compiled plans and conversion tables by path
+        self.plans = dict()
+        self.tables = dict()
+
+    def template_path(self, file_type, file_schema=None):
+        """
+        Path of the data template of file_type for file_schema, or of the
+        template of file types without schema. file_type 'generic' is the
+        generic header, with the base schema as file_schema.
+        """
+        if file_type == 'generic':
+            return os.path.join(
+                self.template_dir,
+                'generic_header_data_template_schema_{}.json'.format(file_schema)
+            )
+        if file_schema is None:
+            return os.path.join(self.template_dir, file_type, 'data_template.json')
+        return os.path.join(
+            self.template_dir, file_type, 'file_schema_{}'.format(file_schema),
+            'data_template.json'
+        )
+
+    def plan(self, file_type, file_schema=None):
+        return self.load_plan(self.template_path(file_type, file_schema))
+
+    def load_plan(self, path):
+        if path not in self.plans:
+            self.plans[path] = TemplatePlan(load_json(path))
+        return self.plans[path]
+
+    def table(self, file_type, file_schema, name='conversion.json'):
+        """
+        Conversion table of file_type for file_schema, as loaded from JSON.
+        Shared, so it must not be modified.
+        """
+        path = os.path.join(
+            self.template_dir, file_type, 'file_schema_{}'.format(file_schema), name
+        )
+        if path not in self.tables:
+            self.tables[path] = load_json(path)
+        return self.tables[path]
+
+    def warm(self):
+        """
+        Compile every data template and read every conversion table of
+        the directory, e.g. once in each worker process.
+        """
+        for dir_path, _, file_names in os.walk(self.template_dir):
+            for f in sorted(file_names):
+                path = os.path.join(dir_path, f)
+                if f == 'conversion.json':
+                    if path not in self.tables:
+                        self.tables[path] = load_json(path)
+                elif f.endswith('.json'):
+                    self.load_plan(path)
+        return self
+
+
+# Registry of the process
+templates = TemplateRegistry()
+
+
+def warm_templates():
+    # Initializer of worker processes
+    templates.warm()
+
+
+def load_plan(path):
+    return templates.load_plan(path)
@@ -0,0 +1,155 @@
+import numpy as np
+
+"""
+Conversion between sample stamps and FILETIME (100 ns units), using the
+time mappings of the .snc file.
+
+Between two mappings, times are linearly interpolated. Where the FILETIME
+advanced much more than the samples did, the recording was paused: such
+gaps are found by comparing against the nominal rate, and the samples
+before a gap keep the nominal rate up to the next mapping. Clock resets,
+where the FILETIME goes back while the samples go on, are handled the
+same way. All conversions are computed relative to the closest mapping, so
+FILETIMEs stay exact integers.
+"""
+
+# FILETIME units per second
+FILETIME_RATE = 10 ** 7
+
+
+class TimeBase:
+    def __init__(self, samplestamp, filetime, sample_freq=None, gap_tolerance=0.5):
+        """
+        samplestamp and filetime are the .snc time mappings. The nominal
+        rate comes from sample_freq if given, and from the median rate of
+        the mappings otherwise. A step between mappings is a gap when its
+        rate is more than gap_tolerance over the nominal rate.
+        """
+        order = np.argsort(np.asarray(samplestamp, dtype=np.int64), kind='stable')
+        self.samplestamp = np.asarray(samplestamp, dtype=np.int64)[order]
+        self.filetime = np.asarray(filetime, dtype=np.int64)[order]
+        if len(self.samplestamp) < 2:
+            raise ValueError("Need at least 2 time mappings")
+
+        d_stamp = np.diff(self.samplestamp)
+        d_time = np.diff(self.filetime)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.rates = d_time / d_stamp
+
+        # FILETIME units per sample
+        if sample_freq is not None:
+            self.nominal_rate = FILETIME_RATE / sample_freq
+        else:
+            valid = (d_stamp > 0) & (d_time > 0)
+            if not valid.any():
+                raise ValueError("Time mappings don't advance")
+            self.nominal_rate = float(np.median(self.rates[valid]))
+
+        # Steps between mapping i and i+1
+        self.resets = np.flatnonzero(d_time < 0)
+        self.gaps = np.flatnonzero(
+            (d_time > 0) & ((d_stamp == 0) | (self.rates > self.nominal_rate * (1 + gap_tolerance)))
+        )
+
+        # Rate used in each step, and beyond the ends
+        self.step_rates = np.where(np.isfinite(self.rates), self.rates, self.nominal_rate)
+        self.step_rates[self.gaps] = self.nominal_rate
+        self.step_rates[self.resets] = self.nominal_rate
+
+        # Monotonic runs of FILETIME, split at the resets
+        self.runs = np.split(np.arange(len(self.samplestamp)), self.resets + 1)
+
+    @classmethod
+    def from_loader(cls, snc_loader, sample_freq=None, **kwargs):
+        time_mappings = snc_loader.data['time_mappings']
+        return cls(
+            time_mappings['samplestamp'], time_mappings['sample_time'],
+            sample_freq, **kwargs
+        )
+
+    def __len__(self):
+        return len(self.samplestamp)
+
+    def step_rate(self, i):
+        # Rate after mapping i, the last step goes on after the end
+        return self.step_rates[np.minimum(i, len(self) - 2)]
+
+    def stamp_to_filetime(self, stamps):
+        """
+        FILETIME of the sample stamps, an int64 array.
+        """
+        stamps = np.asarray(stamps, dtype=np.int64)
+        # Mapping at or before each stamp, the first one before the start
+        i = np.clip(np.searchsorted(self.samplestamp, stamps, 'right') - 1, 0, len(self) - 1)
+        offset = stamps - self.samplestamp[i]
+        return self.filetime[i] + np.round(offset * self.step_rate(i)).astype(np.int64)
+
+    def run_ranges(self):
+        # FILETIMEs covered by each run. The samples after the last
+        # mapping of a run go on until the reset.
+        lo = np.array([self.filetime[run[0]] for run in self.runs], dtype=np.float64)
+        hi = np.array([
+            self.filetime[run[-1]] + (
+                (self.samplestamp[run[-1]+1] - self.samplestamp[run[-1]]) * self.nominal_rate
+                if run[-1] < len(self) - 1 else 0
+            )
+            for run in self.runs
+        ], dtype=np.float64)
+        return lo, hi
+
+    def filetime_to_stamp(self, filetimes):
+        """
+        Sample stamp at the FILETIMEs, a float64 array. Times inside a gap
+        map to the sample stamp the recording goes on with. When the clock
+        was reset, times that occur more than once map to the earliest
+        samples, and times outside of the mappings use the closest part
+        of them.
+        """
+        filetimes = np.asarray(filetimes, dtype=np.int64)
+        lo, hi = self.run_ranges()
+        covered = (filetimes[..., None] >= lo) & (filetimes[..., None] <= hi)
+        distance = np.maximum(lo - filetimes[..., None], filetimes[..., None] - hi)
+        # First run covering the time, else the closest one
+        run_ids = np.where(
+            covered.any(axis=-1), covered.argmax(axis=-1), distance.argmin(axis=-1)
+        )
+
+        res = np.empty(filetimes.shape)
+        for n, run in enumerate(self.runs):
+            sel = run_ids == n
+            if not sel.any():
+                continue
+
+            j = np.searchsorted(self.filetime[run], filetimes[sel], 'right') - 1
+            i = run[np.clip(j, 0, len(run) - 1)]
+            stamp = self.samplestamp[i] + (filetimes[sel] - self.filetime[i]) / self.step_rate(i)
+
+            # Inside gaps, stay before the next mapping
+            in_gap = np.isin(i, self.gaps) & (j >= 0)
+            stamp[in_gap] = np.minimum(stamp[in_gap], self.samplestamp[i[in_gap]+1])
+            res[sel] = stamp
+        return res
+
+    def gap_list(self):
+        """
+        (sample stamp, FILETIME start, FILETIME end) of each gap. The
+        samples stop at the start time and go on at the end time.
+        """
+        return [
+            (
+                int(self.samplestamp[i+1]),
+                int(self.filetime[i] + round(
+                    (self.samplestamp[i+1] - self.samplestamp[i]) * self.nominal_rate
+                )),
+                int(self.filetime[i+1])
+            )
+            for i in self.gaps
+        ]
+
+    def add_filetime(self, chunk):
+        """
+        Append a FILETIME row to an EEG chunk laid out like EEGData,
+        using its last row (the sample stamps). The FILETIME row is
+        float64 like the chunk, which is exact up to a few microseconds.
+        """
+        return np.vstack([chunk, self.stamp_to_filetime(chunk[-1].astype(np.int64))])
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class TocIndex:
+    """
+    Index over the table of content of an .etc file. Entries are kept
+    sorted by their .erd file offset, so packet offsets can be looked
+    up with searchsorted.
+    """
+    def __init__(self, table_of_content):
+        # Older schemas call the sample stamp timestamp
+        stamp_key = 'samplestamp' if 'samplestamp' in table_of_content else 'timestamp'
+
+        offset = np.asarray(table_of_content['offset'], dtype=np.int64)
+        order = np.argsort(offset, kind='stable')
+        self.offset = offset[order]
+        self.samplestamp = np.asarray(
+            table_of_content[stamp_key], dtype=np.int64
+        )[order]
+        self.sample_num = np.asarray(
+            table_of_content['sample_num'], dtype=np.int64
+        )[order]
+        self.sample_span = np.asarray(
+            table_of_content['sample_span'], dtype=np.int64
+        )[order]
+
+        # Channel state after each entry's packet, see set_checkpoints
+        self.checkpoints = None
+        self.has_checkpoint = np.zeros(len(self.offset), dtype=bool)
+
+    def __len__(self):
+        return len(self.offset)
+
+    def extend(self, table_of_content):
+        """
+        Add entries, e.g. the ones appended to an .etc file since it was
+        read. New entries have no checkpoint.
+        """
+        other = TocIndex(table_of_content)
+        self.offset = np.concatenate([self.offset, other.offset])
+        self.samplestamp = np.concatenate([self.samplestamp, other.samplestamp])
+        self.sample_num = np.concatenate([self.sample_num, other.sample_num])
+        self.sample_span = np.concatenate([self.sample_span, other.sample_span])
+        self.has_checkpoint = np.concatenate([self.has_checkpoint, other.has_checkpoint])
+        if self.checkpoints is not None:
+            self.checkpoints = np.concatenate([
+                self.checkpoints,
+                np.full((len(other), self.checkpoints.shape[1]), np.nan)
+            ])
+
+        # Entries are usually appended in offset order
+        if len(other) and len(self) > len(other) \
+                and other.offset[0] < self.offset[-len(other)-1]:
+            order = np.argsort(self.offset, kind='stable')
+            for name in ['offset', 'samplestamp', 'sample_num', 'sample_span', 'has_checkpoint']:
+                setattr(self, name, getattr(self, name)[order])
+            if self.checkpoints is not None:
+                self.checkpoints = self.checkpoints[order]
+
+    def lookup(self, offsets):
+        """
+        Entry index of each offset, -1 if the offset is not in the table.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(offsets.shape, -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.offset, offsets), len(self)-1)
+        return np.where(self.offset[idx] == offsets, idx, -1)
+
+    def covered_by(self, offsets):
+        """
+        Whether every entry of the table is one of the given offsets.
+        """
+        idx = self.lookup(offsets)
+        return np.unique(idx[idx >= 0]).size == np.unique(self.offset).size
+
+    def stamp_packets(self, packet_offsets, last_stamp=-1):
+        """
+        Sample stamp of each packet. Packets in the table get the stamp
+        of their entry, the others are assumed to be the last sample
+        stamp + 1.
+        """
+        idx = self.lookup(packet_offsets)
+
+        # Count up from last_stamp until a packet is in the table
+        t = np.arange(len(idx))
+        stamps = last_stamp + 1 + t
+
+        # Packets in the table restart the count from their entry
+        anchor = np.maximum.accumulate(np.where(idx >= 0, t, -1))
+        anchored = anchor >= 0
+        stamps[anchored] = self.samplestamp[idx[anchor[anchored]]] \
+            + t[anchored] - anchor[anchored]
+        return stamps
+
+    def set_checkpoints(self, checkpoints, found):
+        """
+        checkpoints is a (entries x channels) array with the decoder state
+        after the packet of each entry, found marks the valid rows.
+        """
+        self.checkpoints = checkpoints
+        self.has_checkpoint = found
+
+    def seek(self, samplestamp):
+        """
+        Entry with a checkpoint closest before samplestamp, or -1. The
+        packets decoded from its offset on start at its stamp + 1.
+        """
+        candidates = np.flatnonzero(
+            self.has_checkpoint & (self.samplestamp < samplestamp)
+        )
+        if len(candidates) == 0:
+            return -1
+        return candidates[np.argmax(self.samplestamp[candidates])]
@@ -0,0 +1,139 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Timing of the video frames of a study.
+
+Each video of the .vtc table of content spans from its start to its end
+FILETIME, with its frames spread evenly in between. Only the number of
+frames has to be read from the video files themselves. Frame counts are
+cached per file (path, size and modification time), and cv2 is only
+imported when a video has to be opened.
+"""
+
+# Frame counts by (path, size, mtime)
+_frame_counts = {}
+
+
+def frame_count(path):
+    """
+    Number of frames of the video at path, 0 if it doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _frame_counts:
+        import cv2
+        vid = cv2.VideoCapture(path)
+        # Unknown counts are negative
+        _frame_counts[key] = max(0, int(vid.get(cv2.CAP_PROP_FRAME_COUNT)))
+        vid.release()
+    return _frame_counts[key]
+
+
+class VideoFrames:
+    def __init__(self, vtc_loader, path, time_base=None, workers=8):
+        """
+        Videos of vtc_loader's table of content, found in directory path,
+        none if vtc_loader is None. The TimeBase time_base is needed for
+        samples_for_frame. The videos are opened in a pool of workers
+        threads.
+        """
+        if vtc_loader is None:
+            entries = {'video_filename': [], 'filetime_starttime': [], 'filetime_endtime': []}
+        else:
+            entries = vtc_loader.data['video_toc_entry']
+        self.files = [os.path.join(path, f) for f in entries['video_filename']]
+        self.starts = np.asarray(entries['filetime_starttime'], dtype=np.int64)
+        self.ends = np.asarray(entries['filetime_endtime'], dtype=np.int64)
+        self.workers = workers
+
+        self.time_base = time_base
+
+        # Built when first needed
+        self._frame_counts = None
+        self._filetimes = None
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def frame_counts(self):
+        if self._frame_counts is None:
+            with ThreadPoolExecutor(max(1, min(self.workers, len(self.files)))) as pool:
+                counts = list(pool.map(frame_count, self.files))
+            self._frame_counts = np.asarray(counts, dtype=np.int64)
+        return self._frame_counts
+
+    @property
+    def first_frames(self):
+        # Index of the first frame of each video in filetimes
+        return np.concatenate([[0], np.cumsum(self.frame_counts)[:-1]]).astype(np.int64)
+
+    @property
+    def filetimes(self):
+        """
+        FILETIME of every frame of every video, one video after another.
+        """
+        if self._filetimes is None:
+            times = [
+                np.linspace(start, end, n, dtype=int)
+                for start, end, n in zip(self.starts, self.ends, self.frame_counts)
+            ]
+            self._filetimes = np.concatenate(times) if times else np.zeros(0, dtype=int)
+        return self._filetimes
+
+    def frame_filetime(self, video, frame):
+        """
+        FILETIME of the given frames of the given videos (arrays of the
+        same shape), without building filetimes.
+        """
+        video = np.asarray(video)
+        frame = np.asarray(frame)
+        n = self.frame_counts[video]
+        start = self.starts[video].astype(np.float64)
+        # Same as the np.linspace of filetimes
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = (self.ends[video].astype(np.float64) - start) / (n - 1)
+        times = np.where(n > 1, frame * step, 0) + start
+        times = np.where((frame == n - 1) & (n > 1), self.ends[video], np.floor(times))
+        return times.astype(np.int64)
+
+    def frame_for_filetime(self, filetime):
+        """
+        (video, frame) of the frame closest to each FILETIME. Both are -1
+        for times not covered by any video.
+        """
+        filetime = np.asarray(filetime, dtype=np.int64)
+        if not len(self.files):
+            none = np.full(filetime.shape, -1, dtype=np.int64)
+            return none, none.copy()
+
+        order = np.argsort(self.starts, kind='stable')
+        i = np.searchsorted(self.starts[order], filetime, 'right') - 1
+        video = np.where(i >= 0, order[np.maximum(i, 0)], -1)
+
+        n = self.frame_counts[video]
+        start = self.starts[video]
+        span = self.ends[video] - start
+        inside = (i >= 0) & (filetime <= self.ends[video]) & (n > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frame = np.round((filetime - start) / span * (n - 1))
+        frame = np.where(span > 0, frame, 0)
+
+        video = np.where(inside, video, -1)
+        frame = np.where(inside, np.clip(frame, 0, np.maximum(n - 1, 0)), -1)
+        return video, frame.astype(np.int64)
+
+    def samples_for_frame(self, video, frame):
+        """
+        Sample stamp of the given frames of the given videos, a float64
+        array.
+        """
+        if self.time_base is None:
+            raise ValueError("VideoFrames was built without a TimeBase")
+        return self.time_base.filetime_to_stamp(self.frame_filetime(video, frame))
@@ -1,7 +1,16 @@
 import os
 import numpy as np
 from collections import OrderedDict
-from .utils.misc import frame_filetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .utils.cache import DecodedCache
+from .utils.export import writers
+from .utils.key_tree_parser import LazyKeyTree
+from .utils.note_index import NoteIndex
+from .utils.stats import stage
+from .utils.template_plan import warm_templates
+from .utils.video import VideoFrames
+from .utils.time_base import TimeBase
 
 from .file_types.eeg_file import EEGLoader
 from .file_types.erd_file import ERDLoader
@@ -21,109 +30,313 @@ loaders = OrderedDict(
     vtc=[VTCLoader, "vtc_loader"]
 )
 
+# Packets placed into the combined array per batch
+COMBINE_BLOCK_PACKETS = 1 << 16
+
+
+def scan_headers(load_dir):
+    """
+    Summary of the study in load_dir from its file headers, see
+    XltekLoader.scan_headers.
+    """
+    return XltekLoader(load_dir, load_video=False).scan_headers()
+
+
+def load_files(*file_loaders):
+    """
+    Load the given file loaders and return them. Task of the parallel
+    reads; with processes the loaded objects are pickled back, with the
+    packets as flat arrays (see PacketStore).
+    """
+    for file_loader in file_loaders:
+        file_loader.load()
+    return file_loaders
+
+
+def block_data(block, stamps):
+    """
+    Columns of a PacketBlock laid out like EEGData: the decoded channels,
+    then a SampleStamp row with stamps.
+    """
+    # Channels not in a packet are nan
+    values = np.where(block.present, block.values, np.nan)
+    return np.vstack([values.T, stamps])
+
+
 class XltekLoader:
-    def __init__(self, load_dir):
+    def __init__(self, load_dir, use_mmap=False, workers=1, executor='process',
+                 cache_dir=None, cache_max_bytes=None, lazy_notes=False,
+                 load_video=True, value_dtype=np.float64, stats=None):
+        """
+        stats is an optional LoadStats, recording the time, bytes, packets
+        and memory of each loading stage.
+        """
+        if executor not in ['process', 'thread']:
+            raise ValueError("executor has to be 'process' or 'thread'")
         self.load_dir = load_dir
+        self.workers = workers
+        self.executor = executor
+        self.load_video = load_video
+        self.use_mmap = use_mmap
+        self.lazy_notes = lazy_notes
+        self.value_dtype = value_dtype
+        self.stats = stats
         self.files_dict = dict()
         self.loaders_dict = OrderedDict()
 
-        # First scan for files of interest
-        for f in os.listdir(load_dir):
-            f_full = os.path.join(load_dir, f)
+        # Opt-in cache of the decoded files
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = DecodedCache(cache_dir, cache_max_bytes)
+
+        with stage(self.stats, 'scan_files'):
+            self.scan_files()
+
+        # .erd file of each .stc segment, see read_segments
+        self.segments = None
+
+        # VideoFrames, see video_frames
+        self.frames = None
+
+        # Memoized values of the lazy properties, by name
+        self.lazy = dict()
+
+        # Read positions of a study being recorded, see refresh
+        self.tail = None
+
+    def scan_files(self):
+        """
+        Scan the directory for files of interest, and assign a file
+        loader to each file that doesn't have one yet. Returns the names
+        of the new loaders.
+        """
+        # Sorted, so that the n-th .erd and .etc files belong together
+        files_dict = dict()
+        for f in sorted(os.listdir(self.load_dir)):
+            f_full = os.path.join(self.load_dir, f)
             if os.path.isfile(f_full):
                 file_split_lst = f.split('.')
                 if file_split_lst[-2].endswith('new'): continue
                 file_type = file_split_lst[-1]
                 if file_type in loaders.keys():
-                    if file_type not in self.files_dict.keys():
-                        self.files_dict[file_type] = []
-                    self.files_dict[file_type].append(f_full)
+                    if file_type not in files_dict.keys():
+                        files_dict[file_type] = []
+                    files_dict[file_type].append(f_full)
 
         # Assign file loaders for each of the files
+        new_loaders = []
         for file_type in loaders.keys():
-            for f_id, f in enumerate(self.files_dict[file_type]):
+            # Not every study has every file type, e.g. no .vtc without video
+            files_dict[file_type] = files_dict.get(file_type, [])
+            for f_id, f in enumerate(files_dict[file_type]):
                 loader_type, loader_name = loaders[file_type]
-                self.loaders_dict[loader_name.format(f_id)] = loader_type(f)
+                if loader_name.format(f_id) in self.loaders_dict:
+                    continue
+                file_loader = loader_type(f)
+                file_loader.use_mmap = self.use_mmap
+                file_loader.cache = self.cache
+                file_loader.stats = self.stats
+                if file_type == 'erd':
+                    file_loader.value_dtype = self.value_dtype
+                if file_type == 'ent':
+                    file_loader.lazy_notes = self.lazy_notes
+                self.loaders_dict[loader_name.format(f_id)] = file_loader
+                new_loaders.append(loader_name.format(f_id))
+        self.files_dict = files_dict
+        return new_loaders
 
-    def combine_files(self):
-        total_samples = -1
-        lst_data = []
+    def iter_loaded_files(self):
+        """
+        (.erd loader, its RawDataObject, sample stamp of each packet) of
+        the loaded .erd files, in .stc segment order.
+        """
+        num_channels = self.loaders_dict['erd_loader_0'].num_channels
+        num_files = len(self.files_dict['etc'])
 
-        # Get sequences and concat together
-        for loader_id in range(len(self.files_dict['etc'])):
+        last_stamp = -1
+        for loader_id, seg_start in self.file_order():
+            if loader_id >= num_files:
+                continue
 
             erd_loader = self.loaders_dict['erd_loader_{}'.format(loader_id)]
             etc_loader = self.loaders_dict['etc_loader_{}'.format(loader_id)]
             packets = erd_loader.data['data_packets']
 
-            # TODO: Find the length of this array and preallocate
-            data_file = []
-
-            # Assign sample stamp for each packet
-            for t, val in enumerate(packets.values_list):
-                slice_data = np.zeros((erd_loader.num_channels+1,1))
-
-                for channel_id in range(erd_loader.num_channels):
-                    # If the channel is not included in some packet,
-                    # mark as nan. Interpolate them later.
-                    try:
-                        channel_val_idx = packets.channels_list[t].index(channel_id)
-                        slice_data[channel_id] = val[channel_val_idx]
-                    except ValueError as e:
-                        if "is not in list" in str(e):
-                            slice_data[channel_id] = np.NAN
-
-                # If offset is not in their respective toc file,
-                # assume it's just last sample stamp + 1
-                try:
-                    offset = packets.values_list[t]
-                    offset_idx = etc_loader.data['table_of_content']['offset'].index(offset)
-                    sample_stamp = etc_loader.data['samplestamp'].index(offset_idx)
-                except ValueError as e:
-                    if "is not in list" in str(e):
-                        sample_stamp = total_samples + 1
-                total_samples  = sample_stamp
-
-                slice_data[-1, 0] = sample_stamp
-                data_file.append(slice_data)
-            
-            lst_data.append(
-                np.concatenate(data_file, axis=1)
+            if erd_loader.num_channels != num_channels:
+                raise ValueError(
+                    "Number of channels of {} differs from the first .erd "
+                    "file".format(erd_loader.load_filename)
+                )
+
+            # Assign sample stamp for each packet, counting from the
+            # segment start until the first table entry
+            if seg_start is not None:
+                last_stamp = seg_start - 1
+            stamps = etc_loader.toc_index.stamp_packets(
+                packets.packet_file_offset, last_stamp
             )
+            if len(stamps):
+                last_stamp = stamps[-1]
+            yield erd_loader, packets, stamps
 
-        # TODO: Make sure the names are sorted?
+    def combine_eeg(self, channel_ids):
+        """
+        EEGData of the selected channels, one column per packet.
+        """
+        num_channels = self.loaders_dict['erd_loader_0'].num_channels
+
+        # Row of each stored channel. The .erd files hold each selected
+        # channel once, in index order.
+        stored = np.unique(channel_ids)
+        row_of = np.full(num_channels, -1)
+        row_of[stored] = np.arange(len(stored))
+
+        # Preallocate the whole array, one column per packet
+        num_packets = sum(
+            len(self.loaders_dict['erd_loader_{}'.format(loader_id)].data['data_packets'])
+            for loader_id in range(len(self.files_dict['etc']))
+        )
+        data_array = np.full((len(stored)+1, num_packets), np.nan)
+
+        # Get sequences and place them one after another
+        column = 0
+        for erd_loader, packets, stamps in self.iter_loaded_files():
+            # If the channel is not included in some packet,
+            # it stays nan. See resample_groups to fill them.
+            for t_start in range(0, len(packets), COMBINE_BLOCK_PACKETS):
+                t_end = min(t_start+COMBINE_BLOCK_PACKETS, len(packets))
+                values, packet_channels, ptr = packets.packet_arrays(t_start, t_end)
+                columns = np.repeat(
+                    np.arange(column+t_start, column+t_end), np.diff(ptr)
+                )
+                data_array[row_of[packet_channels], columns] = values
+
+            data_array[-1, column:column+len(packets)] = stamps
+            column += len(packets)
+
+        # Rows in the order asked for
+        if not np.array_equal(stored, channel_ids):
+            data_array = data_array[
+                np.append(np.searchsorted(stored, channel_ids), len(stored))
+            ]
+        return data_array
+
+    def combine_groups(self, channel_ids):
+        """
+        EEG of the selected channels grouped by their subsample rate
+        (-1 for full rate channels). Each group only has columns for the
+        packets holding its channels. Returns {subsample: group}, where
+        group has EEGData (with a SampleStamp row), ChannelNames and
+        SampleFreq.
+        """
+        erd_loader = self.loaders_dict['erd_loader_0']
+        num_channels = erd_loader.num_channels
+        channel_subsample = erd_loader.data['data_packets'].channel_subsample()
+        channel_ids = np.asarray(channel_ids, dtype=np.intp)
+
+        # Full rate first, then slower and slower
+        keys = sorted(set(channel_subsample[channel_ids].tolist()), key=lambda s: (s != -1, s))
+        group_of = np.full(num_channels, -1)
+        row_of = np.full(num_channels, -1)
+        group_channels = []
+        for g, key in enumerate(keys):
+            channels = np.unique(channel_ids[channel_subsample[channel_ids] == key])
+            group_of[channels] = g
+            row_of[channels] = np.arange(len(channels))
+            group_channels.append(channels)
+
+        def iter_entries(packets):
+            # Packet, group and row of the stored values, a batch at a time
+            for t_start in range(0, len(packets), COMBINE_BLOCK_PACKETS):
+                t_end = min(t_start+COMBINE_BLOCK_PACKETS, len(packets))
+                values, packet_channels, ptr = packets.packet_arrays(t_start, t_end)
+                rows = np.repeat(np.arange(t_start, t_end), np.diff(ptr))
+                yield values, rows, group_of[packet_channels], row_of[packet_channels]
+
+        # First find the packets holding channels of each group
+        files = list(self.iter_loaded_files())
+        has_group = []
+        for _, packets, _ in files:
+            has = np.zeros((len(keys), len(packets)), dtype=bool)
+            for _, rows, groups, _ in iter_entries(packets):
+                has[groups[groups >= 0], rows[groups >= 0]] = True
+            has_group.append(has)
+
+        num_columns = sum(has.sum(axis=1) for has in has_group)
+        arrays = [
+            np.full((len(channels)+1, n), np.nan)
+            for channels, n in zip(group_channels, np.broadcast_to(num_columns, len(keys)))
+        ]
+
+        # Then place the values into their group
+        start = np.zeros(len(keys), dtype=np.int64)
+        for (_, packets, stamps), has in zip(files, has_group):
+            columns = start[:, None] + np.cumsum(has, axis=1) - 1
+            for values, rows, groups, channel_rows in iter_entries(packets):
+                for g in range(len(keys)):
+                    sel = groups == g
+                    arrays[g][channel_rows[sel], columns[g, rows[sel]]] = values[sel]
+            for g in range(len(keys)):
+                arrays[g][-1, start[g]:start[g]+has[g].sum()] = stamps[has[g]]
+            start += has.sum(axis=1)
+
+        sample_freq = erd_loader.data['raw_data_file_header']['sample_freq']
+        c_names = erd_loader.channel_names
+        groups = OrderedDict()
+        for key, channels, data_array in zip(keys, group_channels, arrays):
+            # Rows in the order asked for
+            asked = channel_ids[channel_subsample[channel_ids] == key]
+            if not np.array_equal(channels, asked):
+                data_array = data_array[
+                    np.append(np.searchsorted(channels, asked), len(channels))
+                ]
+            groups[key] = {
+                'EEGData': data_array,
+                'ChannelNames': [c_names[c] for c in asked]+['SampleStamp'],
+                'SampleFreq': sample_freq if key == -1 else sample_freq / key
+            }
+        return groups
+
+    def combine_files(self, channel_ids=None, multi_rate=False):
+        with stage(self.stats, 'combine_files'):
+            return self._combine_files(channel_ids, multi_rate)
 
-        # Concat them all in time
-        data_array = np.concatenate(lst_data, axis=1)
-        # TODO: Is this always possible?
+    def _combine_files(self, channel_ids, multi_rate):
+        if channel_ids is None:
+            channel_ids = list(range(self.loaders_dict['erd_loader_0'].num_channels))
+
+        if multi_rate:
+            eeg = {'EEGGroups': self.combine_groups(channel_ids)}
+        else:
+            # Return channel names for the array (plus sample stamp).
+            # TODO: Check that the channel orders/presence the same for different files
+            c_names = self.loaders_dict['erd_loader_0'].channel_names
+            eeg = {
+                'EEGData': self.combine_eeg(channel_ids),
+                'ChannelNames': [c_names[c] for c in channel_ids]+['SampleStamp']
+            }
+
+        # TODO: Make sure the names are sorted?
 
         # Use snc to create FILETIME for each packet
         samplestamp = self.loaders_dict['snc_loader'].data['time_mappings']['samplestamp']
         filetime = self.loaders_dict['snc_loader'].data['time_mappings']['sample_time']
 
-        # Use start & end filetime of video to interpolate each frame's filetime
-        frame_filetime_lst = frame_filetime(
-            self.loaders_dict['vtc_loader'],
-            self.load_dir  
+        # Use start & end filetime of video to interpolate each frame's
+        # filetime. Without load_video, the videos are not opened.
+        video_frames = self.video_frames()
+        frame_filetime_lst = (
+            video_frames.files,
+            self.frame_filetimes() if self.load_video else None
         )
 
         # Attach note to their sample stamp
-        note_dict = dict()
-        note_packets = self.loaders_dict['ent_loader'].data['note_packets']
-        for tree in note_packets['note_key_tree']:
-            if isinstance(tree, dict):
-                note_dict[int(tree['Stamp'])] = tree
-                # TODO: Handle failures in casting?
-
-        # Return channel names for the array (plus sample stamp). 
-        # TODO: Check that the channel orders/presence the same for different files
-        c_names = self.loaders_dict['erd_loader_0'].channel_names
+        note_dict = self.notes
 
         # Return list
         ret_val = {
-            'StudyInfo': self.loaders_dict['eeg_loader'].data['study_info'],
-            'EEGData': data_array,
-            'ChannelNames': c_names+['SampleStamp'],
+            'StudyInfo': self.study_info,
+            **eeg,
             'Notes': note_dict,
             'FrameAndFiletime': frame_filetime_lst,
             'FiletimeStampConversion': (
@@ -134,32 +347,623 @@ class XltekLoader:
 
         return ret_val
 
-    def load(self):
+    def collect_notes(self, note_trees=None):
+        if note_trees is None:
+            note_trees = self.loaders_dict['ent_loader'].data['note_packets']['note_key_tree']
+        note_dict = dict()
+        for tree in note_trees:
+            if isinstance(tree, (dict, LazyKeyTree)):
+                note_dict[int(tree['Stamp'])] = tree
+                # TODO: Handle failures in casting?
+        return note_dict
+
+    def loaded(self, loader_name, *args):
+        """
+        The file loader loader_name, loaded and validated (with args) if
+        it wasn't loaded yet.
+        """
+        file_loader = self.loaders_dict[loader_name]
+        if not hasattr(file_loader, 'data'):
+            file_loader.load()
+            self.validate_loader(loader_name, *args)
+        return file_loader
+
+    @property
+    def study_info(self):
+        """
+        StudyInfo of the .eeg file. Only reads the .eeg file.
+        """
+        return self.loaded('eeg_loader').data['study_info']
+
+    @property
+    def notes(self):
+        """
+        Notes by sample stamp, like 'Notes' of load(). Only reads the .ent
+        file.
+        """
+        if 'notes' not in self.lazy:
+            note_trees = self.loaded('ent_loader').data['note_packets']['note_key_tree']
+            self.lazy['notes'] = self.collect_notes(note_trees)
+        return self.lazy['notes']
+
+    @property
+    def timebase(self):
+        """
+        TimeBase of the study, to convert between sample stamps and
+        FILETIME. Only reads the .snc file and the first .erd header.
+        """
+        if 'timebase' not in self.lazy:
+            # Nominal rate from the .erd header, read on its own if needed
+            sample_freq = None
+            if self.files_dict['erd']:
+                sample_freq = self.first_erd().data['raw_data_file_header']['sample_freq']
+            self.lazy['timebase'] = TimeBase.from_loader(self.loaded('snc_loader'), sample_freq)
+        return self.lazy['timebase']
+
+    @property
+    def eeg(self):
+        """
+        EEGData and ChannelNames of all channels, like load(). Only reads
+        the .erd, .etc and .stc files.
+        """
+        if 'eeg' not in self.lazy:
+            for loader_id in range(len(self.files_dict['erd'])):
+                erd_loader = self.loaders_dict['erd_loader_{}'.format(loader_id)]
+                # Also when only the header or some channels were read
+                if hasattr(erd_loader, 'data') and (
+                    erd_loader.channels is not None or not len(erd_loader.data['data_packets'])
+                ):
+                    erd_loader.channels = None
+                    del erd_loader.data
+                self.loaded('erd_loader_{}'.format(loader_id))
+            for loader_id in range(len(self.files_dict['etc'])):
+                self.loaded(
+                    'etc_loader_{}'.format(loader_id),
+                    self.loaders_dict['erd_loader_{}'.format(loader_id)]
+                )
+
+            channel_ids = list(range(self.loaders_dict['erd_loader_0'].num_channels))
+            c_names = self.loaders_dict['erd_loader_0'].channel_names
+            self.lazy['eeg'] = {
+                'EEGData': self.combine_eeg(channel_ids),
+                'ChannelNames': [c_names[c] for c in channel_ids]+['SampleStamp']
+            }
+        return self.lazy['eeg']
+
+    def video_frames(self):
+        """
+        VideoFrames of the study, to look up the time of video frames.
+        Loads the .vtc and .snc files if they aren't loaded yet. Without
+        a .vtc file, there are no videos.
+        """
+        if self.frames is None:
+            vtc_loader = self.loaded('vtc_loader') if 'vtc_loader' in self.loaders_dict else None
+            self.frames = VideoFrames(vtc_loader, self.load_dir, self.timebase)
+        return self.frames
+
+    def frame_filetimes(self):
+        # Opens the videos for their frame counts
+        with stage(self.stats, 'video_frames') as record:
+            filetimes = self.video_frames().filetimes
+            record['packets'] = len(filetimes)
+        return filetimes
+
+    def note_index(self):
+        """
+        NoteIndex of the .ent notes, for queries by sample stamp. Loads
+        the .ent file if it isn't loaded yet.
+        """
+        if 'note_index' not in self.lazy:
+            note_trees = self.loaded('ent_loader').data['note_packets']['note_key_tree']
+            self.lazy['note_index'] = NoteIndex(note_trees)
+        return self.lazy['note_index']
+
+    def read_segments(self):
+        """
+        (.erd loader id, start stamp, end stamp) of each .stc segment.
+        """
+        if self.segments is not None:
+            return self.segments
+
+        stc_loader = self.loaded('stc_loader')
+
+        # Segments refer to the .erd files by name
+        erd_ids = {
+            os.path.splitext(os.path.basename(f))[0]: loader_id
+            for loader_id, f in enumerate(self.files_dict['erd'])
+        }
+        segment_toc = stc_loader.data['segment_table_of_content']
+        self.segments = []
+        for seg_id, seg_name in enumerate(segment_toc['segment_name']):
+            seg_name = os.path.splitext(os.path.basename(seg_name))[0]
+            loader_id = erd_ids.get(seg_name, seg_id)
+            if loader_id >= len(self.files_dict['erd']):
+                continue
+            self.segments.append((
+                loader_id,
+                segment_toc['start_stamp'][seg_id],
+                segment_toc['end_stamp'][seg_id]
+            ))
+        return self.segments
+
+    def file_order(self):
+        """
+        (.erd loader id, segment start stamp) in .stc segment order. Files
+        missing from the .stc come last, with None as the start stamp.
+        """
+        order = [
+            (loader_id, seg_start) for loader_id, seg_start, _ in self.read_segments()
+        ]
+        listed = {loader_id for loader_id, _ in order}
+        order += [
+            (loader_id, None) for loader_id in range(len(self.files_dict['erd']))
+            if loader_id not in listed
+        ]
+        return order
+
+    def header_loader(self, loader_name):
+        # Separate loader reading only the headers of the file, so that
+        # the loaders of loaders_dict stay unread
+        file_loader = self.loaders_dict[loader_name]
+        header_loader = type(file_loader)(file_loader.load_filename)
+        header_loader.use_mmap = self.use_mmap
+        header_loader.stats = self.stats
+        if hasattr(header_loader, 'load_header'):
+            header_loader.load_header()
+        else:
+            header_loader.header_only = True
+            header_loader.load()
+        return header_loader
+
+    def first_erd(self):
+        # The first .erd loader, or one reading only its header if it is
+        # not read yet: enough for the channel names and sample_freq
+        erd_loader = self.loaders_dict['erd_loader_0']
+        if hasattr(erd_loader, 'data'):
+            return erd_loader
+        if 'erd_header' not in self.lazy:
+            self.lazy['erd_header'] = self.header_loader('erd_loader_0')
+        return self.lazy['erd_header']
+
+    def scan_headers(self):
+        """
+        Summary of the study for cataloguing, reading only the generic
+        header of the .eeg file, the header of the first .erd file, the
+        .stc segments and the last entry of each .etc file. The number of
+        samples comes from the .stc segments, or is estimated from the
+        .etc tables if there are none yet. Only the .eeg, .erd, .etc and
+        .stc files are needed.
+        """
+        for file_type in ['eeg', 'erd', 'etc', 'stc']:
+            if not self.files_dict[file_type]:
+                raise FileNotFoundError(
+                    "No .{} file in {}".format(file_type, self.load_dir)
+                )
+
+        generic_header = self.header_loader('eeg_loader').data['generic_file_header']
+        erd_header = self.first_erd().data['raw_data_file_header']
+
+        segment_toc = self.loaded('stc_loader').data['segment_table_of_content']
+        segments = list(zip(segment_toc['start_stamp'], segment_toc['end_stamp']))
+        if segments:
+            num_samples = sum(end - start + 1 for start, end in segments)
+        else:
+            # Samples up to the span of the last entry of each file
+            num_samples = 0
+            for loader_id in range(len(self.files_dict.get('etc', []))):
+                last = self.header_loader('etc_loader_{}'.format(loader_id)).read_entry(-1)
+                if last is not None:
+                    num_samples += last['sample_num'] + last['sample_span']
+
+        sample_freq = erd_header['sample_freq']
+        return {
+            'StudyDir': self.load_dir,
+            'GenericHeader': generic_header,
+            'SampleFreq': sample_freq,
+            'NumChannels': erd_header['num_channels'],
+            'HeadboxType': erd_header['headbox_type'],
+            'NumFiles': len(self.files_dict['erd']),
+            'ErdBytes': sum(os.path.getsize(f) for f in self.files_dict['erd']),
+            'Segments': segments,
+            'NumSamples': num_samples,
+            'Duration': num_samples / sample_freq if sample_freq else None
+        }
+
+    def read_headers(self):
+        """
+        Read the .erd headers and the .etc tables, without reading any
+        packets.
+        """
+        for loader_id in range(len(self.files_dict['erd'])):
+            erd_loader = self.loaders_dict['erd_loader_{}'.format(loader_id)]
+            etc_loader = self.loaders_dict['etc_loader_{}'.format(loader_id)]
+            if not hasattr(erd_loader, 'data'):
+                erd_loader.load_header()
+            if not hasattr(etc_loader, 'data'):
+                etc_loader.load()
+
+    def prepare_random_access(self):
+        """
+        Index the decoder state at every .etc table entry. Only done for
+        the .etc tables without checkpoints, e.g. after the files were
+        read again.
+        """
+        self.read_headers()
+        for loader_id in range(len(self.files_dict['erd'])):
+            erd_loader = self.loaders_dict['erd_loader_{}'.format(loader_id)]
+            etc_loader = self.loaders_dict['etc_loader_{}'.format(loader_id)]
+            if etc_loader.toc_index.checkpoints is None:
+                erd_loader.data['data_packets'].index_checkpoints(etc_loader.toc_index)
+
+    def resolve_channels(self, channels=None):
+        """
+        Channel indices for a list of channel names or indices. None
+        selects all channels.
+        """
+        return self.first_erd().resolve_channels(channels)
+
+    def read_window(self, start_samplestamp, end_samplestamp, channels=None):
+        """
+        Read the EEG from start_samplestamp up to (not including)
+        end_samplestamp. Only the .erd files covering the window are read,
+        starting from the closest .etc table entry before the window.
+        Returns EEGData and ChannelNames like load().
+        """
+        self.prepare_random_access()
+        channel_ids = self.resolve_channels(channels)
+
+        lst_data = [np.zeros((len(channel_ids)+1, 0))]
+        for loader_id, seg_start, seg_end in self.read_segments():
+            if seg_start >= end_samplestamp or seg_end < start_samplestamp:
+                continue
+            lst_data.append(self.read_file_window(
+                loader_id, seg_start, start_samplestamp, end_samplestamp, channel_ids
+            ))
+
+        c_names = self.loaders_dict['erd_loader_0'].channel_names
+        return {
+            'EEGData': np.concatenate(lst_data, axis=1),
+            'ChannelNames': [c_names[c] for c in channel_ids]+['SampleStamp']
+        }
+
+    def read_file_window(self, loader_id, seg_start, start_samplestamp,
+                         end_samplestamp, channel_ids):
+        packets = self.loaders_dict['erd_loader_{}'.format(loader_id)].data['data_packets']
+        toc_index = self.loaders_dict['etc_loader_{}'.format(loader_id)].toc_index
+
+        # Seek to the last table entry before the window, or the first packet
+        entry = toc_index.seek(start_samplestamp)
+        if entry >= 0:
+            blocks = self.iter_file_blocks(
+                loader_id, channel_ids,
+                cursor=toc_index.offset[entry],
+                state=toc_index.checkpoints[entry].copy(),
+                last_stamp=toc_index.samplestamp[entry]
+            )
+        else:
+            blocks = self.iter_file_blocks(
+                loader_id, channel_ids, last_stamp=seg_start-1
+            )
+
+        # Decode forward until the end of the window
+        lst_data = [np.zeros((len(channel_ids)+1, 0))]
+        for block in blocks:
+            stamps = block[-1]
+            keep = (stamps >= start_samplestamp) & (stamps < end_samplestamp)
+            if keep.any():
+                lst_data.append(block[:, keep])
+            if stamps[-1] >= end_samplestamp - 1:
+                break
+
+        return np.concatenate(lst_data, axis=1)
+
+    def iter_file_blocks(self, loader_id, channel_ids, cursor=None, state=None,
+                         last_stamp=-1):
+        """
+        Decode an .erd file from cursor on (the first packet by default),
+        yielding arrays of the selected channels plus a SampleStamp row.
+        state is the channel state at cursor and is updated in place.
+        """
+        erd_loader = self.loaders_dict['erd_loader_{}'.format(loader_id)]
+        toc_index = self.loaders_dict['etc_loader_{}'.format(loader_id)].toc_index
+        packets = erd_loader.data['data_packets']
+        if cursor is None:
+            cursor = packets.data_offset
+        if state is None:
+            state = np.full(packets.n_channels, np.nan)
+
+        # Only the selected channels are decoded
+        for block in packets.iter_from(int(cursor), state, channels=channel_ids):
+            stamps = toc_index.stamp_packets(block.ends, last_stamp)
+            last_stamp = stamps[-1]
+            yield block_data(block, stamps)
+
+    def iter_chunks(self, chunk_samples=65536, channels=None, filetime=False):
+        """
+        Walk the .erd files in .stc segment order and yield arrays of
+        shape (num_channels+1, chunk_samples), laid out like EEGData with
+        the SampleStamp as the last row. The last chunk can be shorter.
+        Memory use depends on chunk_samples, not on the recording length.
+        With filetime, a row with the FILETIME of each sample is added
+        after the SampleStamp.
+        """
+        if chunk_samples <= 0:
+            raise ValueError("chunk_samples has to be positive")
+
+        self.read_headers()
+        channel_ids = self.resolve_channels(channels)
+        if filetime:
+            time_base = self.timebase
+            for chunk in self.iter_chunks(chunk_samples, channel_ids):
+                yield time_base.add_filetime(chunk)
+            return
+
+        chunk = np.empty((len(channel_ids)+1, chunk_samples))
+        filled = 0
+        state = None
+        last_stamp = -1
+        for loader_id, seg_start in self.file_order():
+            # The decoder state carries over to the next file
+            if state is None:
+                state = np.full(
+                    self.loaders_dict['erd_loader_{}'.format(loader_id)].num_channels,
+                    np.nan
+                )
+            if seg_start is not None:
+                last_stamp = seg_start - 1
+            for block in self.iter_file_blocks(
+                loader_id, channel_ids, state=state, last_stamp=last_stamp
+            ):
+                last_stamp = block[-1, -1]
+
+                # Fill the chunk and hand it out whenever it is full
+                used = 0
+                while used < block.shape[1]:
+                    n = min(chunk_samples - filled, block.shape[1] - used)
+                    chunk[:, filled:filled+n] = block[:, used:used+n]
+                    filled += n
+                    used += n
+                    if filled == chunk_samples:
+                        yield chunk
+                        chunk = np.empty_like(chunk)
+                        filled = 0
+
+        if filled:
+            yield chunk[:, :filled]
+
+    def refresh(self, channels=None):
+        """
+        Read what was written to a study still being recorded since the
+        last refresh. The first call reads everything written so far.
+        For each .erd file, the offset after the last complete packet and
+        the decoder state are kept, and the .etc, .snc and .ent files are
+        read on from their last complete record, so a refresh only reads
+        the new data. New .erd/.etc files are picked up as they appear.
+        The files are not cached.
+
+        Returns EEGData and ChannelNames of the new samples, laid out like
+        load(), and the new Notes and FiletimeStampConversion pairs.
+        """
+        # Notes and time mappings grow while recording
+        self.lazy = dict()
+        if self.tail is None:
+            # Per .erd loader id: cursor, decoder state and last stamp
+            self.tail = dict()
+            new_records = dict()
+            for loader_name in ['ent_loader', 'snc_loader']:
+                file_loader = self.loaders_dict[loader_name]
+                self.load_complete(file_loader)
+                new_records.update(file_loader.data)
+        else:
+            self.scan_files()
+            new_records = self.loaders_dict['ent_loader'].load_tail()
+            new_records.update(self.loaders_dict['snc_loader'].load_tail())
+
+        # Segments are added while recording
+        self.loaders_dict['stc_loader'].cache = None
+        self.loaders_dict['stc_loader'].load()
+        self.segments = None
+
+        channel_ids = None
+        lst_data = []
+        last_stamp = -1
+        for loader_id, seg_start in self.file_order():
+            if loader_id >= len(self.files_dict['etc']):
+                continue
+            erd_loader = self.loaders_dict['erd_loader_{}'.format(loader_id)]
+            etc_loader = self.loaders_dict['etc_loader_{}'.format(loader_id)]
+
+            tail = self.tail.get(loader_id)
+            if tail is None:
+                # New file, read its header and table of content so far
+                erd_loader.load_header()
+                self.load_complete(etc_loader)
+                tail = self.tail[loader_id] = dict(
+                    cursor=erd_loader.data['data_packets'].data_offset,
+                    state=np.full(erd_loader.num_channels, np.nan),
+                    last_stamp=None
+                )
+            else:
+                etc_loader.load_tail()
+
+            # Stamps count on from the segment start or the previous file
+            if tail['last_stamp'] is None:
+                tail['last_stamp'] = last_stamp if seg_start is None else seg_start - 1
+            if channel_ids is None:
+                channel_ids = erd_loader.resolve_channels(channels)
+
+            packets = erd_loader.data['data_packets']
+            for block in packets.iter_from(tail['cursor'], tail['state'], channel_ids):
+                stamps = etc_loader.toc_index.stamp_packets(block.ends, tail['last_stamp'])
+                tail['cursor'] = int(block.ends[-1])
+                tail['last_stamp'] = stamps[-1]
+                lst_data.append(block_data(block, stamps))
+            last_stamp = tail['last_stamp']
+
+        if channel_ids is None:
+            # No .erd file yet
+            channel_ids, c_names = [], []
+        else:
+            c_names = self.loaders_dict['erd_loader_0'].channel_names
+        time_mappings = new_records['time_mappings']
+        return {
+            'EEGData': np.concatenate(
+                [np.zeros((len(channel_ids)+1, 0))] + lst_data, axis=1
+            ),
+            'ChannelNames': [c_names[c] for c in channel_ids]+['SampleStamp'],
+            'Notes': self.collect_notes(new_records['note_packets']['note_key_tree']),
+            'FiletimeStampConversion': (
+                list(time_mappings['sample_time']),
+                list(time_mappings['samplestamp'])
+            )
+        }
+
+    def load_complete(self, file_loader):
+        # Load up to the last complete record, uncached, for load_tail.
+        # The loader is restored for later calls to load()
+        cache = file_loader.cache
+        file_loader.cache = None
+        file_loader.complete_records = True
+        try:
+            file_loader.load()
+        finally:
+            file_loader.cache = cache
+            file_loader.complete_records = False
+
+    def export(self, path, format='zarr', chunk_samples=65536,
+               channels_per_chunk=64, channels=None, level=5):
+        """
+        Convert the study to chunked, compressed storage at path. EEGData
+        is laid out like in load() and stored in chunks of
+        channels_per_chunk x chunk_samples, written one time block at a
+        time. ChannelNames, Notes and StudyInfo are stored as attributes,
+        FiletimeStampConversion and the video frame times as arrays.
+        format is 'zarr' (no extra package needed) or 'hdf5' (needs h5py).
+        """
+        if format not in writers:
+            raise ValueError("Unknown export format '{}'".format(format))
+        if chunk_samples <= 0 or channels_per_chunk <= 0:
+            raise ValueError("chunk_samples and channels_per_chunk have to be positive")
+
+        self.read_headers()
+        for loader_name in ['eeg_loader', 'ent_loader', 'snc_loader', 'vtc_loader']:
+            if loader_name in self.loaders_dict and not hasattr(self.loaders_dict[loader_name], 'data'):
+                self.loaders_dict[loader_name].load()
+
+        channel_ids = self.resolve_channels(channels)
+        writer = writers[format](
+            path, len(channel_ids)+1, channels_per_chunk, chunk_samples, level
+        )
+        for chunk in self.iter_chunks(chunk_samples, channel_ids):
+            writer.append(chunk)
+
+        c_names = self.loaders_dict['erd_loader_0'].channel_names
+        time_mappings = self.loaders_dict['snc_loader'].data['time_mappings']
+        video_frames = self.video_frames()
+        writer.add_array('FiletimeStampConversion_filetime', time_mappings['sample_time'])
+        writer.add_array('FiletimeStampConversion_samplestamp', time_mappings['samplestamp'])
+        if self.load_video:
+            writer.add_array('FrameFiletime', self.frame_filetimes())
+        writer.set_attrs({
+            'ChannelNames': [c_names[c] for c in channel_ids]+['SampleStamp'],
+            'Notes': self.collect_notes(),
+            'StudyInfo': self.loaders_dict['eeg_loader'].data['study_info'],
+            'VideoFiles': video_frames.files
+        })
+        writer.close()
+
+    def load(self, channels=None, multi_rate=False):
+        """
+        Load the whole study. channels selects the channels of EEGData by
+        name or index (all by default). The other channels are skipped
+        while decoding, so they take neither time nor memory. With
+        multi_rate, EEGGroups holds the channels of each subsample rate
+        in their own array instead of EEGData, see combine_groups.
+        """
+        channel_ids = None
+        if channels is not None:
+            channel_ids = self.resolve_channels(channels)
+        for loader_id in range(len(self.files_dict['erd'])):
+            self.loaders_dict['erd_loader_{}'.format(loader_id)].channels = (
+                None if channel_ids is None else np.unique(channel_ids).tolist()
+            )
+
         self.read()
         self.validate()
-        res = self.combine_files()
+        res = self.combine_files(channel_ids, multi_rate)
         return res
 
     def read(self):
-        for loader_id in range(len(self.files_dict['erd'])):
-            self.loaders_dict['erd_loader_{}'.format(loader_id)].load()
-        for loader_id in range(len(self.files_dict['etc'])):
-            self.loaders_dict['etc_loader_{}'.format(loader_id)].load()
+        self.lazy = dict()
+        if self.workers > 1:
+            self.read_parallel()
+        else:
+            for loader_id in range(len(self.files_dict['erd'])):
+                self.loaders_dict['erd_loader_{}'.format(loader_id)].load()
+            for loader_id in range(len(self.files_dict['etc'])):
+                self.loaders_dict['etc_loader_{}'.format(loader_id)].load()
         self.loaders_dict['eeg_loader'].load()
         self.loaders_dict['ent_loader'].load()
         self.loaders_dict['stc_loader'].load()
-        self.loaders_dict['vtc_loader'].load()
+        if 'vtc_loader' in self.loaders_dict:
+            self.loaders_dict['vtc_loader'].load()
         self.loaders_dict['snc_loader'].load()
 
+    def read_parallel(self):
+        """
+        Load the .erd/.etc pairs in a pool of workers. The .erd files are
+        independent, since each starts with its own absolute values.
+        """
+        num_pairs = max(len(self.files_dict['erd']), len(self.files_dict['etc']))
+        names = [
+            [name.format(loader_id) for name in ['erd_loader_{}', 'etc_loader_{}']
+             if name.format(loader_id) in self.loaders_dict]
+            for loader_id in range(num_pairs)
+        ]
+
+        # Largest files first, so the pool stays busy until the end
+        names.sort(
+            key=lambda pair: -os.path.getsize(self.loaders_dict[pair[0]].load_filename)
+        )
+
+        if self.executor == 'process':
+            # Each worker compiles the templates once, for all its files
+            pool = partial(ProcessPoolExecutor, initializer=warm_templates)
+        else:
+            pool = ThreadPoolExecutor
+        if self.stats is not None and self.executor == 'process':
+            # Workers record into copies, merged back below
+            for pair in names:
+                worker_stats = self.stats.fork()
+                for name in pair:
+                    self.loaders_dict[name].stats = worker_stats
+        with pool(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(load_files, *[self.loaders_dict[n] for n in pair])
+                for pair in names
+            ]
+            # Put the loaded copies back in place of the originals
+            for pair, future in zip(names, futures):
+                for name, loaded in zip(pair, future.result()):
+                    if self.stats is not None:
+                        self.stats.merge(loaded.stats)
+                        loaded.stats = self.stats
+                    self.loaders_dict[name] = loaded
+
     def validate(self):
         for loader_id in range(len(self.files_dict['erd'])):
-            self.loaders_dict['erd_loader_{}'.format(loader_id)].validate()
+            self.validate_loader('erd_loader_{}'.format(loader_id))
         for loader_id in range(len(self.files_dict['etc'])):
-            self.loaders_dict['etc_loader_{}'.format(loader_id)].validate(
+            self.validate_loader(
+                'etc_loader_{}'.format(loader_id),
                 self.loaders_dict['erd_loader_{}'.format(loader_id)]
             )  # Use toc file to validate erd
-        self.loaders_dict['eeg_loader'].validate()
-        self.loaders_dict['ent_loader'].validate()
-        self.loaders_dict['stc_loader'].validate()
-        self.loaders_dict['vtc_loader'].validate()
-        self.loaders_dict['snc_loader'].validate()
+        for loader_name in ['eeg_loader', 'ent_loader', 'stc_loader', 'vtc_loader', 'snc_loader']:
+            # No .vtc file without video
+            if loader_name in self.loaders_dict:
+                self.validate_loader(loader_name)
+
+    def validate_loader(self, loader_name, *args):
+        file_loader = self.loaders_dict[loader_name]
+        with stage(self.stats, 'validate', os.path.basename(file_loader.load_filename)):
+            return file_loader.validate(*args)
@@ -0,0 +1,31 @@
+import pytest
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.synthetic import write_study
+
+"""
+Synthetic study shared by the tests, see write_study.
+"""
+
+# Many double deltas and absolute values, so FFFF bytes straddling two
+# delta fields are common. Channels at lower rates and a shorted channel
+# use the frequency byte and the group masks.
+STUDY = dict(
+    duration=20, num_files=3, double_fraction=0.5, abs_fraction=0.02,
+    frequency_factor={20: 2, 21: 4, 22: 4, 23: 50}, shorted=(5,),
+    notes_per_minute=30, toc_every=64, num_videos=0, gap=37
+)
+
+
+@pytest.fixture(scope='session')
+def study(tmp_path_factory):
+    """
+    (path, .erd segments, encoded channel values) of the study.
+    """
+    path = str(tmp_path_factory.mktemp('study'))
+    segments, values = write_study(path, return_values=True, **STUDY)
+    return path, segments, values
+
+
+@pytest.fixture(scope='session')
+def loaded(study):
+    return XltekLoader(study[0], load_video=False).load()
@@ -0,0 +1,70 @@
+import os
+import json
+from file_loader.batch import BatchRun, MANIFEST, read_manifest, write_catalog
+from file_loader.utils.synthetic import write_study
+
+
+def make_tree(root):
+    # Two studies of different sizes and a broken one
+    for name, duration in [('a', 4), ('b/c', 8)]:
+        write_study(os.path.join(root, name), duration=duration, num_videos=0)
+    broken = os.path.join(root, 'broken')
+    os.makedirs(broken)
+    for suffix in ['.eeg', '.erd']:
+        with open(os.path.join(broken, 'Pat' + suffix), 'wb') as f:
+            f.write(b'\x00' * 100)
+    return [os.path.join(root, name) for name in ['a', 'b/c', 'broken']]
+
+
+def run(root, out, **kwargs):
+    logs = []
+    summary = BatchRun(root, out, loader_options={'load_video': False}, **kwargs).run(logs.append)
+    return summary, logs
+
+
+def test_resume(tmp_path):
+    root, out = str(tmp_path / 'root'), str(tmp_path / 'out')
+    a, c, broken = make_tree(root)
+
+    # An interrupted run: a done, c left as a partial output, and the
+    # last manifest line cut off
+    summary, _ = run(root, out)
+    assert (summary['done'], summary['failed']) == (2, 1)
+    manifest = read_manifest(out)
+    assert manifest[broken]['status'] == 'failed'
+    assert os.path.isdir(manifest[c]['output'])
+    with open(os.path.join(out, MANIFEST), 'w') as f:
+        f.write(json.dumps(manifest[a]) + '\n')
+        f.write(json.dumps(manifest[broken])[:20])
+    os.rename(manifest[c]['output'], manifest[c]['output'] + '.partial')
+
+    # Only c and the broken study are done again
+    summary, logs = run(root, out)
+    assert (summary['done'], summary['failed']) == (1, 1)
+    assert logs[0].startswith('2 studies to do')
+    assert os.path.isdir(manifest[c]['output'])
+    assert not os.path.exists(manifest[c]['output'] + '.partial')
+
+    # Failed studies are only retried on request
+    summary, _ = run(root, out)
+    assert (summary['done'], summary['failed']) == (0, 0)
+    summary, _ = run(root, out, retry_failed=True)
+    assert (summary['done'], summary['failed']) == (0, 1)
+
+
+def test_largest_first(tmp_path):
+    root, out = str(tmp_path / 'root'), str(tmp_path / 'out')
+    a, c, broken = make_tree(root)
+    pending = BatchRun(root, out).pending()
+    assert [study for study, _ in pending] == [c, a, broken]
+
+
+def test_catalog(tmp_path):
+    root, out = str(tmp_path / 'root'), str(tmp_path / 'out')
+    a, c, broken = make_tree(root)
+    assert write_catalog(root, out, log=lambda text: None) == 1
+    with open(os.path.join(out, 'catalog.jsonl')) as f:
+        entries = {entry['study']: entry for entry in map(json.loads, f)}
+    assert entries[a]['status'] == entries[c]['status'] == 'done'
+    assert entries[c]['NumChannels'] == 32
+    assert entries[broken]['status'] == 'failed'
@@ -0,0 +1,70 @@
+import os
+import mmap
+import numpy as np
+import pytest
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.byte_buffer import ByteBuffer
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'buffer.bin')
+    with open(path, 'wb') as f:
+        f.write(b'abc\x00xyz' + (1234).to_bytes(2, 'big') + b'tail\x00\x00')
+    return path
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_read(path, use_mmap):
+    buf = ByteBuffer(path, use_mmap=use_mmap)
+    assert buf.read('string', 7) == 'abc'
+    assert buf.read(None, 2) == 1234
+    assert buf.read('string', 6, False) == 'tail\x00\x00'
+    assert buf.read() is None
+    buf.close()
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_ranged_read(path, use_mmap):
+    buf = ByteBuffer(path, use_mmap=use_mmap, offset=4, size=5)
+    assert bytes(buf.s) == b'xyz\x04\xd2'
+    assert buf.read('string', 3) == 'xyz'
+    assert buf.read(None, 2) == 1234
+    assert buf.isfinished()
+    buf.close()
+
+    buf = ByteBuffer(path, use_mmap=use_mmap, offset=9)
+    assert buf.read('string', -1) == 'tail'
+    buf.close()
+
+
+def test_mapped_without_copy(path):
+    buf = ByteBuffer(path, use_mmap=True, offset=4, size=5)
+    # A slice of the mapped file, not a copy of its bytes
+    assert isinstance(buf.map, mmap.mmap)
+    assert isinstance(buf.s, memoryview) and buf.s.obj is buf.map
+    buf.close()
+    assert buf.map.closed
+
+    buf = ByteBuffer(path, use_mmap=True)
+    assert buf.s is buf.map
+    buf.close()
+    assert buf.map.closed
+
+
+def test_close_with_views(path):
+    buf = ByteBuffer(path, use_mmap=True)
+    values = np.frombuffer(buf.s, np.uint8)
+    # Left mapped while the array uses it
+    buf.close()
+    assert not buf.map.closed
+    assert values[0] == ord('a')
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_load(study, loaded, use_mmap):
+    loader = XltekLoader(study[0], use_mmap=use_mmap, load_video=False)
+    ret = loader.load()
+    np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'])
+    assert ret['Notes'] == loaded['Notes']
+    assert ret['StudyInfo'] == loaded['StudyInfo']
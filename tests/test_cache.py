@@ -0,0 +1,70 @@
+import os
+import shutil
+import numpy as np
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.stats import LoadStats
+
+
+def cached_load(path, cache_dir, **kwargs):
+    # The result of load(), and whether each file came from the cache
+    stats = LoadStats()
+    loader = XltekLoader(path, cache_dir=cache_dir, load_video=False, stats=stats, **kwargs)
+    ret = loader.load()
+    cached = {
+        record['loader']: record.get('cached', False)
+        for record in stats.records if record['stage'] == 'load'
+    }
+    return ret, cached
+
+
+def test_restore(study, loaded, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    ret, cached = cached_load(study[0], cache_dir)
+    assert not any(cached.values())
+    ret, cached = cached_load(study[0], cache_dir)
+    assert all(cached.values())
+    np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'])
+    assert ret['Notes'] == loaded['Notes']
+
+
+def test_invalidation(study, loaded, tmp_path):
+    path = str(tmp_path / 'study')
+    shutil.copytree(study[0], path)
+    cache_dir = str(tmp_path / 'cache')
+    cached_load(path, cache_dir)
+    names = sorted(os.listdir(path))
+
+    # Touched, and changed in the header with size and mtime kept
+    touched = [f for f in names if f.endswith('.erd')][1]
+    os.utime(os.path.join(path, touched), ns=(1, 1))
+    changed = [f for f in names if f.endswith('.eeg')][0]
+    changed_path = os.path.join(path, changed)
+    st = os.stat(changed_path)
+    with open(changed_path, 'r+b') as f:
+        f.seek(32)
+        f.write(b'R')
+    os.utime(changed_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    ret, cached = cached_load(path, cache_dir)
+    assert not cached[touched] and not cached[changed]
+    assert all(v for f, v in cached.items() if f not in (touched, changed))
+    np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'])
+
+
+def test_variants(study, loaded, tmp_path):
+    # Channel subsets and value types are cached apart from full loads
+    cache_dir = str(tmp_path / 'cache')
+    loader = XltekLoader(study[0], cache_dir=cache_dir, load_video=False)
+    loader.load(channels=['C3', 21])
+    ret, _ = cached_load(study[0], cache_dir)
+    np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'])
+    ret, cached = cached_load(study[0], cache_dir, value_dtype=np.float32)
+    assert not any(v for f, v in cached.items() if f.endswith('.erd'))
+    np.testing.assert_allclose(ret['EEGData'], loaded['EEGData'], rtol=1e-6)
+
+
+def test_evict(study, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    XltekLoader(study[0], cache_dir=cache_dir, cache_max_bytes=1, load_video=False).load()
+    # Only the last entry is kept
+    assert len(os.listdir(cache_dir)) == 1
@@ -0,0 +1,49 @@
+import os
+import collections
+import numpy as np
+import pytest
+from file_loader import file_loading_parent
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.byte_buffer import ByteBuffer
+from file_loader.utils.synthetic import write_study
+
+
+@pytest.mark.parametrize('channels', [None, ['C3', 'CZ', 20, 5, 23]])
+def test_channel_subset(study, loaded, channels):
+    loader = XltekLoader(study[0], load_video=False)
+    ret = loader.load(channels=channels)
+    channel_ids = loader.resolve_channels(channels)
+    np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'][channel_ids+[-1]])
+    assert ret['ChannelNames'] == [loaded['ChannelNames'][c] for c in channel_ids+[-1]]
+
+
+def test_files_read_once(study, monkeypatch):
+    whole = collections.Counter()
+
+    class RecordingBuffer(ByteBuffer):
+        def __init__(self, path, *args, **kwargs):
+            super().__init__(path, *args, **kwargs)
+            if len(self.s) == os.path.getsize(path):
+                whole[os.path.splitext(path)[1]] += 1
+
+    monkeypatch.setattr(file_loading_parent, 'ByteBuffer', RecordingBuffer)
+    XltekLoader(study[0], load_video=False).load(channels=['CZ', 21])
+    assert whole['.erd'] == whole['.etc'] == 3
+
+
+@pytest.mark.parametrize('headbox_type, num_channels, channels', [
+    (3, 256, ['OSAT', 'PR', 'C1', 200]),
+    (6, 36, ['O2', 'DC4', 'Ref'])
+])
+def test_headbox_channels(tmp_path, headbox_type, num_channels, channels):
+    path = str(tmp_path)
+    write_study(path, headbox_type=headbox_type, num_channels=num_channels,
+                duration=4, num_videos=0)
+    full = XltekLoader(path, load_video=False).load()
+    loader = XltekLoader(path, load_video=False)
+    ret = loader.load(channels=channels)
+
+    channel_ids = loader.resolve_channels(channels)
+    names = [c if isinstance(c, str) else full['ChannelNames'][c] for c in channels]
+    assert ret['ChannelNames'] == names + ['SampleStamp']
+    np.testing.assert_array_equal(ret['EEGData'], full['EEGData'][channel_ids+[-1]])
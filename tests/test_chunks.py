@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from file_loader import file_loading_parent
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils import raw_data_packet
+from file_loader.utils.byte_buffer import ByteBuffer
+
+
+@pytest.mark.parametrize('chunk_samples', [1000, 4096, 10**6])
+def test_iter_chunks(study, loaded, chunk_samples):
+    loader = XltekLoader(study[0], load_video=False)
+    chunks = list(loader.iter_chunks(chunk_samples))
+    assert all(chunk.shape[1] == chunk_samples for chunk in chunks[:-1])
+    np.testing.assert_array_equal(np.concatenate(chunks, axis=1), loaded['EEGData'])
+
+
+def test_iter_chunks_channels(study, loaded):
+    loader = XltekLoader(study[0], load_video=False)
+    chunks = list(loader.iter_chunks(777, channels=['CZ', 21]))
+    channel_ids = loader.resolve_channels(['CZ', 21])
+    np.testing.assert_array_equal(
+        np.concatenate(chunks, axis=1), loaded['EEGData'][channel_ids+[-1]]
+    )
+
+
+def test_iter_chunks_filetime(study, loaded):
+    loader = XltekLoader(study[0], load_video=False)
+    chunks = np.concatenate(list(loader.iter_chunks(5000, filetime=True)), axis=1)
+    np.testing.assert_array_equal(chunks[:-1], loaded['EEGData'])
+    np.testing.assert_array_equal(
+        chunks[-1], loader.timebase.stamp_to_filetime(loaded['EEGData'][-1])
+    )
+
+
+@pytest.mark.parametrize('chunk_samples', [0, -5])
+def test_invalid_chunk_samples(study, chunk_samples):
+    loader = XltekLoader(study[0], load_video=False)
+    with pytest.raises(ValueError):
+        next(loader.iter_chunks(chunk_samples))
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_bounded_reads(study, loaded, monkeypatch, use_mmap):
+    # Small windows, so packets are cut at many window ends
+    monkeypatch.setattr(raw_data_packet, 'WINDOW_BYTES', 5000)
+    sizes = []
+
+    class RecordingBuffer(ByteBuffer):
+        def __init__(self, path, *args, **kwargs):
+            super().__init__(path, *args, **kwargs)
+            if path.endswith('.erd') and not isinstance(self.s, memoryview):
+                sizes.append(len(self.s))
+
+    monkeypatch.setattr(file_loading_parent, 'ByteBuffer', RecordingBuffer)
+    loader = XltekLoader(study[0], use_mmap=use_mmap, load_video=False)
+    chunks = list(loader.iter_chunks(1000))
+    np.testing.assert_array_equal(np.concatenate(chunks, axis=1), loaded['EEGData'])
+
+    # Headers and windows are read, never a whole .erd file
+    if use_mmap:
+        assert sizes == []
+    else:
+        assert max(sizes) <= 8656
+        assert sizes.count(5000) > 10
@@ -0,0 +1,26 @@
+import numpy as np
+from file_loader.xltek_loader import XltekLoader
+
+"""
+Round trip through the synthetic study writer: the decoded channel
+values against the values the packets were encoded from. The other
+reads are checked against load() in their own test modules.
+
+    python -m pytest tests
+"""
+
+
+def test_round_trip(study, loaded):
+    path, segments, values = study
+    loader = XltekLoader(path, load_video=False)
+    loader.read_headers()
+    erd_loader = loader.loaders_dict['erd_loader_0']
+
+    # Back to file units, the deltas are summed in converted units
+    discardbits = erd_loader.data['raw_data_file_header']['discardbits']
+    factors = erd_loader.channel_factors * (1 << discardbits)
+    file_values = loaded['EEGData'][:-1] / factors[:, None]
+    np.testing.assert_allclose(file_values, np.concatenate(values).T, rtol=0, atol=1e-6)
+
+    stamps = np.concatenate([np.arange(start, end+1) for start, end in segments])
+    np.testing.assert_array_equal(loaded['EEGData'][-1], stamps)
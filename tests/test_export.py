@@ -0,0 +1,41 @@
+import json
+import numpy as np
+import pytest
+from file_loader.xltek_loader import XltekLoader
+
+
+def test_zarr(study, loaded, tmp_path):
+    zarr = pytest.importorskip('zarr')
+    path = str(tmp_path / 'study.zarr')
+    XltekLoader(study[0], load_video=False).export(
+        path, chunk_samples=3000, channels_per_chunk=10
+    )
+    group = zarr.open_group(path, mode='r')
+    np.testing.assert_array_equal(group['EEGData'][:], loaded['EEGData'])
+    assert group['EEGData'].chunks == (10, 3000)
+    assert group.attrs['ChannelNames'] == loaded['ChannelNames']
+    assert group.attrs['Notes'] == {str(k): v for k, v in loaded['Notes'].items()}
+    filetime, samplestamp = loaded['FiletimeStampConversion']
+    np.testing.assert_array_equal(group['FiletimeStampConversion_filetime'][:], filetime)
+    np.testing.assert_array_equal(group['FiletimeStampConversion_samplestamp'][:], samplestamp)
+
+
+def test_hdf5(study, loaded, tmp_path):
+    h5py = pytest.importorskip('h5py')
+    path = str(tmp_path / 'study.h5')
+    channels = ['C4', 21, 'CZ']
+    loader = XltekLoader(study[0], load_video=False)
+    loader.export(path, format='hdf5', chunk_samples=2048, channels=channels)
+    channel_ids = loader.resolve_channels(channels)
+    with h5py.File(path, 'r') as f:
+        np.testing.assert_array_equal(f['EEGData'][:], loaded['EEGData'][channel_ids+[-1]])
+        names = json.loads(f['ChannelNames'][()])
+    assert names == [loaded['ChannelNames'][c] for c in channel_ids+[-1]]
+
+
+def test_invalid(study, tmp_path):
+    loader = XltekLoader(study[0], load_video=False)
+    with pytest.raises(ValueError):
+        loader.export(str(tmp_path / 'out'), format='csv')
+    with pytest.raises(ValueError):
+        loader.export(str(tmp_path / 'out'), chunk_samples=0)
@@ -0,0 +1,50 @@
+import pickle
+import numpy as np
+import pytest
+from file_loader.utils.expression import expression, evaluate, evaluate_vector
+from file_loader.utils.template_plan import templates
+
+
+def test_nested_names():
+    # Variables used only inside comprehensions and lambdas
+    assert expression('[discardbits*i for i in range(3)]')({'discardbits': 2}) == [0, 2, 4]
+    assert expression('(lambda x: x*k)(2)')({'k': 3}) == 6
+    assert expression('[[a+j for j in range(i)] for i in range(3)]')({'a': 1}) == [[], [1], [1, 2]]
+    with pytest.raises(NameError):
+        expression('[b for i in range(2)]')({})
+
+
+def test_compiled_once():
+    assert expression('length-16') is expression('length-16')
+    assert expression('length-16')({'length': 20, 'other': 1}) == 4
+
+    # Sent to worker processes by source
+    copy = pickle.loads(pickle.dumps(expression('[x*i for i in range(2)]')))
+    assert copy({'x': 5}) == [0, 5]
+
+
+def test_evaluate():
+    val = {'headbox_type==1': "'EEG32'", 'headbox_type==4': ["'AMB", "28'"]}
+    assert evaluate(val, {'headbox_type': 4}) == 'AMB28'
+    with pytest.raises(ValueError):
+        evaluate(val, {'headbox_type': 2})
+
+
+# Headbox types with their channel counts, some with factors by channel
+@pytest.mark.parametrize('headbox_type, num_channels', [
+    (1, 32), (3, 256), (4, 28), (6, 36), (8, 27), (9, 35), (14, 50)
+])
+def test_evaluate_vector(headbox_type, num_channels):
+    table = templates.table('erd', 9)['conversion_factors']
+    variables = {'headbox_type': headbox_type, 'discardbits': 2}
+    factors = evaluate_vector(table, variables, 'channel', num_channels)
+    expected = [
+        evaluate(table, dict(variables, channel=channel)) for channel in range(num_channels)
+    ]
+    np.testing.assert_array_equal(factors, expected)
+
+
+def test_evaluate_vector_unmatched():
+    table = templates.table('erd', 9)['conversion_factors']
+    with pytest.raises(ValueError):
+        evaluate_vector(table, {'headbox_type': 4, 'discardbits': 2}, 'channel', 30)
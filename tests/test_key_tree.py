@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from file_loader.utils.key_tree_parser import key_tree_parser, LazyKeyTree
+from file_loader.utils.synthetic import key_tree
+
+
+def old_parse(t, start=0, end=-1):
+    # The recursive parser this one replaced, returning dicts
+    tree = dict()
+    found_key = False
+    cursor = start
+    stopping = len(t) if end == -1 else end
+    while cursor < stopping:
+        if t[cursor:cursor+3] == '(."' and t[cursor+3] not in [')', '(']:
+            found_key = True
+            cursor = cursor + 3
+        if not found_key:
+            cursor += 1
+            continue
+
+        next_quote = t.find('"', cursor)
+        key = t[cursor:next_quote]
+        if t[next_quote+3] != '(':
+            next_paren_right = t.find(')', cursor)
+            # Sometimes text has parenthesis
+            while t[next_paren_right+1] not in [',', ')']:
+                next_paren_right = t.find(')', next_paren_right+1)
+            val = t[next_quote+3:next_paren_right].encode("unicode-escape").decode()
+            val = val.strip('"')
+            if val.isdigit():
+                val = int(val)
+            try:
+                val = float(val)
+            except ValueError:
+                pass
+            tree[key] = val
+        else:
+            inside_text = False
+            count = None
+            cursor_inner = next_quote + 3
+            while count != 0:
+                count = count or 0
+                if t[cursor_inner] == '"':
+                    inside_text = not inside_text
+                if t[cursor_inner] == '(' and not inside_text:
+                    count += 1
+                elif t[cursor_inner] == ')' and not inside_text:
+                    count -= 1
+                cursor_inner += 1
+            next_paren_right = cursor_inner
+            tree[key] = old_parse(t, next_quote+3, cursor_inner+1)
+        cursor = next_paren_right + 1
+        found_key = False
+    return tree
+
+
+texts = [
+    '(.(."Stamp", 2238), (."Data", (.(."User", "abc"))))',
+    '(.(."Comment", "Seizure (left) onset"), (."Stamp", 12))',
+    '(.(."Name", "Müller"), (."Tab", "a\tb"), (."Rate", 0.5), (."Gain", -3))',
+    '(.(."Data", (.(."A", (.(."B", 1), (."C", "x"))), (."D", ""))), (."Id", "007"))',
+    '(.(."Value", inf), (."Other", -inf), (."Text", "n/a"))',
+]
+
+
+@pytest.mark.parametrize('text', texts)
+def test_same_as_old_parser(text):
+    assert key_tree_parser(text).to_dict() == old_parse(text)
+
+
+def test_synthetic_notes():
+    rng = np.random.default_rng(3)
+    for note_id in range(50):
+        text = key_tree({
+            'Stamp': int(rng.integers(10**6)),
+            'Comment': 'note {} (synthetic)'.format(note_id),
+            'Data': {'User': 'bench', 'Info': {'Id': note_id, 'Rate': float(rng.random())}}
+        })
+        assert key_tree_parser(text).to_dict() == old_parse(text)
+
+
+def test_lazy():
+    text = texts[0]
+    tree = LazyKeyTree(text)
+    # The Stamp is read without parsing the rest
+    assert tree['Stamp'] == 2238.
+    assert tree.tree is None
+    assert dict(tree) == old_parse(text)
+    assert tree['Data']['User'] == 'abc'
+
+
+def test_cut_off():
+    # Trees cut off at the end of the text keep what was read
+    tree = key_tree_parser('(.(."Stamp", 5), (."Data", (.(."User", "ab"').to_dict()
+    assert tree['Stamp'] == 5.
+    assert 'Data' in tree
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.resample import resample, resample_groups
+from conftest import STUDY
+
+
+def group_of(subsample):
+    # Channels stored at the given subsample rate, -1 for full rate
+    factors = STUDY['frequency_factor']
+    if subsample == -1:
+        return [c for c in range(32) if c not in factors]
+    return [c for c, f in factors.items() if f == subsample]
+
+
+def test_groups(study, loaded):
+    ret = XltekLoader(study[0], load_video=False).load(multi_rate=True)
+    groups = ret['EEGGroups']
+    assert 'EEGData' not in ret
+    assert list(groups) == [-1, 2, 4, 50]
+
+    sample_freq = 512.
+    for subsample, group in groups.items():
+        channel_ids = group_of(subsample)
+        assert group['ChannelNames'] == [loaded['ChannelNames'][c] for c in channel_ids+[-1]]
+        assert group['SampleFreq'] == (sample_freq if subsample == -1 else sample_freq / subsample)
+
+        # Only the columns of the packets holding the group
+        rows = loaded['EEGData'][channel_ids+[-1]]
+        present = ~np.isnan(rows[0])
+        np.testing.assert_array_equal(group['EEGData'], rows[:, present])
+
+
+def test_channel_subset(study, loaded):
+    loader = XltekLoader(study[0], load_video=False)
+    groups = loader.load(channels=['C3', 22], multi_rate=True)['EEGGroups']
+    assert list(groups) == [-1, 4]
+    assert groups[4]['ChannelNames'] == [loaded['ChannelNames'][22], 'SampleStamp']
+
+
+def test_resample():
+    data = np.array([
+        [0., np.nan, 2., np.nan, 4.],
+        [10, 11, 12, 13, 14]
+    ])
+    stamps = [9, 10, 11, 12.4, 13.6, 15]
+    expected = {
+        'linear': [np.nan, 0., 1., 2.4, 3.6, np.nan],
+        'previous': [np.nan, 0., 0., 2., 2., np.nan],
+        'nearest': [np.nan, 0., 0., 2., 4., np.nan]
+    }
+    for method, values in expected.items():
+        out = resample(data, stamps, method)
+        np.testing.assert_allclose(out[0], values, rtol=1e-12)
+        np.testing.assert_array_equal(out[-1], stamps)
+    with pytest.raises(ValueError):
+        resample(data, stamps, 'cubic')
+
+
+def test_resample_groups(study, loaded):
+    groups = XltekLoader(study[0], load_video=False).load(multi_rate=True)['EEGGroups']
+    dense = resample_groups(groups, method='previous')
+    channel_ids = [c for subsample in groups for c in group_of(subsample)]
+    assert dense['ChannelNames'] == [loaded['ChannelNames'][c] for c in channel_ids+[-1]]
+    # At the stamps of the full rate packets by default
+    stamps = groups[-1]['EEGData'][-1]
+    np.testing.assert_array_equal(dense['EEGData'][-1], stamps)
+
+    # Equal to load() wherever the channel was stored
+    expected = loaded['EEGData'][channel_ids][:, np.isin(loaded['EEGData'][-1], stamps)]
+    stored = ~np.isnan(expected)
+    np.testing.assert_array_equal(dense['EEGData'][:-1][stored], expected[stored])
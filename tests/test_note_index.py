@@ -0,0 +1,58 @@
+import numpy as np
+from file_loader.utils.key_tree_parser import LazyKeyTree
+from file_loader.utils.note_index import NoteIndex
+from file_loader.utils.time_base import TimeBase
+from file_loader.xltek_loader import XltekLoader
+
+
+def note(stamp, text):
+    return {'Stamp': stamp, 'Comment': text}
+
+
+# Two notes at stamp 50, and entries that are not notes
+trees = [
+    note(50., 'b'), note(10., 'a'), 'not a note', {'Comment': 'no stamp'},
+    note(90., 'd'), note(50., 'c'), LazyKeyTree('(.(."Stamp", 70), (."Comment", "lazy"))')
+]
+
+
+def comments(pairs):
+    return [n['Comment'] for _, n in pairs]
+
+
+def test_duplicate_stamps():
+    index = NoteIndex(trees)
+    assert len(index) == 5
+    assert index.stamps.tolist() == [10, 50, 50, 70, 90]
+    # Both notes at 50 are kept, in file order
+    assert [n['Comment'] for n in index.at(50)] == ['b', 'c']
+    assert index.at(51) == []
+    # Only the last one in to_dict, like 'Notes' of load()
+    assert index.to_dict()[50]['Comment'] == 'c'
+
+
+def test_queries():
+    index = NoteIndex(trees)
+    assert comments(index.between(50, 70)) == ['b', 'c', 'lazy']
+    assert comments(index.between(91, 200)) == []
+    np.testing.assert_array_equal(index.count_between([0, 50, 60], [100, 50, 69]), [5, 2, 0])
+    assert comments(index.near(60, k=3)) == ['b', 'c', 'lazy']
+    assert comments(index.near(0)) == ['a']
+    assert comments(index.near(1000, k=10)) == ['d', 'lazy', 'b', 'c', 'a']
+    np.testing.assert_array_equal(
+        index.sample_index(np.array([0, 10, 49, 60, 80])), [1, 3, 3, 4, -1]
+    )
+
+
+def test_filetime():
+    index = NoteIndex(trees)
+    time_base = TimeBase([0, 100], [1000, 2000], 10.)
+    np.testing.assert_array_equal(index.filetime(time_base), [1100, 1500, 1500, 1700, 1900])
+
+
+def test_study_notes(study, loaded):
+    loader = XltekLoader(study[0], load_video=False)
+    index = loader.note_index()
+    assert index.to_dict() == loaded['Notes']
+    assert len(index) == sum(1 for _ in index)
+    assert list(index.stamps) == sorted(index.stamps)
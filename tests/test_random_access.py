@@ -0,0 +1,47 @@
+import numpy as np
+from file_loader.xltek_loader import XltekLoader
+
+
+def test_read_window(study, loaded):
+    path, segments, _ = study
+    loader = XltekLoader(path, load_video=False)
+    stamps = loaded['EEGData'][-1]
+
+    # Inside a file, across the gap between two files and past the end
+    windows = [
+        (100, 2000),
+        (segments[0][1] - 50, segments[1][0] + 50),
+        (segments[1][0] + 3, segments[2][1] + 1000),
+        (0, segments[-1][1] + 1)
+    ]
+    for start, end in windows:
+        keep = (stamps >= start) & (stamps < end)
+        ret = loader.read_window(start, end)
+        np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'][:, keep])
+
+        ret = loader.read_window(start, end, channels=['C4', 21])
+        channel_ids = loader.resolve_channels(['C4', 21])
+        np.testing.assert_array_equal(
+            ret['EEGData'], loaded['EEGData'][channel_ids+[-1]][:, keep]
+        )
+
+
+def test_checkpoints_after_reload(study, loaded):
+    path, segments, _ = study
+    loader = XltekLoader(path, load_video=False)
+    start, end = segments[1][0] + 2000, segments[1][0] + 2100
+    expected = loader.read_window(start, end)['EEGData']
+
+    # load() reads the .etc tables again, without checkpoints
+    loader.load()
+    cursors = []
+    iter_file_blocks = loader.iter_file_blocks
+
+    def record(*args, **kwargs):
+        cursors.append(kwargs.get('cursor'))
+        return iter_file_blocks(*args, **kwargs)
+
+    loader.iter_file_blocks = record
+    np.testing.assert_array_equal(loader.read_window(start, end)['EEGData'], expected)
+    assert cursors and cursors[0] is not None
+    assert loader.loaders_dict['etc_loader_1'].toc_index.has_checkpoint.any()
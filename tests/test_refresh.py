@@ -0,0 +1,79 @@
+import os
+import struct
+import numpy as np
+from file_loader.file_types.ent_file import ENTLoader
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.synthetic import generic_header, key_tree
+
+
+def write_prefix(path, recorded, progress):
+    # The study as it was on disk part way through the recording: the
+    # n-th .erd/.etc pair is written after the ones before it, and the
+    # .ent/.snc files grow all along. Cuts fall inside records.
+    names = sorted(recorded)
+    erd_names = [f for f in names if f.endswith('.erd')]
+    for f in names:
+        content = recorded[f]
+        if f.endswith('.erd') or f.endswith('.etc'):
+            done = progress - erd_names.index(f[:-4] + '.erd')
+            header_size = 8656 if f.endswith('.erd') else 352
+        elif f.endswith('.ent') or f.endswith('.snc'):
+            done = progress / len(erd_names)
+            header_size = 352
+        else:
+            done, header_size = 1, 0
+        if done <= 0:
+            continue
+        size = len(content) if done >= 1 else header_size + int((len(content) - header_size) * done)
+        with open(os.path.join(path, f), 'wb') as out:
+            out.write(content[:size])
+
+
+def test_refresh(study, loaded, tmp_path):
+    path = study[0]
+    recorded = dict()
+    for f in os.listdir(path):
+        with open(os.path.join(path, f), 'rb') as src:
+            recorded[f] = src.read()
+
+    live = str(tmp_path)
+    write_prefix(live, recorded, 0.1)
+    loader = XltekLoader(live, load_video=False)
+    parts, notes = [], dict()
+    for progress in [0.1, 0.45, 1.3, 1.31, 2.7, 3]:
+        write_prefix(live, recorded, progress)
+        ret = loader.refresh()
+        parts.append(ret['EEGData'])
+        notes.update(ret['Notes'])
+
+    np.testing.assert_array_equal(np.concatenate(parts, axis=1), loaded['EEGData'])
+    assert notes == loaded['Notes']
+
+    # The loader reads whole files again after a refresh
+    np.testing.assert_array_equal(loader.load()['EEGData'], loaded['EEGData'])
+    np.testing.assert_array_equal(loader.eeg['EEGData'], loaded['EEGData'])
+
+
+def test_cut_inside_text(tmp_path):
+    # The second note is cut inside the two bytes of 'é'
+    ent = generic_header(3)
+    for note_id, comment in enumerate(['first', 'Température']):
+        text = key_tree({'Stamp': 10 * note_id, 'Comment': comment}).encode() + b'\x00'
+        ent += struct.pack('=4i', 0, len(text) + 16, 0, note_id) + text
+    cut = ent.index('é'.encode()) + 1
+
+    path = str(tmp_path / 'Pat.ent')
+    with open(path, 'wb') as f:
+        f.write(ent[:cut])
+    live = ENTLoader(path)
+    live.complete_records = True
+    live.load()
+    assert live.data['note_packets']['id'] == [0]
+
+    # Read once the rest is written
+    with open(path, 'wb') as f:
+        f.write(ent)
+    assert live.load_tail()['note_packets']['id'] == [1]
+    full = ENTLoader(path)
+    full.load()
+    assert live.data['note_packets'] == full.data['note_packets']
@@ -0,0 +1,62 @@
+import os
+import shutil
+import pytest
+from file_loader.xltek_loader import XltekLoader, scan_headers
+from file_loader.utils.stats import LoadStats
+from conftest import STUDY
+
+
+def copy_study(study, tmp_path, suffixes):
+    # The files of the study with the given suffixes
+    path = str(tmp_path / 'study')
+    os.makedirs(path)
+    for f in os.listdir(study[0]):
+        if os.path.splitext(f)[1] in suffixes:
+            shutil.copy(os.path.join(study[0], f), path)
+    return path
+
+
+def test_summary(study, loaded, tmp_path):
+    path = copy_study(study, tmp_path, ['.eeg', '.erd', '.etc', '.stc'])
+    stats = LoadStats()
+    summary = XltekLoader(path, load_video=False, stats=stats).scan_headers()
+    assert summary['SampleFreq'] == 512.
+    assert summary['NumChannels'] == 32
+    assert summary['HeadboxType'] == 1
+    assert summary['NumFiles'] == 3
+    assert summary['Segments'] == [(start, end) for start, end in study[1]]
+    assert summary['NumSamples'] == loaded['EEGData'].shape[1]
+    assert summary['Duration'] == summary['NumSamples'] / 512.
+    assert summary['GenericHeader']['file_schema'] == 3
+
+    # Only the headers and the .stc file are read
+    read = sum(r['bytes'] for r in stats.records if r['stage'] == 'load')
+    assert read < 16 * 1024
+    assert scan_headers(path) == summary
+
+
+def test_no_segments(study, loaded, tmp_path):
+    # While recording, before the first segment is written
+    path = copy_study(study, tmp_path, ['.eeg', '.erd', '.etc', '.stc'])
+    stc = [f for f in os.listdir(path) if f.endswith('.stc')][0]
+    with open(os.path.join(path, stc), 'r+b') as f:
+        f.truncate(352 + 56)
+    summary = scan_headers(path)
+    assert summary['Segments'] == []
+    # Estimated from the span of the last .etc entry of each file
+    num_samples = loaded['EEGData'].shape[1]
+    assert abs(summary['NumSamples'] - num_samples) <= STUDY['toc_every'] * 3
+
+
+def test_missing(study, tmp_path):
+    path = copy_study(study, tmp_path, ['.eeg', '.etc', '.stc'])
+    with pytest.raises(FileNotFoundError):
+        scan_headers(path)
+
+
+def test_loaders_stay_unread(study):
+    loader = XltekLoader(study[0], load_video=False)
+    loader.scan_headers()
+    # Headers are read by separate loaders
+    unread = [f for name, f in loader.loaders_dict.items() if name != 'stc_loader']
+    assert not any(hasattr(f, 'data') for f in unread)
@@ -0,0 +1,56 @@
+import os
+import json
+import collections
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.stats import LoadStats, stage
+
+
+def test_stages(study, loaded, tmp_path):
+    progress = collections.defaultdict(list)
+    stats = LoadStats(progress=lambda f, done, total: progress[f].append((done, total)))
+    XltekLoader(study[0], load_video=False, stats=stats).load()
+    summary = stats.summary()
+    for name in ['scan_files', 'load', 'decode', 'validate', 'combine_files']:
+        assert summary[name]['count'] > 0
+
+    # Every packet decoded once, every byte read once
+    assert summary['decode']['count'] == 3
+    assert summary['decode']['packets'] == loaded['EEGData'].shape[1]
+    loads = {r['loader']: r['bytes'] for r in stats.records if r['stage'] == 'load'}
+    assert loads == {f: os.path.getsize(os.path.join(study[0], f)) for f in os.listdir(study[0])}
+
+    # Up to the whole .erd file
+    assert len(progress) == 3
+    for f, calls in progress.items():
+        done = [d for d, _ in calls]
+        assert done == sorted(done)
+        assert calls[-1][0] == calls[-1][1] == loads[f] - 8656
+
+    saved = json.loads(stats.to_json(str(tmp_path / 'stats.json')))
+    assert len(saved['records']) == len(stats.records)
+    with open(str(tmp_path / 'stats.json')) as f:
+        assert json.load(f) == saved
+
+
+def test_memory():
+    stats = LoadStats(track_memory=True)
+    with stats.stage('outer'):
+        with stats.stage('inner'):
+            block = bytearray(1 << 22)
+        del block
+    inner, outer = stats.records
+    assert inner['peak_bytes'] >= 1 << 22
+    assert outer['peak_bytes'] >= inner['peak_bytes']
+
+
+def test_workers(study, loaded):
+    # Records of the worker processes are merged
+    stats = LoadStats()
+    ret = XltekLoader(study[0], load_video=False, workers=2, stats=stats).load()
+    assert stats.summary()['decode']['packets'] == loaded['EEGData'].shape[1]
+    assert ret['EEGData'].shape == loaded['EEGData'].shape
+
+
+def test_no_stats():
+    with stage(None, 'load') as record:
+        record['bytes'] = 1
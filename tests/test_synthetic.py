@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.synthetic import write_study
+
+
+# Headbox types write_study supports, with their channel counts
+@pytest.mark.parametrize('headbox_type, num_channels', [
+    (1, 32), (3, 256), (4, 28), (5, 42), (6, 36), (14, 47), (15, 34),
+    (17, 45), (19, 32), (20, 276), (21, 256), (22, 43), (23, 39)
+])
+def test_headbox_types(tmp_path, headbox_type, num_channels):
+    path = str(tmp_path)
+    _, values = write_study(path, headbox_type=headbox_type, num_channels=num_channels,
+                            duration=2, num_files=1, num_videos=0, return_values=True)
+    loader = XltekLoader(path, load_video=False)
+    ret = loader.load()
+    erd_loader = loader.loaders_dict['erd_loader_0']
+    assert len(ret['ChannelNames']) == num_channels + 1
+    assert len(set(ret['ChannelNames'])) == num_channels + 1
+
+    # Back to file units with each channel's factor
+    discardbits = erd_loader.data['raw_data_file_header']['discardbits']
+    factors = erd_loader.channel_factors * (1 << discardbits)
+    np.testing.assert_allclose(
+        ret['EEGData'][:-1] / factors[:, None], values[0].T, rtol=0, atol=1e-6
+    )
+
+
+@pytest.mark.parametrize('headbox_type', [8, 9])
+def test_unsupported_headbox(tmp_path, headbox_type):
+    # Conversion factors, but no channel names
+    write_study(str(tmp_path), headbox_type=headbox_type, duration=1, num_videos=0)
+    with pytest.raises(ValueError):
+        XltekLoader(str(tmp_path), load_video=False).load()
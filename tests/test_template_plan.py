@@ -0,0 +1,107 @@
+import pickle
+import numpy as np
+import pytest
+from file_loader.xltek_loader import XltekLoader
+from file_loader.file_types.erd_file import ERDLoader
+from file_loader.utils.byte_buffer import ByteBuffer
+from file_loader.utils.misc import load_json
+from file_loader.utils.template_plan import (
+    templates, StructBlock, FixedRepeat, Repeat, TemplatePlan
+)
+
+
+def interpret(template, buf, data):
+    # Field by field reading of the data template, like before the plans
+    # were compiled. Stops at the first special field.
+    for key_outer, val_outer in template.items():
+        if 'requirements' in key_outer or 'read_checkpoint' in key_outer:
+            continue
+        if 'special' in key_outer:
+            return False
+        if 'repeat' in key_outer:
+            records = data[key_outer.split(':')[1]] = {key: [] for key in val_outer}
+            while not buf.isfinished():
+                for key, val in val_outer.items():
+                    num_read = val[1]
+                    if not isinstance(num_read, int):
+                        variables = {k: v[-1] for k, v in records.items() if k != key}
+                        num_read = eval(num_read, {}, variables)
+                    records[key].append(buf.read(val[0], num_read, *val[2:]))
+        elif isinstance(val_outer, dict):
+            data[key_outer] = {key: buf.read(*val) for key, val in val_outer.items()}
+        else:
+            data[key_outer] = buf.read(*val_outer)
+    return True
+
+
+def test_same_as_interpreted(study):
+    loader = XltekLoader(study[0], load_video=False)
+    for file_loader in loader.loaders_dict.values():
+        file_loader.load()
+        buf = ByteBuffer(file_loader.load_filename)
+        data = {}
+        if file_loader.generic_data_templates is not None:
+            interpret(load_json(templates.template_path('generic', 1)), buf, data)
+        interpret(load_json(file_loader.data_template_path), buf, data)
+        buf.close()
+
+        if isinstance(file_loader, ERDLoader):
+            # Only the first headbox is kept
+            header = data['raw_data_file_header']
+            header['headbox_type'] = header['headbox_type'][0]
+            header['headbox_sn'] = header['headbox_sn'][0]
+        assert data
+        for key, val in data.items():
+            assert file_loader.data[key] == val, (file_loader.load_filename, key)
+
+
+def test_header_only(study):
+    loader = XltekLoader(study[0], load_video=False)
+    for name, file_loader in loader.loaders_dict.items():
+        file_loader.load()
+        header_loader = loader.header_loader(name)
+        assert header_loader.data_end <= file_loader.data_end
+        for key, val in header_loader.data.items():
+            if key != 'data_packets':
+                assert file_loader.data[key] == val
+
+
+def test_steps():
+    # Fixed size records are read as one structured array, others field
+    # by field
+    etc_plan = templates.plan('etc', 3)
+    assert any(isinstance(step, FixedRepeat) for step in etc_plan.steps)
+    ent_plan = templates.plan('ent', 3)
+    assert any(isinstance(step, Repeat) for step in ent_plan.steps)
+
+    plan = TemplatePlan({
+        'head': {'a': ['i', 1], 'b': ['d', 2], 'name': ['string', 8]},
+        'read_checkpoint_1': 28,
+        'rest': {'text': ['key_tree', -1]}
+    })
+    assert [type(r) for r in plan.steps[0].readers] == [StructBlock]
+    assert plan.header_end() == 28
+    assert templates.plan('erd', 9) is templates.plan('erd', 9)
+
+
+def test_pickle():
+    # Sent to worker processes along with the loaders
+    plan = templates.plan('erd', 9)
+    copy = pickle.loads(pickle.dumps(plan))
+    assert [type(step) for step in copy.steps] == [type(step) for step in plan.steps]
+    assert copy.header_end() == plan.header_end()
+
+
+@pytest.mark.parametrize('complete', [True, False])
+def test_partial_record(tmp_path, complete):
+    plan = TemplatePlan({'repeat:rec': {'a': ['i', 1], 'b': ['q', 1]}})
+    path = str(tmp_path / 'records')
+    records = np.zeros(3, dtype=[('a', '<i4'), ('b', '<i8')])
+    records['a'] = [1, 2, 3]
+    with open(path, 'wb') as f:
+        f.write(records.tobytes()[:-5])
+    buf = ByteBuffer(path)
+    out = plan.read_records(buf, complete)['rec']
+    assert out['a'] == [1, 2]
+    assert buf.cursor == 24
+    buf.close()
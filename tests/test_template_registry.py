@@ -0,0 +1,52 @@
+import os
+import json
+import numpy as np
+from file_loader.xltek_loader import XltekLoader
+from file_loader.utils.template_plan import TemplateRegistry, TEMPLATE_DIR, templates
+
+
+def test_compiled_once():
+    registry = TemplateRegistry()
+    assert registry.plan('erd', 9) is registry.plan('erd', 9)
+    assert registry.table('erd', 9) is registry.table('erd', 9)
+    assert registry.load_plan(registry.template_path('erd', 9)) is registry.plan('erd', 9)
+    assert registry.template_path('generic', 1) == os.path.join(
+        TEMPLATE_DIR, 'generic_header_data_template_schema_1.json'
+    )
+
+
+def test_warm():
+    registry = TemplateRegistry().warm()
+    num_templates = num_tables = 0
+    for _, _, file_names in os.walk(TEMPLATE_DIR):
+        num_tables += file_names.count('conversion.json')
+        num_templates += sum(f.endswith('.json') and f != 'conversion.json' for f in file_names)
+    assert len(registry.plans) == num_templates
+    assert len(registry.tables) == num_tables
+
+
+def test_template_dir(tmp_path):
+    # Another template directory, e.g. with a new file schema
+    template_dir = str(tmp_path / 'templates')
+    os.makedirs(os.path.join(template_dir, 'xyz'))
+    with open(os.path.join(template_dir, 'xyz', 'data_template.json'), 'w') as f:
+        json.dump({'head': {'a': ['i', 1]}}, f)
+    registry = TemplateRegistry(template_dir)
+    assert registry.plan('xyz').header_end() == 4
+    assert not registry.plans.keys() & templates.plans.keys()
+
+
+def test_any_working_directory(study, loaded, tmp_path, monkeypatch):
+    # Templates are found next to the package
+    monkeypatch.chdir(str(tmp_path))
+    ret = XltekLoader(study[0], load_video=False).load()
+    np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'])
+    assert os.path.isabs(TEMPLATE_DIR)
+
+
+def test_shared_by_loaders(study):
+    # Loaders of different studies use the same compiled plans
+    first = XltekLoader(study[0], load_video=False)
+    second = XltekLoader(study[0], load_video=False)
+    assert first.loaders_dict['erd_loader_0'].generic_data_templates \
+        is second.loaders_dict['erd_loader_1'].generic_data_templates
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from file_loader.utils.time_base import TimeBase
+from file_loader.utils.synthetic import START_FILETIME
+from file_loader.xltek_loader import XltekLoader
+
+T = START_FILETIME
+RATE = 10 ** 4  # FILETIME units per sample at 1000 Hz
+
+
+def test_linear():
+    time_base = TimeBase([0, 1000, 2000], [T, T + 1000*RATE, T + 2000*RATE])
+    assert time_base.nominal_rate == RATE
+    stamps = np.array([-5, 0, 1, 999, 1500, 2500])
+    filetimes = time_base.stamp_to_filetime(stamps)
+    assert filetimes.dtype == np.int64
+    np.testing.assert_array_equal(filetimes, T + stamps * RATE)
+    np.testing.assert_array_equal(time_base.filetime_to_stamp(filetimes), stamps)
+
+
+def test_gap():
+    # Paused for 3 seconds after stamp 1999
+    time_base = TimeBase(
+        [0, 1000, 2000, 3000], [T, T + 1000*RATE, T + 5000*RATE, T + 6000*RATE], 1000.
+    )
+    assert time_base.gaps.tolist() == [1]
+    assert time_base.gap_list() == [(2000, T + 2000*RATE, T + 5000*RATE)]
+
+    # The samples before the gap keep the nominal rate
+    np.testing.assert_array_equal(
+        time_base.stamp_to_filetime([1500, 1999, 2000, 2500]),
+        [T + 1500*RATE, T + 1999*RATE, T + 5000*RATE, T + 5500*RATE]
+    )
+    # Times inside the gap map to the stamp the recording goes on with
+    np.testing.assert_array_equal(
+        time_base.filetime_to_stamp([T + 1999*RATE, T + 3000*RATE, T + 5500*RATE]),
+        [1999, 2000, 2500]
+    )
+
+
+def test_reset():
+    # The clock goes back by 10 seconds at stamp 2000
+    time_base = TimeBase(
+        [0, 1000, 2000, 3000], [T, T + 1000*RATE, T - 8000*RATE, T - 7000*RATE], 1000.
+    )
+    assert time_base.resets.tolist() == [1]
+    assert len(time_base.runs) == 2
+    np.testing.assert_array_equal(
+        time_base.stamp_to_filetime([500, 1500, 2500]),
+        [T + 500*RATE, T + 1500*RATE, T - 7500*RATE]
+    )
+    np.testing.assert_array_equal(
+        time_base.filetime_to_stamp([T + 500*RATE, T - 7500*RATE]), [500, 2500]
+    )
+
+
+def test_median_rate():
+    # Without sample_freq, the nominal rate is the median of the steps
+    time_base = TimeBase(
+        [0, 100, 200, 300, 400], [T, T + 100*RATE, T + 200*RATE, T + 900*RATE, T + 1000*RATE]
+    )
+    assert time_base.nominal_rate == RATE
+    assert time_base.gaps.tolist() == [2]
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        TimeBase([0], [T])
+    with pytest.raises(ValueError):
+        TimeBase([0, 0], [T, T])
+
+
+def test_study(study, loaded):
+    loader = XltekLoader(study[0], load_video=False)
+    filetime, samplestamp = loaded['FiletimeStampConversion']
+    # Exact at the mappings
+    np.testing.assert_array_equal(loader.timebase.stamp_to_filetime(samplestamp), filetime)
+    np.testing.assert_allclose(loader.timebase.filetime_to_stamp(filetime), samplestamp)
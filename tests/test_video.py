@@ -0,0 +1,24 @@
+import os
+import shutil
+import numpy as np
+from file_loader.xltek_loader import XltekLoader
+
+
+def test_no_vtc(study, loaded, tmp_path):
+    # A study recorded without video
+    path = str(tmp_path / 'study')
+    shutil.copytree(study[0], path)
+    for f in os.listdir(path):
+        if f.endswith('.vtc'):
+            os.remove(os.path.join(path, f))
+
+    loader = XltekLoader(path)
+    ret = loader.load()
+    np.testing.assert_array_equal(ret['EEGData'], loaded['EEGData'])
+    assert ret['FrameAndFiletime'][0] == []
+    assert len(ret['FrameAndFiletime'][1]) == 0
+    assert len(loader.video_frames()) == 0
+
+    loader = XltekLoader(path)
+    loader.export(str(tmp_path / 'study.zarr'), chunk_samples=4096)
+    assert os.path.isdir(str(tmp_path / 'study.zarr'))